@@ -1,6 +1,10 @@
 # app.py — Belle Flora SEO Optimizer (sessie-creds + CSRF + producten per collectie selecteren + bundels + garden hints + heroicons)
-import os, re, json, time, html, secrets
-from typing import Any, Dict, List, Optional, Tuple
+import os, re, sys, json, time, html, gzip, secrets, random, threading, tempfile, sqlite3, difflib, hmac, hashlib, base64, itertools, bisect, zlib
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 from functools import wraps
 
 import requests
@@ -24,14 +28,31 @@ ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "michiel")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "CHANGE_ME")
 
 SHOPIFY_STORE_DOMAIN = os.environ.get("SHOPIFY_STORE_DOMAIN", "your-store.myshopify.com").strip()
+SHOPIFY_SCHEME       = os.environ.get("SHOPIFY_SCHEME", "https").strip()   # "http" enkel voor lokale stand-ins (bench/)
 
 OPENAI_API_KEY   = os.environ.get("OPENAI_API_KEY", "").strip()
+OPENAI_BASE_URL  = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
 OPENAI_MODEL     = os.environ.get("DEFAULT_MODEL", "gpt-4o-mini")
 OPENAI_TEMP      = float(os.environ.get("DEFAULT_TEMPERATURE", "0.7"))
 OPENAI_RETRIES   = int(os.environ.get("OPENAI_MAX_RETRIES", "4"))
+OPENAI_TIMEOUT   = float(os.environ.get("OPENAI_HTTP_TIMEOUT", "120"))
+OPENAI_DEADLINE  = float(os.environ.get("OPENAI_DEADLINE", "180"))
+OPENAI_BACKOFF   = float(os.environ.get("OPENAI_BACKOFF_BASE", "2"))
+OPENAI_HEDGE     = os.environ.get("OPENAI_HEDGE", "false").lower() in ("1","true","yes")
+OPENAI_HEDGE_MIN_SAMPLES = int(os.environ.get("OPENAI_HEDGE_MIN_SAMPLES", "20"))
+OPENAI_HEDGE_FLOOR       = float(os.environ.get("OPENAI_HEDGE_FLOOR", "3"))
+OPENAI_PRICE_PROMPT      = float(os.environ.get("OPENAI_PRICE_PROMPT_EUR", "0.14"))      # € per 1M prompt-tokens
+OPENAI_PRICE_COMPLETION  = float(os.environ.get("OPENAI_PRICE_COMPLETION_EUR", "0.55"))  # € per 1M completion-tokens
+OPENAI_FAST_MODEL        = os.environ.get("FAST_MODEL", "").strip()   # leeg = geen routing, alles via DEFAULT_MODEL
+OPENAI_FAST_TEMP         = float(os.environ.get("FAST_TEMPERATURE", "0.4"))
+OPENAI_FAST_PRICE_PROMPT     = float(os.environ.get("FAST_PRICE_PROMPT_EUR", "0.05"))
+OPENAI_FAST_PRICE_COMPLETION = float(os.environ.get("FAST_PRICE_COMPLETION_EUR", "0.37"))
+ROUTE_FAST_MAX_SCORE     = int(os.environ.get("ROUTE_FAST_MAX_SCORE", "1"))   # complexiteit ≤ dit → snel model
+RUN_BUDGET_EUR           = float(os.environ.get("RUN_BUDGET_EUR", "0"))                  # 0 = geen limiet
 
 DELAY_PER_PRODUCT  = float(os.environ.get("DELAY_SECONDS", "0.8"))
 SHOPIFY_RETRIES    = int(os.environ.get("SHOPIFY_MAX_RETRIES", "4"))
+SHOPIFY_BACKOFF    = float(os.environ.get("SHOPIFY_BACKOFF_BASE", "2"))
 REQUEST_TIMEOUT    = int(os.environ.get("REQUEST_TIMEOUT", "60"))
 
 BRAND_NAME       = os.environ.get("BRAND_NAME", "Belle Flora").strip()
@@ -66,11 +87,66 @@ META_HEIGHT_HINTS = [s for s in os.environ.get("META_HEIGHT_KEYS_HINT", "hoogte,
 META_DIAM_HINTS   = [s for s in os.environ.get("META_DIAM_KEYS_HINT", "diameter,pot,ø,⌀").split(",") if s.strip()]
 META_MIRROR_MAX_HEIGHT = int(os.environ.get("META_MIRROR_MAX_HEIGHT", "2"))
 META_MIRROR_MAX_DIAM   = int(os.environ.get("META_MIRROR_MAX_DIAM", "1"))
+META_DEFS_TTL          = int(os.environ.get("META_DEFS_TTL", "900"))   # definities opnieuw ophalen (schrijfplan-validatie)
 
 HEROICON_SIZE = int(os.environ.get("HEROICON_SIZE", "20"))
 
+FAMILY_DEDUP = os.environ.get("FAMILY_DEDUP", "true").lower() in ("1","true","yes")
+DUP_DETECT      = os.environ.get("DUP_DETECT", "true").lower() in ("1","true","yes")
+DUP_THRESHOLD   = float(os.environ.get("DUP_THRESHOLD", "0.8"))   # geschatte Jaccard-gelijkenis (woord-3-grams)
+GENERATION_MODE = os.environ.get("GENERATION_MODE", "full").lower()   # full | auto (metas-only als titel+tekst al goed zijn) | metas
+
+DATA_DIR         = os.environ.get("DATA_DIR", os.path.join(tempfile.gettempdir(), "seo-optimizer"))
+APPLY_BATCH_SIZE = int(os.environ.get("APPLY_BATCH_SIZE", "10"))
+BACKFILL_PAGE    = int(os.environ.get("BACKFILL_PAGE", "100"))   # producten per pagina (≤ 250, REST ids-filter)
+ROLLBACK_CONCURRENCY = int(os.environ.get("ROLLBACK_CONCURRENCY", "4"))   # gelijktijdige batches bij terugdraaien
+
+SHOPIFY_WEBHOOK_SECRET   = os.environ.get("SHOPIFY_WEBHOOK_SECRET", "").strip()
+WEBHOOK_DEBOUNCE_SECONDS = float(os.environ.get("WEBHOOK_DEBOUNCE_SECONDS", "120"))
+WEBHOOK_POLL_SECONDS     = float(os.environ.get("WEBHOOK_POLL_SECONDS", "15"))
+WEBHOOK_LEASE_SECONDS    = float(os.environ.get("WEBHOOK_LEASE_SECONDS", "600"))
+WEBHOOK_MAX_ATTEMPTS     = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "5"))
+
+SCHED_MAX_INFLIGHT        = int(os.environ.get("SCHED_MAX_INFLIGHT", "8"))
+# lager dan het aantal gelijktijdige runs/threads (--threads 4 in de Procfile), anders wacht er nooit een job
+# op een slot en heeft de eerlijke verdeling niets te verdelen
+SCHED_PRODUCT_SLOTS       = int(os.environ.get("SCHED_PRODUCT_SLOTS", "2"))
+SHOPIFY_STORE_CONCURRENCY = int(os.environ.get("SHOPIFY_STORE_CONCURRENCY", "2"))
+OPENAI_KEY_CONCURRENCY    = int(os.environ.get("OPENAI_KEY_CONCURRENCY", "4"))
+
+METRICS_DIR           = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "seo-metrics"))
+METRICS_TOKEN         = os.environ.get("METRICS_TOKEN", "").strip()
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+PROFILER_ENABLED     = os.environ.get("PROFILER_ENABLED", "false").lower() in ("1","true","yes")
+PROFILE_DIR          = os.environ.get("PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+PROFILE_INTERVAL     = float(os.environ.get("PROFILE_INTERVAL", "0.01"))    # s tussen samples
+PROFILE_MAX_SECONDS  = float(os.environ.get("PROFILE_MAX_SECONDS", "600"))
+
+TITLE_INDEX_TTL = int(os.environ.get("TITLE_INDEX_TTL", "300"))
+TITLE_INDEX_MAX = int(os.environ.get("TITLE_INDEX_MAX", "32"))   # elke collectieselectie is een eigen index
+WARM_START      = os.environ.get("WARM_START", "false").lower() in ("1","true","yes")   # caches vullen bij import (zie _warm_start)
+PICKER_PAGE_MAX = 200
+
+BREAKER_THRESHOLD    = int(os.environ.get("BREAKER_THRESHOLD", "5"))         # opeenvolgende fouten → open
+BREAKER_COOLDOWN     = float(os.environ.get("BREAKER_COOLDOWN", "30"))      # verdubbelt per mislukte probe
+BREAKER_COOLDOWN_MAX = float(os.environ.get("BREAKER_COOLDOWN_MAX", "300"))
+BREAKER_MAX_WAIT     = float(os.environ.get("BREAKER_MAX_WAIT", "900"))     # zo lang wacht een call op een open breaker
+RETRY_BUDGET_RATIO   = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2"))   # retries per geslaagde call (per upstream)
+RETRY_BUDGET_BURST   = 10.0
+BACKOFF_CAP          = 60.0
+
+JOB_EVENT_BUFFER      = int(os.environ.get("JOB_EVENT_BUFFER", "1000"))      # events per job in geheugen (backpressure-venster)
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_ORPHAN_SECONDS    = float(os.environ.get("JOB_ORPHAN_SECONDS", "600"))   # zonder lezer zo lang → job stopt
+JOB_METRICS_SECONDS   = float(os.environ.get("JOB_METRICS_SECONDS", "5"))
+JOB_RETENTION_SECONDS = 86400
+
 REQ = requests.Session()
 _META_MAP_CACHE: Dict[str, Dict[str, Any]] = {}
+_TITLE_INDEX_CACHE: "OrderedDict[Tuple[str, Tuple[str, ...]], Dict[str, Any]]" = OrderedDict()   # LRU
+_TITLE_INDEX_LOCK = threading.Lock()
+_COLLECTIONS_CACHE: Dict[Tuple[str, str], Dict[str, Any]] = {}
 
 # =========================
 # CSRF
@@ -92,6 +168,557 @@ def require_csrf(fn):
         return fn(*a, **kw)
     return wrapper
 
+# =========================
+# Metrics (Prometheus-tekstformaat, gedeeld over gunicorn-workers via METRICS_DIR)
+# =========================
+
+HIST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+GAUGE_STALE_SECONDS = 300
+WORKER_FILE_MAX_AGE = 24 * 3600   # vangnet voor bestanden van een ander host/container of een hergebruikte pid
+
+_METRICS_LOCK = threading.Lock()
+_METRICS: Dict[str, Dict[str, Any]] = {"counters": {}, "hist": {}, "gauges": {}}
+_RECENT_PRODUCTS: deque = deque(maxlen=5000)
+_METRICS_FLUSHED_AT = 0.0
+
+def _labels(**labels: Any) -> str:
+    return ",".join(f'{k}="{_s(v)}"' for k, v in sorted(labels.items()))
+
+def _metrics_flush(force: bool = False) -> None:
+    """Schrijf de snapshot van deze worker weg zodat /metrics in elke worker alles ziet."""
+    global _METRICS_FLUSHED_AT
+    now = time.time()
+    if not force and now - _METRICS_FLUSHED_AT < METRICS_FLUSH_SECONDS: return
+    _METRICS_FLUSHED_AT = now
+    with _METRICS_LOCK:
+        snap = json.dumps({**_METRICS, "recent_products": [t for t in _RECENT_PRODUCTS if t > now - 60]})
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f: f.write(snap)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def _worker_file_stale(path: str, now: float) -> bool:
+    """Snapshot van een proces dat niet meer bestaat (herstarte worker, batch-/bench-pool)."""
+    try:
+        pid = int(os.path.basename(path)[len("worker-"):-len(".json")])
+        if now - os.path.getmtime(path) > WORKER_FILE_MAX_AGE: return True
+        if pid == os.getpid(): return False
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, OSError):   # PermissionError: bestaat, maar van een andere gebruiker
+        return False
+    return False
+
+def _metric_inc(name: str, value: float = 1, **labels: Any) -> None:
+    with _METRICS_LOCK:
+        series = _METRICS["counters"].setdefault(name, {})
+        key = _labels(**labels)
+        series[key] = series.get(key, 0) + value
+    _metrics_flush()
+
+def _metric_set(name: str, value: float, **labels: Any) -> None:
+    with _METRICS_LOCK:
+        _METRICS["gauges"].setdefault(name, {})[_labels(**labels)] = value
+    _metrics_flush()
+
+def _metric_observe(name: str, seconds: float, **labels: Any) -> None:
+    with _METRICS_LOCK:
+        h = _METRICS["hist"].setdefault(name, {}).setdefault(
+            _labels(**labels), {"buckets": [0] * len(HIST_BUCKETS), "sum": 0.0, "count": 0})
+        for i, b in enumerate(HIST_BUCKETS):
+            if seconds <= b: h["buckets"][i] += 1
+        h["sum"] += seconds; h["count"] += 1
+    _metrics_flush()
+
+def _product_done(result: str) -> None:
+    _metric_inc("seo_products_total", result=result)
+    if result == "updated":
+        with _METRICS_LOCK: _RECENT_PRODUCTS.append(time.time())
+
+_STAGES = threading.local()   # .acc = {stage: [wall, cpu, n]} van de run in deze thread (zie _stage_summary)
+
+@contextmanager
+def _timed(stage: str):
+    """Histogram krijgt de volledige duur; de run-samenvatting (_STAGES.acc) enkel de eigen tijd,
+    zonder geneste stages (bv. shopify_post binnen update_product_texts), zodat niets dubbel telt."""
+    stack = getattr(_STAGES, "stack", None)
+    if stack is None: stack = _STAGES.stack = []
+    stack.append([0.0, 0.0])
+    t0, c0 = time.monotonic(), time.thread_time()
+    try:
+        yield
+    except Exception:
+        _metric_inc("seo_stage_errors_total", stage=stage)
+        raise
+    finally:
+        wall, cpu = time.monotonic() - t0, time.thread_time() - c0
+        child_wall, child_cpu = stack.pop()
+        if stack: stack[-1][0] += wall; stack[-1][1] += cpu
+        _metric_observe("seo_stage_seconds", wall, stage=stage)
+        acc = getattr(_STAGES, "acc", None)
+        if acc is not None:
+            a = acc.setdefault(stage, [0.0, 0.0, 0])
+            a[0] += wall - child_wall; a[1] += cpu - child_cpu; a[2] += 1
+
+def _stage_summary(acc: Dict[str, List[float]], top: int = 6) -> str:
+    """'stage wall/cpu' (eigen tijd) voor de duurste stages; veel wall en weinig cpu = wachten op netwerk."""
+    rows = sorted(acc.items(), key=lambda kv: -kv[1][0])[:top]
+    return " · ".join(f"{k} {w:.2f}s/{c:.2f}s cpu (n={n})" for k, (w, c, n) in rows) or "geen metingen"
+
+class _SamplingProfiler:
+    """Sampelt de stack van één thread via sys._current_frames() en schrijft collapsed stacks
+    (`frame;frame;frame count`, voor flamegraph.pl of speedscope) naar PROFILE_DIR.
+    Stopt bij stop(), na max_seconds of wanneer de thread eindigt."""
+
+    def __init__(self, ident: int, name: str, max_seconds: float = PROFILE_MAX_SECONDS) -> None:
+        self.ident, self.name = ident, name
+        self.path = os.path.join(PROFILE_DIR, f"{name}.folded")
+        self.deadline = time.monotonic() + min(max_seconds, PROFILE_MAX_SECONDS)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{name}", daemon=True)
+
+    def start(self) -> "_SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(PROFILE_INTERVAL) and time.monotonic() < self.deadline:
+            frame = sys._current_frames().get(self.ident)
+            if frame is None: break
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(f"{k} {v}\n" for k, v in self.stacks.most_common())
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join(timeout=10)
+        return self.path
+
+def _instrumented(stage: str):
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*a, **kw):
+            with _timed(stage):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+def _metrics_render() -> str:
+    with _METRICS_LOCK: _METRICS["gauges"].pop("seo_scheduler_queue_depth", None)
+    for store, s in SCHED.snapshot().items():
+        _metric_set("seo_scheduler_queue_depth", s["remaining_products"] + s["waiting"], store=store)
+    _metrics_flush(force=True)
+    now = time.time()
+    counters: Dict[str, Dict[str, float]] = {}
+    gauges: Dict[str, Dict[str, float]] = {}
+    hists: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    recent = 0
+    try: files = [os.path.join(METRICS_DIR, f) for f in os.listdir(METRICS_DIR)
+                  if f.startswith("worker-") and f.endswith(".json")]
+    except OSError: files = []
+    for path in files:
+        if _worker_file_stale(path, now):
+            try: os.remove(path)
+            except OSError: pass
+            continue
+        try:
+            with open(path) as f: snap = json.load(f)
+            fresh = now - os.path.getmtime(path) < GAUGE_STALE_SECONDS
+        except (OSError, ValueError):
+            continue
+        for name, series in snap.get("counters", {}).items():
+            for k, v in series.items():
+                counters.setdefault(name, {})[k] = counters.get(name, {}).get(k, 0) + v
+        for name, series in (snap.get("gauges", {}).items() if fresh else []):
+            for k, v in series.items():
+                gauges.setdefault(name, {})[k] = gauges.get(name, {}).get(k, 0) + v
+        for name, series in snap.get("hist", {}).items():
+            for k, h in series.items():
+                agg = hists.setdefault(name, {}).setdefault(k, {"buckets": [0] * len(HIST_BUCKETS), "sum": 0.0, "count": 0})
+                agg["buckets"] = [a + b for a, b in zip(agg["buckets"], h.get("buckets", []))]
+                agg["sum"] += h.get("sum", 0.0); agg["count"] += h.get("count", 0)
+        recent += sum(1 for t in snap.get("recent_products", []) if t > now - 60)
+    gauges.setdefault("seo_products_per_minute", {})[""] = recent
+
+    def sel(k: str, extra: str = "") -> str:
+        inner = ",".join(x for x in (k, extra) if x)
+        return "{" + inner + "}" if inner else ""
+    lines: List[str] = []
+    for name, series in sorted(counters.items()):
+        lines.append(f"# TYPE {name} counter")
+        lines += [f"{name}{sel(k)} {v:g}" for k, v in sorted(series.items())]
+    for name, series in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines += [f"{name}{sel(k)} {v:g}" for k, v in sorted(series.items())]
+    for name, series in sorted(hists.items()):
+        lines.append(f"# TYPE {name} histogram")
+        for k, h in sorted(series.items()):
+            for b, c in zip(HIST_BUCKETS, h["buckets"]):
+                lines.append(f"{name}_bucket{sel(k, _labels(le=f'{b:g}'))} {c}")
+            lines.append(f"{name}_bucket{sel(k, _labels(le='+Inf'))} {h['count']}")
+            lines.append(f"{name}_sum{sel(k)} {h['sum']:.6f}")
+            lines.append(f"{name}_count{sel(k)} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+# =========================
+# Lokale opslag (SQLite in DATA_DIR; gedeeld door alle workers)
+# =========================
+
+_DB_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS previews (
+        run_id TEXT NOT NULL, product_id INTEGER NOT NULL, store TEXT NOT NULL, created REAL NOT NULL,
+        before TEXT NOT NULL, after TEXT NOT NULL, applied REAL,
+        PRIMARY KEY (run_id, product_id))""",
+    """CREATE TABLE IF NOT EXISTS written (
+        store TEXT NOT NULL, product_id INTEGER NOT NULL, content_hash TEXT NOT NULL, title TEXT NOT NULL, at REAL NOT NULL,
+        PRIMARY KEY (store, product_id))""",
+    """CREATE TABLE IF NOT EXISTS webhook_queue (
+        store TEXT NOT NULL, product_id INTEGER NOT NULL, due REAL NOT NULL, received REAL NOT NULL, events INTEGER NOT NULL,
+        claimed_until REAL, attempts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (store, product_id))""",
+    """CREATE TABLE IF NOT EXISTS backfill_runs (
+        run_id TEXT PRIMARY KEY, store TEXT NOT NULL, pids TEXT NOT NULL, cursor INTEGER NOT NULL, written INTEGER NOT NULL,
+        created REAL NOT NULL, updated REAL NOT NULL, finished REAL)""",
+    """CREATE TABLE IF NOT EXISTS snapshots (
+        run_id TEXT NOT NULL, product_id INTEGER NOT NULL, store TEXT NOT NULL, at REAL NOT NULL, before BLOB NOT NULL,
+        PRIMARY KEY (run_id, product_id))""",
+    """CREATE TABLE IF NOT EXISTS rollback_runs (
+        rollback_id TEXT PRIMARY KEY, run_id TEXT NOT NULL, store TEXT NOT NULL, pids TEXT NOT NULL, cursor INTEGER NOT NULL,
+        restored INTEGER NOT NULL, failed INTEGER NOT NULL, created REAL NOT NULL, updated REAL NOT NULL, finished REAL)""",
+    """CREATE TABLE IF NOT EXISTS dup_signatures (
+        store TEXT NOT NULL, field TEXT NOT NULL, product_id INTEGER NOT NULL, sig BLOB NOT NULL, family TEXT NOT NULL,
+        updated REAL NOT NULL, PRIMARY KEY (store, field, product_id))""",
+    """CREATE TABLE IF NOT EXISTS dup_bands (
+        store TEXT NOT NULL, field TEXT NOT NULL, bk TEXT NOT NULL, product_id INTEGER NOT NULL,
+        PRIMARY KEY (store, field, bk, product_id))""",
+    # per product vervangen (_dup_record) moet via een index gaan, anders scant elke delete de hele store
+    "CREATE INDEX IF NOT EXISTS dup_bands_pid ON dup_bands (store, product_id)",
+    "CREATE INDEX IF NOT EXISTS dup_signatures_pid ON dup_signatures (store, product_id)",
+    """CREATE TABLE IF NOT EXISTS dup_flags (
+        store TEXT NOT NULL, product_id INTEGER NOT NULL, field TEXT NOT NULL, other_id INTEGER NOT NULL,
+        similarity REAL NOT NULL, flagged REAL NOT NULL, PRIMARY KEY (store, product_id, field))""",
+    "CREATE INDEX IF NOT EXISTS dup_flags_other ON dup_flags (store, other_id)",
+    """CREATE TABLE IF NOT EXISTS openai_usage (
+        at REAL NOT NULL, run_id TEXT NOT NULL, store TEXT NOT NULL, model TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, cost_eur REAL NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS openai_usage_run ON openai_usage (run_id)",
+    """CREATE TABLE IF NOT EXISTS route_log (
+        at REAL NOT NULL, run_id TEXT NOT NULL, store TEXT NOT NULL, product_id INTEGER NOT NULL, route TEXT NOT NULL,
+        model TEXT NOT NULL, score INTEGER NOT NULL, reasons TEXT NOT NULL, seconds REAL NOT NULL, escalated INTEGER NOT NULL)""",
+    "CREATE INDEX IF NOT EXISTS route_log_run ON route_log (run_id)",
+    """CREATE TABLE IF NOT EXISTS run_budgets (
+        run_id TEXT PRIMARY KEY, budget_eur REAL NOT NULL, action TEXT NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS metafield_plans (
+        store TEXT NOT NULL, label TEXT NOT NULL, defs_sig TEXT NOT NULL, winner TEXT, failed TEXT NOT NULL, updated REAL NOT NULL,
+        PRIMARY KEY (store, label))""",
+    """CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, store TEXT NOT NULL, created REAL NOT NULL,
+        finished REAL, cancel INTEGER NOT NULL DEFAULT 0)""",
+    """CREATE TABLE IF NOT EXISTS job_events (
+        job_id TEXT NOT NULL, seq INTEGER NOT NULL, ev TEXT NOT NULL,
+        PRIMARY KEY (job_id, seq))""",
+]
+_DB_LOCAL = threading.local()
+
+# kolommen die later bijkwamen: bestaande databases krijgen ze via ALTER TABLE
+_DB_COLUMNS = [
+    ("webhook_queue", "claimed_until", "REAL"),
+    ("webhook_queue", "attempts", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+def _db() -> sqlite3.Connection:
+    conn = getattr(_DB_LOCAL, "conn", None)
+    if conn is None:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(DATA_DIR, "store.sqlite3"), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        for stmt in _DB_SCHEMA: conn.execute(stmt)
+        for table, col, decl in _DB_COLUMNS:
+            if col not in {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+        _DB_LOCAL.conn = conn
+    return conn
+
+def _new_run_id() -> str:
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + secrets.token_hex(3)
+
+# =========================
+# Scheduler: eerlijke verdeling over stores/jobs + budget per store en per API-key
+# =========================
+
+class _FairScheduler:
+    """Weighted round-robin over jobs (per product) en begrensde upstream-calls.
+
+    - "product"-slots: globaal SCHED_PRODUCT_SLOTS; de job met de laagste virtuele tijd
+      (verwerkte producten / gewicht) gaat voor, zodat een grote run een kleine niet verdringt.
+    - "shopify"/<store> en "openai"/<key>: in-flight budget per store resp. API-key,
+      plus een globaal plafond SCHED_MAX_INFLIGHT over alle upstream-calls.
+    Geldt per worker-proces.
+    """
+
+    def __init__(self) -> None:
+        self.cv = threading.Condition()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.inflight: Counter = Counter()
+        self.inflight_upstream = 0
+        self.waiters: List[list] = []
+        self._seq = itertools.count()
+        self._local = threading.local()
+
+    def _limit(self, kind: str) -> int:
+        return {"product": SCHED_PRODUCT_SLOTS, "shopify": SHOPIFY_STORE_CONCURRENCY,
+                "openai": OPENAI_KEY_CONCURRENCY}.get(kind, SCHED_MAX_INFLIGHT)
+
+    @contextmanager
+    def job(self, store: str, weight: float = 1.0):
+        job_id = secrets.token_hex(4)
+        with self.cv:
+            start_v = min((j["vtime"] for j in self.jobs.values()), default=0.0)
+            self.jobs[job_id] = {"store": store, "weight": max(0.1, float(weight or 1)), "vtime": start_v,
+                                 "served": 0, "remaining": 0, "started": time.time()}
+        prev = getattr(self._local, "job", None)
+        self._local.job = job_id
+        try:
+            yield job_id
+        finally:
+            self._local.job = prev
+            with self.cv:
+                self.jobs.pop(job_id, None)
+                self.cv.notify_all()
+
+    @contextmanager
+    def bind(self, job_id: Optional[str]):
+        """Slots uit een andere thread (bv. een ThreadPoolExecutor) laten meetellen voor job_id."""
+        prev = getattr(self._local, "job", None)
+        self._local.job = job_id
+        try:
+            yield job_id
+        finally:
+            self._local.job = prev
+
+    def progress(self, job_id: str, remaining: int) -> None:
+        with self.cv:
+            if job_id in self.jobs: self.jobs[job_id]["remaining"] = max(0, int(remaining))
+
+    def _runnable(self, w: list) -> bool:
+        kind, key = w[2], w[3]
+        if self.inflight[(kind, key)] >= self._limit(kind): return False
+        return kind == "product" or self.inflight_upstream < SCHED_MAX_INFLIGHT
+
+    def _may_go(self, entry: list) -> bool:
+        if not self._runnable(entry): return False
+        upstream = entry[2] != "product"
+        for w in self.waiters:
+            if w is entry or (w[2] != "product") != upstream: continue
+            if (w[0], w[1]) < (entry[0], entry[1]) and self._runnable(w):
+                if upstream or w[3] == entry[3]: return False
+        return True
+
+    @contextmanager
+    def slot(self, kind: str, key: str):
+        job_id = getattr(self._local, "job", None)
+        with self.cv:
+            job = self.jobs.get(job_id) if job_id else None
+            entry = [job["vtime"] if job else 0.0, next(self._seq), kind, key, job_id]
+            self.waiters.append(entry)
+            try:
+                while not self._may_go(entry):
+                    self.cv.wait(timeout=1.0)
+            finally:
+                self.waiters.remove(entry)
+            self.inflight[(kind, key)] += 1
+            if kind != "product": self.inflight_upstream += 1
+            elif job:
+                job["served"] += 1; job["vtime"] += 1.0 / job["weight"]
+        try:
+            yield
+        finally:
+            with self.cv:
+                self.inflight[(kind, key)] -= 1
+                if kind != "product": self.inflight_upstream -= 1
+                self.cv.notify_all()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Wachtrijdiepte per store (jobs, resterende producten, wachtende en lopende calls)."""
+        with self.cv:
+            out: Dict[str, Dict[str, Any]] = {}
+            for j in self.jobs.values():
+                s = out.setdefault(j["store"], {"jobs": 0, "remaining_products": 0, "waiting": 0, "inflight_shopify": 0})
+                s["jobs"] += 1; s["remaining_products"] += j["remaining"]
+            for w in self.waiters:
+                job = self.jobs.get(w[4]) if w[4] else None
+                store = job["store"] if job else (w[3] if w[2] == "shopify" else None)
+                if store: out.setdefault(store, {"jobs": 0, "remaining_products": 0, "waiting": 0,
+                                                 "inflight_shopify": 0})["waiting"] += 1
+            for (kind, key), n in self.inflight.items():
+                if kind == "shopify" and n and key in out: out[key]["inflight_shopify"] = n
+            return out
+
+SCHED = _FairScheduler()
+
+def _api_key_id(key: str) -> str:
+    return hashlib.sha1(key.encode()).hexdigest()[:8] if key else "-"
+
+# =========================
+# Upstreams: retry-budget + circuit breaker per upstream (openai, shopify:<store>)
+# =========================
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class _Upstream:
+    """Circuit breaker + retry-budget voor één upstream.
+
+    closed:    fouten (5xx, timeouts, connectiefouten) tellen; na BREAKER_THRESHOLD op rij → open.
+    open:      calls wachten tot de cooldown voorbij is (i.p.v. de API te blijven bestoken).
+    half-open: precies één probe; slaagt die → closed, anders weer open met dubbele cooldown.
+    429/THROTTLED telt niet als fout: de upstream leeft, we moeten enkel trager.
+    Retries op fouten kosten een token; elke geslaagde call levert RETRY_BUDGET_RATIO op.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self.open_until = 0.0
+        self.probing = False
+        self.tokens = RETRY_BUDGET_BURST
+        self.last_error = ""
+
+    def acquire(self, deadline: Optional[float] = None) -> None:
+        limit = deadline if deadline is not None else time.monotonic() + BREAKER_MAX_WAIT
+        with _UPSTREAM_CV:
+            while True:
+                now = time.monotonic()
+                if self.state == "closed": return
+                if self.state == "open" and now >= self.open_until:
+                    self.state, self.probing = "half_open", True
+                    return
+                if now >= limit:
+                    raise CircuitOpenError(f"{self.name} onbeschikbaar: {self.last_error}")
+                until = self.open_until if self.state == "open" else now + 1.0
+                _UPSTREAM_CV.wait(max(0.05, min(until, limit) - now))
+
+    def record(self, ok: bool, error: str = "") -> None:
+        with _UPSTREAM_CV:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.tokens = min(RETRY_BUDGET_BURST, self.tokens + RETRY_BUDGET_RATIO)
+                if self.state != "closed":
+                    self.state, self.cooldown = "closed", BREAKER_COOLDOWN
+                    app.logger.info("breaker %s: hersteld", self.name)
+                    _metric_set("seo_breaker_open", 0, upstream=self.name)
+            else:
+                self.failures += 1
+                self.last_error = error
+                if self.state == "half_open" or (self.state == "closed" and self.failures >= BREAKER_THRESHOLD):
+                    self.state, self.open_until = "open", time.monotonic() + self.cooldown
+                    app.logger.warning("breaker %s: open voor %.0fs (%s)", self.name, self.cooldown, error)
+                    self.cooldown = min(BREAKER_COOLDOWN_MAX, self.cooldown * 2)
+                    _metric_inc("seo_breaker_trips_total", upstream=self.name)
+                    _metric_set("seo_breaker_open", 1, upstream=self.name)
+            _UPSTREAM_CV.notify_all()
+
+    def spend_retry(self) -> bool:
+        with _UPSTREAM_CV:
+            if self.tokens < 1: return False
+            self.tokens -= 1
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with _UPSTREAM_CV:
+            return {"state": self.state, "failures": self.failures, "last_error": self.last_error,
+                    "retry_in": max(0, round(self.open_until - time.monotonic())) if self.state == "open" else 0,
+                    "retry_budget": round(self.tokens, 1)}
+
+_UPSTREAMS: Dict[str, _Upstream] = {}
+_UPSTREAM_CV = threading.Condition()
+
+def _upstream(name: str) -> _Upstream:
+    with _UPSTREAM_CV:
+        up = _UPSTREAMS.get(name)
+        if up is None: up = _UPSTREAMS[name] = _Upstream(name)
+        return up
+
+def _backoff_delay(attempt: int, base: float, retry_after: Optional[str] = None) -> float:
+    """Exponentiële backoff met jitter; Retry-After van de server wint."""
+    try:
+        if retry_after: return min(BACKOFF_CAP, float(retry_after))
+    except ValueError:
+        pass
+    return min(BACKOFF_CAP, base ** attempt) * random.uniform(0.5, 1.0)
+
+def _send(upstream: str, attempt: Any, retries: int, base: float, deadline: Optional[float] = None,
+          throttled: Any = None) -> requests.Response:
+    """Eén logische call: `attempt()` doet het HTTP-request, hier zitten retries, backoff en de breaker.
+
+    Herhaalt op 429 (of `throttled(r)` → wachttijd), 5xx en timeouts/connectiefouten.
+    Geeft de laatste response terug; de caller beslist over raise_for_status().
+    """
+    up = _upstream(upstream)
+    kind = upstream.split(":")[0]
+    for i in range(retries):
+        up.acquire(deadline)
+        try:
+            r = attempt()
+        except (requests.Timeout, requests.ConnectionError) as e:
+            up.record(False, type(e).__name__)
+            if i == retries - 1 or not up.spend_retry(): raise
+            pause = _backoff_delay(i, base)
+        except Exception:
+            up.record(True)
+            raise
+        else:
+            hint = throttled(r) if throttled and r.status_code < 400 else None
+            if r.status_code == 429 or hint is not None:
+                up.record(True)
+                _metric_inc("seo_http_429_total", upstream=kind if hint is None else f"{kind}_graphql")
+                if i == retries - 1: return r
+                pause = hint if hint is not None else _backoff_delay(i, base, r.headers.get("Retry-After"))
+            elif r.status_code >= 500:
+                up.record(False, f"HTTP {r.status_code}")
+                if i == retries - 1 or not up.spend_retry(): return r
+                pause = _backoff_delay(i, base, r.headers.get("Retry-After"))
+            else:
+                up.record(True)
+                return r
+        if deadline is not None:
+            pause = min(pause, deadline - time.monotonic())
+            if pause <= 0: raise requests.Timeout(f"{kind}: deadline overschreden")
+        _metric_inc("seo_retries_total", upstream=kind)
+        time.sleep(pause)
+    return r
+
+def _await_upstreams(names: List[str]) -> Iterator[Dict[str, Any]]:
+    """Pauzeer een run zolang een breaker open staat; yieldt één paused- en één resumed-event."""
+    ups = [_upstream(n) for n in names]
+    blocked = [u for u in ups if u.state == "open"]
+    if not blocked: return
+    u = blocked[0]
+    snap = u.snapshot()
+    yield _ev("paused", f"⏸ {u.name} onbeschikbaar ({snap['last_error']}); hervat automatisch over ~{snap['retry_in']}s",
+              upstream=u.name, retry_in=snap["retry_in"], error=snap["last_error"])
+    t0 = time.monotonic()
+    with _UPSTREAM_CV:
+        while any(x.state == "open" and time.monotonic() < x.open_until for x in ups):
+            _UPSTREAM_CV.wait(1.0)
+    yield _ev("resumed", f"▶️ Hervat na {time.monotonic() - t0:.0f}s pauze", upstream=u.name)
+
 # =========================
 # Utils
 # =========================
@@ -115,24 +742,46 @@ def _normalize_store_domain(raw: str) -> str:
 def _shopify_headers(token: str) -> Dict[str, str]:
     return {"X-Shopify-Access-Token": token, "Content-Type": "application/json", "Accept": "application/json"}
 
+def _shopify_request(method: str, url: str, token: str, throttled: Any = None, **kw: Any) -> requests.Response:
+    netloc = urlparse(url).netloc
+    def attempt() -> requests.Response:
+        with SCHED.slot("shopify", netloc):
+            return REQ.request(method, url, headers=_shopify_headers(token), timeout=REQUEST_TIMEOUT, **kw)
+    return _send(f"shopify:{netloc}", attempt, SHOPIFY_RETRIES, SHOPIFY_BACKOFF, throttled=throttled)
+
+@_instrumented("shopify_get")
 def _get(url: str, token: str, params: Optional[Dict[str, Any]] = None) -> requests.Response:
-    for i in range(SHOPIFY_RETRIES):
-        r = REQ.get(url, headers=_shopify_headers(token), params=params or {}, timeout=REQUEST_TIMEOUT)
-        if r.status_code == 429 and i < SHOPIFY_RETRIES - 1:
-            time.sleep(float(r.headers.get("Retry-After", 2 ** i))); continue
-        r.raise_for_status(); return r
+    r = _shopify_request("GET", url, token, params=params or {})
     r.raise_for_status(); return r
 
+def _gql_throttle_wait(data: Dict[str, Any]) -> Optional[float]:
+    """GraphQL cost throttling komt als 200 + errors[THROTTLED]; geef wachttijd terug (None = niet gethrottled)."""
+    errs = (data or {}).get("errors") or []
+    if not any(((e or {}).get("extensions") or {}).get("code") == "THROTTLED" for e in errs if isinstance(e, dict)):
+        return None
+    cost = ((data.get("extensions") or {}).get("cost") or {})
+    st = cost.get("throttleStatus") or {}
+    need = float(cost.get("requestedQueryCost") or 0) - float(st.get("currentlyAvailable") or 0)
+    rate = float(st.get("restoreRate") or 50)
+    return max(0.5, need / rate) if rate else 1.0
+
+def _gql_throttled(r: requests.Response) -> Optional[float]:
+    try: return _gql_throttle_wait(r.json())
+    except ValueError: return None
+
+@_instrumented("shopify_post")
 def _post(url: str, token: str, json_body: Dict[str, Any]) -> Dict[str, Any]:
-    for i in range(SHOPIFY_RETRIES):
-        r = REQ.post(url, headers=_shopify_headers(token), json=json_body, timeout=REQUEST_TIMEOUT)
-        if r.status_code == 429 and i < SHOPIFY_RETRIES - 1:
-            time.sleep(float(r.headers.get("Retry-After", 2 ** i))); continue
-        r.raise_for_status(); return r.json()
-    r.raise_for_status(); return r.json()
+    r = _shopify_request("POST", url, token, throttled=_gql_throttled, json=json_body)
+    r.raise_for_status()
+    data = r.json()
+    if _gql_throttle_wait(data) is not None: raise RuntimeError("Shopify GraphQL THROTTLED")
+    return data
+
+def _shop_base(store_domain: str) -> str:
+    return f"{SHOPIFY_SCHEME}://{store_domain}"
 
 def _gql_url(store_domain: str) -> str:
-    return f"https://{store_domain}/admin/api/2025-01/graphql.json"
+    return f"{_shop_base(store_domain)}/admin/api/2025-01/graphql.json"
 
 def _get_creds(payload: dict | None = None) -> tuple[str, str]:
     payload = payload or {}
@@ -184,20 +833,159 @@ def _build_system_prompt(txn: bool) -> str:
         "Meta description: …\n"
     )
 
-def _openai_chat(sys_prompt: str, user_prompt: str) -> str:
+def _build_field_system_prompt(txn: bool, fields: Any) -> str:
+    """Compacte systeemprompt voor gerichte (deel)generatie: enkel de regels van de gevraagde velden."""
+    parts = ["Je bent een Nederlandstalige SEO-copywriter voor een plantenwebshop (Belle Flora). "
+             "Schrijf natuurlijk en feitelijk; geen emoji.\n"]
+    if "title" in fields:
+        parts.append("Titelformat: [NL-naam] / [Latijn] – ↕[hoogte cm] – ⌀[pot cm]; ‘– in [kleur] pot’ enkel als dat vermeld is.\n")
+    if "body_html" in fields:
+        parts.append("Beschrijving (HTML): <h3>Beschrijving</h3><p>…</p><h3>Eigenschappen & behoeften</h3> + "
+                     + "".join(f"<p><strong>{l}</strong>: …</p>" for l in CARE_LABELS) + " Geen lijsten.\n")
+    if "meta_title" in fields:
+        parts.append(f"Meta title ≤{META_TITLE_LIMIT} tekens" + (", begin met koopwoord + product" if txn else "") + ".\n")
+    if "meta_description" in fields:
+        parts.append(f"Meta description ≤{META_DESC_LIMIT} tekens"
+                     + (f", 1–2 USP’s ({' | '.join(TRANSACTIONAL_CLAIMS)}) en subtiele CTA" if txn else "") + ".\n")
+    parts.append("OUTPUT — enkel deze velden, exacte labels:\n" + "\n".join(f"{FIELD_LABELS[f]}: …" for f in FIELD_ORDER if f in fields))
+    return "".join(parts)
+
+_OPENAI_LATENCIES: deque = deque(maxlen=500)
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="openai-hedge")
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values: return 0.0
+    v = sorted(values)
+    k = (len(v) - 1) * q
+    lo = int(k); hi = min(lo + 1, len(v) - 1)
+    return v[lo] + (v[hi] - v[lo]) * (k - lo)
+
+def _latency_summary(values: List[float]) -> str:
+    if not values: return "geen metingen"
+    return (f"p50 {_percentile(values, .5):.1f}s · p95 {_percentile(values, .95):.1f}s · "
+            f"p99 {_percentile(values, .99):.1f}s (n={len(values)})")
+
+def _hedge_delay() -> Optional[float]:
+    """Na hoeveel seconden een tweede (hedged) request vertrekt; None = niet hedgen."""
+    if not OPENAI_HEDGE or len(_OPENAI_LATENCIES) < OPENAI_HEDGE_MIN_SAMPLES:
+        return None
+    return max(OPENAI_HEDGE_FLOOR, _percentile(list(_OPENAI_LATENCIES), .95))
+
+def _openai_attempt(url: str, headers: Dict[str, str], body: Dict[str, Any], deadline: float,
+                    on_response: Any = None) -> requests.Response:
+    """Eén poging binnen de deadline; met hedging wint het eerste geslaagde antwoord.
+    on_response(r) ziet elk antwoord precies één keer, ook mislukte en de verliezer van een hedge
+    (die via een done-callback, nadat de winnaar al terug is)."""
+    seen = on_response or (lambda r: None)
+    timeout = max(1.0, min(OPENAI_TIMEOUT, deadline - time.monotonic()))
+    hedge_after = _hedge_delay()
+    if hedge_after is None or hedge_after >= timeout:
+        r = REQ.post(url, headers=headers, json=body, timeout=timeout)
+        seen(r)
+        return r
+    futs = [_HEDGE_POOL.submit(REQ.post, url, headers=headers, json=body, timeout=timeout)]
+    done, _ = wait(futs, timeout=hedge_after)
+    if not done:
+        _metric_inc("seo_openai_hedges_total")
+        futs.append(_HEDGE_POOL.submit(REQ.post, url, headers=headers, json=body,
+                                       timeout=max(1.0, min(OPENAI_TIMEOUT, deadline - time.monotonic()))))
+    last: Any = None
+    while futs:
+        done, _ = wait(futs, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done: raise requests.Timeout("OpenAI deadline overschreden")
+        for f in done:
+            futs.remove(f)
+            try: r = f.result()
+            except Exception as e: last = e; continue
+            seen(r)
+            if r.status_code < 400:
+                for loser in futs:
+                    loser.add_done_callback(lambda g: g.exception() is None and seen(g.result()))
+                return r
+            last = r
+    if isinstance(last, Exception): raise last
+    return last
+
+@_instrumented("openai_chat")
+def _openai_chat(sys_prompt: str, user_prompt: str, usage: Optional[Dict[str, Any]] = None,
+                 model: Optional[str] = None, temperature: Optional[float] = None) -> str:
+    """Completion-tekst; `usage` (optioneel) krijgt model + prompt/completion-tokens van dit antwoord."""
     if not OPENAI_API_KEY: raise RuntimeError("OPENAI_KEY ontbreekt.")
-    url = "https://api.openai.com/v1/chat/completions"
-    body = {"model": OPENAI_MODEL, "temperature": OPENAI_TEMP,
+    url = f"{OPENAI_BASE_URL}/chat/completions"
+    model = model or OPENAI_MODEL
+    body = {"model": model, "temperature": OPENAI_TEMP if temperature is None else temperature,
             "messages": [{"role":"system","content":sys_prompt},{"role":"user","content":user_prompt}]}
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    for i in range(OPENAI_RETRIES):
-        r = REQ.post(url, headers=headers, json=body, timeout=120)
-        if r.status_code == 429 and i < OPENAI_RETRIES - 1:
-            time.sleep(2 ** i); continue
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"]
+    deadline = time.monotonic() + OPENAI_DEADLINE
+    t0 = time.monotonic()
+    def attempt() -> requests.Response:
+        nonlocal t0
+        t0 = time.monotonic()
+        with SCHED.slot("openai", _api_key_id(OPENAI_API_KEY)):
+            return _openai_attempt(url, headers, body, deadline, lambda r: _tally_usage(r, model, usage))
+    r = _send("openai", attempt, OPENAI_RETRIES, OPENAI_BACKOFF, deadline=deadline)
     r.raise_for_status()
-    return ""
+    _OPENAI_LATENCIES.append(time.monotonic() - t0)
+    return r.json()["choices"][0]["message"]["content"]
+
+_USAGE_LOCK = threading.Lock()
+
+def _tally_usage(r: requests.Response, model: str, usage: Optional[Dict[str, Any]]) -> None:
+    """Tokens van elk antwoord met body: de winnaar, een 5xx/mislukte poging die toch verbruikte en de
+    verliezer van een hedge. Komt die pas na _record_usage binnen, dan wordt hij apart op dezelfde run geboekt."""
+    try: data = r.json()
+    except Exception: return
+    used = (data.get("usage") if isinstance(data, dict) else None) or {}
+    pt, ct = int(used.get("prompt_tokens") or 0), int(used.get("completion_tokens") or 0)
+    if not pt and not ct: return
+    if pt: _metric_inc("seo_openai_tokens_total", pt, kind="prompt")
+    if ct: _metric_inc("seo_openai_tokens_total", ct, kind="completion")
+    if usage is None: return
+    model = data.get("model") or model
+    with _USAGE_LOCK:
+        ctx = usage.get("_booked")
+        if ctx is None:
+            usage["model"] = model
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + pt
+            usage["completion_tokens"] = usage.get("completion_tokens", 0) + ct
+            return
+    _record_usage(ctx, {"model": model, "prompt_tokens": pt, "completion_tokens": ct})
+
+_MODEL_PRICES = {OPENAI_MODEL: (OPENAI_PRICE_PROMPT, OPENAI_PRICE_COMPLETION)}
+if OPENAI_FAST_MODEL: _MODEL_PRICES[OPENAI_FAST_MODEL] = (OPENAI_FAST_PRICE_PROMPT, OPENAI_FAST_PRICE_COMPLETION)
+
+def _model_price(model: Optional[str]) -> Tuple[float, float]:
+    # OpenAI antwoordt met een gedateerde naam (gpt-4o-mini-2024-07-18): langste bekende prefix wint
+    hits = [m for m in _MODEL_PRICES if model and model.startswith(m)]
+    return _MODEL_PRICES[max(hits, key=len)] if hits else _MODEL_PRICES[OPENAI_MODEL]
+
+def _usage_cost(prompt_tokens: int, completion_tokens: int, model: Optional[str] = None) -> float:
+    pp, cp = _model_price(model)
+    return (prompt_tokens * pp + completion_tokens * cp) / 1e6
+
+def _approx_tokens(text: str) -> int:
+    # ~4 tekens per token; goed genoeg voor een schatting vooraf
+    return len(text or "") // 4 + 1
+
+def _record_usage(ctx: Dict[str, Any], usage: Dict[str, Any]) -> None:
+    """Boek één call op de run (ctx) en in de usage-store. Wat daarna nog binnenkomt op dezelfde
+    usage (hedge-verliezer) boekt _tally_usage zelf op ctx."""
+    with _USAGE_LOCK:
+        usage["_booked"] = ctx
+        pt, ct = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        if not pt and not ct: return   # geen antwoord met body (bv. timeout): niets betaald
+        cost = _usage_cost(pt, ct, usage.get("model"))
+        u = ctx["usage"]
+        u["prompt_tokens"] += pt; u["completion_tokens"] += ct; u["cost_eur"] += cost; u["calls"] += 1
+    _metric_inc("seo_openai_cost_eur_total", cost)
+    _db().execute("INSERT INTO openai_usage (at, run_id, store, model, prompt_tokens, completion_tokens, cost_eur) "
+                  "VALUES (?,?,?,?,?,?,?)", (time.time(), ctx["run_id"], ctx["store"], usage.get("model") or OPENAI_MODEL,
+                                             pt, ct, cost))
+
+def _avg_completion_tokens(default: int = 600) -> int:
+    row = _db().execute("SELECT AVG(completion_tokens) AS a, COUNT(*) AS n FROM "
+                        "(SELECT completion_tokens FROM openai_usage ORDER BY at DESC LIMIT 500)").fetchone()
+    return int(row["a"]) if row and row["n"] >= 10 else default
 
 def split_ai_output(text: str) -> Dict[str, str]:
     lines = [l.rstrip() for l in (text or "").splitlines()]
@@ -366,6 +1154,69 @@ def analyze_bundle(title: str) -> Tuple[bool, Optional[int]]:
             return True, qty
     return False, qty
 
+# --- Variantfamilies (zelfde plant, andere maat/potkleur)
+RE_VARIANT_DIMS = re.compile(
+    r"(?:↕|hoogte)\s*[:=]?\s*\d{1,3}\s*(?:cm)?\b"
+    r"|(?:[⌀Øø]|diameter|doorsnede|pot\s*maat|potmaat|pot\s*diameter|potdiameter)\s*[:=]?\s*\d{1,3}\s*(?:cm)?\b"
+    r"|\b\d{1,3}\s*(?:[-–]\s*\d{1,3}\s*)?cm\b", re.I)
+RE_VARIANT_POT = re.compile(
+    r"\bin\s+(?:een\s+)?(?:" + COLOR_RE + r"\s+)?pot\b|\b" + COLOR_RE + r"\s+pot\b|\bpot\s*[:\-]?\s*" + COLOR_RE + r"\b", re.I)
+
+def _tidy_separators(t: str) -> str:
+    t = re.sub(r"\s*([–—|-])(?:\s*[–—|-])+", r" \1", t)
+    t = re.sub(r"^[\s–—|,-]+|[\s–—|,-]+$", "", t)
+    return re.sub(r"\s{2,}", " ", t).strip()
+
+def strip_variant_bits(text: str) -> str:
+    """Verwijder maten en potkleur/pot-suffix; laat de basisnaam over."""
+    t = RE_VARIANT_DIMS.sub(" ", text or "")
+    t = RE_VARIANT_POT.sub(" ", t)
+    return _tidy_separators(t)
+
+def variant_info(title: str, body_html: str) -> Dict[str, Any]:
+    return {"dims": parse_dimensions(title, body_html), "pot_color": extract_pot_color(title, body_html)}
+
+def family_key(title: str, body_html: str) -> Optional[str]:
+    """Sleutel voor producten die enkel in maat of potkleur verschillen; None als er geen variant-info is."""
+    info = variant_info(title, body_html)
+    if not info["dims"] and not info["pot_color"]:
+        return None
+    base = strip_variant_bits(title).lower()
+    return base or None
+
+def _retarget_variant(text: str, src: Dict[str, Any], dst: Dict[str, Any]) -> str:
+    """Herschrijf maten/potkleur van het familiehoofd naar die van een zusterproduct."""
+    out = text or ""
+    if not out: return out
+    sd, dd = src.get("dims") or {}, dst.get("dims") or {}
+    swaps = []
+    for k in ("height_cm", "pot_diameter_cm"):
+        old, new = sd.get(k), dd.get(k)
+        if old and old != new and not (k == "pot_diameter_cm" and old == sd.get("height_cm")):
+            swaps.append((old, new))
+    for n, (old, new) in enumerate(swaps):
+        rx = re.compile(rf"(?<!\d){re.escape(old)}(\s*cm)\b", re.I)
+        if new:
+            out = rx.sub(f"\x00{n}\x00" + r"\1", out)
+        else:
+            out = re.sub(rf"\s*[–—-]?\s*(?:↕|[⌀Øø])\s*{re.escape(old)}\s*cm\b", "", out, flags=re.I)
+    for n, (old, new) in enumerate(swaps):
+        if new: out = out.replace(f"\x00{n}\x00", new)
+    sc, dc = src.get("pot_color"), dst.get("pot_color")
+    if sc and sc.lower() != (dc or "").lower():
+        if dc:
+            def _color(m: "re.Match[str]") -> str:
+                c = m.group("c")
+                return dc[:1].upper() + dc[1:] if c[:1].isupper() else dc
+            out = re.sub(rf"\b(?P<c>{re.escape(sc)})(?=\s+pot\b)", _color, out, flags=re.I)
+            out = re.sub(rf"(?<=\bpot)(\s*[:\-]?\s*)(?P<c>{re.escape(sc)})\b", lambda m: m.group(1) + _color(m), out, flags=re.I)
+        else:
+            out = re.sub(rf"\s*[–—-]?\s*in\s+{re.escape(sc)}\s+pot\b", "", out, flags=re.I)
+    return out
+
+def derive_sibling_pieces(pieces: Dict[str, str], src: Dict[str, Any], dst: Dict[str, Any]) -> Dict[str, str]:
+    return {k: _retarget_variant(_s(v), src, dst) for k, v in (pieces or {}).items()}
+
 def enforce_title_name_map(title: str) -> str:
     for nl, lat in NAME_MAP.items():
         if re.search(rf"\b{re.escape(nl)}\b", title, re.I) and not re.search(rf"\b{re.escape(lat)}\b", title, re.I):
@@ -485,10 +1336,79 @@ def inject_heroicons(body_html: str) -> str:
     out = add_icon(out, "Plantperiode",  _icon_svg("sprout"))
     return out
 
+# ---------- Validatie per veld (structuur op de ruwe AI-velden; meta-lengtes op het resultaat van finalize_*) ----------
+FIELD_ORDER  = ("title", "body_html", "meta_title", "meta_description")
+META_FIELDS  = ("meta_title", "meta_description")
+FIELD_LABELS = {"title": "Nieuwe titel", "body_html": "Beschrijving", "meta_title": "Meta title", "meta_description": "Meta description"}
+CARE_LABELS  = ("Lichtbehoefte", "Waterbehoefte", "Standplaats", "Giftigheid")
+RE_LABEL_LEAK = re.compile(r"\b(?:beschrijving|meta title|meta description)\s*:", re.I)
+RE_CARE_SECTION = re.compile(r"<h3>\s*Eigenschappen\s*(?:&|&amp;)\s*behoeften", re.I)
+
+def validate_pieces(pieces: Dict[str, str], fields: Tuple[str, ...] = FIELD_ORDER, lengths: bool = True) -> Dict[str, str]:
+    """{veld: probleem} voor ontbrekende of misvormde velden; leeg = in orde.
+    lengths=False slaat de lengtes van de metas over: op ruwe AI-output corrigeert finalize_meta_* die nog,
+    dus die check hoort op het gefinaliseerde resultaat (zie _optimize_product)."""
+    bad: Dict[str, str] = {}
+    if "title" in fields:
+        t = _s(pieces.get("title")).strip()
+        if not t: bad["title"] = "ontbreekt"
+        elif "\n" in t or len(t) > 150: bad["title"] = "te lang of meerdere regels"
+        elif RE_LABEL_LEAK.search(t): bad["title"] = "bevat labels"
+    if "body_html" in fields:
+        b = _s(pieces.get("body_html"))
+        missing = [l for l in CARE_LABELS if not re.search(rf"<strong>\s*{l}\s*</strong>", b, re.I)]
+        if not b.strip(): bad["body_html"] = "ontbreekt"
+        elif not RE_CARE_SECTION.search(b): bad["body_html"] = "sectie ‘Eigenschappen & behoeften’ ontbreekt"
+        elif missing: bad["body_html"] = "regels ontbreken: " + ", ".join(missing)
+        elif re.search(r"</strong>\s*:\s*Onbekend\b", b): bad["body_html"] = "zonder inhoud (Onbekend)"
+    if "meta_title" in fields:
+        m = _s(pieces.get("meta_title")).strip()
+        if not m: bad["meta_title"] = "ontbreekt"
+        elif not lengths: pass
+        elif len(m) > META_TITLE_LIMIT: bad["meta_title"] = f"te lang ({len(m)} > {META_TITLE_LIMIT})"
+    if "meta_description" in fields:
+        d = _s(pieces.get("meta_description")).strip()
+        if not d: bad["meta_description"] = "ontbreekt"
+        elif not lengths: pass
+        elif len(d) > META_DESC_LIMIT: bad["meta_description"] = f"te lang ({len(d)} > {META_DESC_LIMIT})"
+        elif len(d) < 70: bad["meta_description"] = f"te kort ({len(d)})"
+    return bad
+
+# ---------- Pure transformatieketen (AI-output → Shopify-waarden) ----------
+def finalize_product(title: str, body: str, pieces: Dict[str, str], qty: Optional[int],
+                     txn: bool, garden: bool) -> Dict[str, Any]:
+    title_ai = enforce_title_name_map(_s(pieces.get("title")) or title)
+    body_ai  = _s(pieces.get("body_html")) or body
+
+    dims = parse_dimensions(title_ai, body_ai)
+    if not dims.get("height_cm") and not dims.get("pot_diameter_cm"):
+        dims = parse_dimensions(title, body)
+
+    pot_color   = extract_pot_color(title_ai, body_ai)
+    pot_present = detect_pot_presence(title_ai, body_ai)
+
+    final_title = normalize_title(title_ai, dims, pot_color, pot_present)
+    if qty and not re.match(r"^\s*\d+\s*[xX]\s+", final_title):
+        final_title = f"{qty}x {final_title}"
+
+    final_body = body_ai
+    if garden:
+        final_body = _ensure_garden_lines(final_body, final_title)
+    final_body = inject_heroicons(final_body)
+
+    return {
+        "title": final_title,
+        "body_html": final_body,
+        "meta_title": finalize_meta_title(pieces.get("meta_title"), final_title),
+        "meta_description": finalize_meta_desc(pieces.get("meta_description"), final_body, final_title, txn),
+        "dims": dims,
+    }
+
 # =========================
 # Shopify: teksten + metafields
 # =========================
 
+@_instrumented("update_product_texts")
 def update_product_texts(store_domain: str, token: str, product_id: int,
                          new_title: str, new_body_html: str, seo_title: str, seo_desc: str) -> None:
     mutation = """
@@ -498,12 +1418,102 @@ def update_product_texts(store_domain: str, token: str, product_id: int,
         userErrors { field message }
       }
     }"""
-    gid = f"gid://shopify/Product/{int(product_id)}"
-    variables = {"input": {"id": gid, "title": new_title, "descriptionHtml": new_body_html,
-                           "seo": {"title": seo_title or new_title, "description": seo_desc or ""}}}
+    variables = {"input": _product_input(product_id, new_title, new_body_html, seo_title, seo_desc)}
     data = _post(_gql_url(store_domain), token, {"query": mutation, "variables": variables})
     errs = (data.get("data", {}).get("productUpdate", {}) or {}).get("userErrors", [])
     if errs: raise RuntimeError(f"Shopify productUpdate: {errs}")
+    _remember_written(store_domain, product_id, new_title, new_body_html)
+
+def _content_hash(title: str, body_html: str) -> str:
+    """Hash op titel + zichtbare tekst: ongevoelig voor HTML-normalisatie door Shopify."""
+    text = re.sub(r"\s+", " ", html.unescape(_html_to_text(body_html))).strip()
+    return hashlib.sha1(f"{(title or '').strip()}\n{text}".encode()).hexdigest()
+
+def _remember_written(store: str, product_id: int, title: str, body_html: str) -> None:
+    try:
+        _db().execute("INSERT OR REPLACE INTO written (store, product_id, content_hash, title, at) VALUES (?, ?, ?, ?, ?)",
+                      (store, int(product_id), _content_hash(title, body_html), title or "", time.time()))
+    except sqlite3.Error:
+        pass
+
+def _product_input(product_id: int, title: str, body_html: str, seo_title: str, seo_desc: str,
+                   restore: bool = False) -> Dict[str, Any]:
+    """restore=True (rollback): SEO exact zoals in de snapshot, ook leeg; anders valt een lege SEO-titel terug op de titel."""
+    return {"id": f"gid://shopify/Product/{int(product_id)}", "title": title, "descriptionHtml": body_html,
+            "seo": {"title": (seo_title or "") if restore else (seo_title or title), "description": seo_desc or ""}}
+
+@_instrumented("update_product_texts_batch")
+def update_products_texts_batch(store_domain: str, token: str, items: List[Dict[str, Any]],
+                                restore: bool = False) -> Dict[int, str]:
+    """Meerdere productUpdate's in één GraphQL-request (aliassen). Geeft {product_id: fout} terug.
+    restore=True schrijft de SEO-velden ongewijzigd terug (zie _product_input)."""
+    if not items: return {}
+    decls = ", ".join(f"$i{n}: ProductInput!" for n in range(len(items)))
+    fields = "\n".join(f"  p{n}: productUpdate(input: $i{n}) {{ product {{ id }} userErrors {{ field message }} }}"
+                       for n in range(len(items)))
+    mutation = f"mutation batchUpdate({decls}) {{\n{fields}\n}}"
+    variables = {f"i{n}": _product_input(it["id"], it["title"], it["body_html"], it.get("meta_title"),
+                                         it.get("meta_description"), restore)
+                 for n, it in enumerate(items)}
+    data = _post(_gql_url(store_domain), token, {"query": mutation, "variables": variables})
+    res = data.get("data") or {}
+    failed: Dict[int, str] = {}
+    for n, it in enumerate(items):
+        node = res.get(f"p{n}")
+        errs = (node or {}).get("userErrors") or []
+        if node is None: failed[int(it["id"])] = f"geen antwoord: {data.get('errors')}"
+        elif errs: failed[int(it["id"])] = f"Shopify productUpdate: {errs}"
+        else: _remember_written(store_domain, it["id"], it["title"], it["body_html"])
+    return failed
+
+# ---- Snapshots: originele waarden vóór elke update (append-only, per run + product)
+
+def fetch_current_texts(store_domain: str, token: str, product_ids: List[int]) -> Dict[int, Dict[str, str]]:
+    """Huidige titel, beschrijving en SEO per product (GraphQL nodes, ≤250 per request)."""
+    query = """
+    query current($ids: [ID!]!) {
+      nodes(ids: $ids) { ... on Product { id title descriptionHtml seo { title description } } }
+    }"""
+    out: Dict[int, Dict[str, str]] = {}
+    for i in range(0, len(product_ids), 250):
+        ids = [f"gid://shopify/Product/{int(p)}" for p in product_ids[i:i + 250]]
+        data = _post(_gql_url(store_domain), token, {"query": query, "variables": {"ids": ids}})
+        for n in (data.get("data") or {}).get("nodes") or []:
+            if not n or not n.get("id"): continue
+            seo = n.get("seo") or {}
+            out[int(str(n["id"]).rsplit("/", 1)[-1])] = {
+                "title": _s(n.get("title")), "body_html": _s(n.get("descriptionHtml")),
+                "meta_title": _s(seo.get("title")), "meta_description": _s(seo.get("description"))}
+    return out
+
+def _snapshot_products(run_id: str, store: str, token: str, product_ids: List[int],
+                       current: Optional[Dict[int, Dict[str, str]]] = None, strict: bool = True) -> List[int]:
+    """Leg de waarden vast vóór een update. De eerste snapshot per (run, product) blijft staan: een hervatte
+    of herhaalde run overschrijft nooit het origineel. Zonder snapshot geen update: strict → exception,
+    anders krijgt de caller de niet-gevonden ids terug (de rest van de batch is wel vastgelegd)."""
+    ids = [int(p) for p in product_ids]
+    if not ids: return []
+    marks = ",".join("?" * len(ids))
+    have = {r[0] for r in _db().execute(f"SELECT product_id FROM snapshots WHERE run_id=? AND product_id IN ({marks})",
+                                        (run_id, *ids))}
+    todo = [p for p in ids if p not in have]
+    if not todo: return []
+    current = current or {}
+    missing = [p for p in todo if p not in current]
+    if missing: current = {**current, **fetch_current_texts(store, token, missing)}
+    lost = [p for p in todo if p not in current]
+    if lost and strict: raise RuntimeError(f"snapshot mislukt (product niet gevonden): {lost[:5]}")
+    now = time.time()
+    _db().executemany("INSERT OR IGNORE INTO snapshots (run_id, product_id, store, at, before) VALUES (?,?,?,?,?)",
+                      [(run_id, p, store, now, zlib.compress(json.dumps(current[p], ensure_ascii=False).encode()))
+                       for p in todo if p in current])
+    return lost
+
+def _load_snapshots(run_id: str, store: str, product_ids: List[int]) -> Dict[int, Dict[str, str]]:
+    marks = ",".join("?" * len(product_ids))
+    rows = _db().execute(f"SELECT product_id, before FROM snapshots WHERE run_id=? AND store=? AND product_id IN ({marks})",
+                         (run_id, store, *product_ids)).fetchall()
+    return {int(r["product_id"]): json.loads(zlib.decompress(r["before"])) for r in rows}
 
 # ---- Metafields helpers (GraphQL + REST fallback)
 
@@ -565,18 +1575,71 @@ def _rank_candidates(defs: List[Dict[str, Any]], hints: List[str]) -> List[Dict[
     out.sort(key=lambda x: x.get("score", 0), reverse=True)
     return out
 
+def _defs_signature(defs: List[Dict[str, Any]]) -> str:
+    keys = sorted((d.get("namespace") or "", d.get("key") or "", d.get("type_slug") or "") for d in defs)
+    return hashlib.sha1(json.dumps(keys).encode("utf-8")).hexdigest()[:16]
+
 def _ensure_meta_map(token: str, store_domain: str) -> Dict[str, Any]:
     cache_key = store_domain
-    if cache_key in _META_MAP_CACHE: return _META_MAP_CACHE[cache_key]
+    cached = _META_MAP_CACHE.get(cache_key)
+    if cached and time.time() - cached["at"] < META_DEFS_TTL: return cached
     defs = _defs_for_product(token, store_domain)
+    sig = _defs_signature(defs)
     h = _rank_candidates(defs, META_HEIGHT_HINTS or ["hoogte", "height"])
     d = _rank_candidates(defs, META_DIAM_HINTS  or ["diameter", "pot", "ø", "⌀"])
     if not h: h = [{"namespace": META_NAMESPACE_DEFAULT, "key": "height_cm", "name": "height_cm", "type": "single_line_text_field", "score": 0}]
     if not d: d = [{"namespace": META_NAMESPACE_DEFAULT, "key": "pot_diameter_cm", "name": "pot_diameter_cm", "type": "single_line_text_field", "score": 0}]
-    mm = {"height_candidates": h, "diam_candidates": d}
+    if cached and cached["sig"] != sig:
+        app.logger.info("metafield-definities gewijzigd voor %s: schrijfplan vervalt", store_domain)
+    plans = cached["plans"] if cached and cached["sig"] == sig else _load_write_plans(store_domain, sig)
+    mm = {"height_candidates": h, "diam_candidates": d, "sig": sig, "at": time.time(), "plans": plans}
     _META_MAP_CACHE[cache_key] = mm
     return mm
 
+# ---- Schrijfplan per store/label: winnende (namespace, key, type) + mislukte kandidaten.
+# Geldig zolang de definities (signature) niet wijzigen; gedeeld tussen workers via SQLite.
+
+_PLAN_LOCK = threading.Lock()
+
+def _cand_id(ns: str, key: str, tslug: str, value: str) -> str:
+    # waarde-vorm erbij: een integer-definitie die "60-70" weigert, mag "60" nog wel krijgen
+    return f"{ns}.{key}:{tslug}:{'int' if str(value).isdigit() else 'text'}"
+
+# Enkel fouten over de definitie/het type zelf maken een kandidaat onbruikbaar; een waarde die buiten
+# min/max valt of de validatie van de definitie niet haalt, zegt niets over het volgende product.
+_DEFINITION_ERROR_RE = re.compile(r"type mismatch|must be consistent with the definition|definition (was )?not found|"
+                                  r"(namespace|key|type)\b.*\b(invalid|not (valid|supported|allowed)|reserved|does not exist)|"
+                                  r"access denied|not authorized", re.I)
+_VALUE_ERROR_RE = re.compile(r"\bvalue\b.*\b(must|should|is not|isn't|exceeds|out of range)\b|\b(min|max)(imum)?\b", re.I)
+
+def _is_definition_error(msg: str) -> bool:
+    msg = msg or ""
+    return bool(_DEFINITION_ERROR_RE.search(msg)) and not _VALUE_ERROR_RE.search(msg)
+
+def _load_write_plans(store: str, sig: str) -> Dict[str, Dict[str, Any]]:
+    rows = _db().execute("SELECT label, winner, failed FROM metafield_plans WHERE store=? AND defs_sig=?", (store, sig)).fetchall()
+    return {r["label"]: {"winner": json.loads(r["winner"]) if r["winner"] else None, "failed": set(json.loads(r["failed"]))}
+            for r in rows}
+
+def _write_plan(store: str, mm: Dict[str, Any], label: str) -> Dict[str, Any]:
+    with _PLAN_LOCK:
+        plan = mm["plans"].get(label)
+    if plan is None or plan["winner"] is None:   # misschien al geleerd door een andere worker
+        plan = _load_write_plans(store, mm["sig"]).get(label) or plan or {"winner": None, "failed": set()}
+        with _PLAN_LOCK: mm["plans"][label] = plan
+    return plan
+
+def _save_write_plan(store: str, mm: Dict[str, Any], label: str, winner: Any = False, failed: Optional[str] = None) -> None:
+    """winner=None wist de winnaar (schrijven mislukte), False laat hem ongemoeid."""
+    with _PLAN_LOCK:
+        plan = mm["plans"].setdefault(label, {"winner": None, "failed": set()})
+        if winner is not False: plan["winner"] = winner
+        if failed: plan["failed"].add(failed)
+        row = (store, label, mm["sig"], json.dumps(plan["winner"]) if plan["winner"] else None,
+               json.dumps(sorted(plan["failed"])), time.time())
+    _db().execute("INSERT OR REPLACE INTO metafield_plans (store, label, defs_sig, winner, failed, updated) "
+                  "VALUES (?,?,?,?,?,?)", row)
+
 def _encode_graphql_value(val_str: str, tname_slug: str) -> str:
     try:
         if tname_slug == "number_integer": return str(int(val_str))
@@ -616,17 +1679,83 @@ def _gql_set_one(token: str, store_domain: str, gid: str, ns: str, key: str, tna
     if ue: return False, (ue[0].get("message") or str(ue))
     return True, ""
 
+METAFIELDS_SET_MAX = 25   # Shopify-limiet per metafieldsSet-call
+
+def _gql_set_many(token: str, store_domain: str, metafields: List[Dict[str, Any]]) -> Dict[int, str]:
+    """Eén metafieldsSet met meerdere entries. Geeft {index: fout} terug voor entries met userErrors."""
+    mutation = """
+    mutation setMany($metafields: [MetafieldsSetInput!]!) {
+      metafieldsSet(metafields: $metafields) {
+        metafields { namespace key }
+        userErrors { field message }
+      }
+    }"""
+    entries = [{**m, "value": _encode_graphql_value(m["value"], m["type"])} for m in metafields]
+    data = _post(_gql_url(store_domain), token, {"query": mutation, "variables": {"metafields": entries}})
+    ue = (data.get("data", {}).get("metafieldsSet", {}) or {}).get("userErrors", [])
+    failed: Dict[int, str] = {}
+    for e in ue:
+        path = e.get("field") or []
+        idx = next((int(p) for p in path if str(p).isdigit()), None)
+        if idx is None:   # fout zonder index: hele call als mislukt beschouwen
+            return {i: e.get("message") or str(e) for i in range(len(entries))}
+        failed[idx] = e.get("message") or str(e)
+    return failed
+
+def set_metafields_batch(token: str, store_domain: str, values_by_pid: Dict[int, Dict[str, str]]) -> Dict[str, Any]:
+    """Metafields voor meerdere producten in gebundelde metafieldsSet-calls (beste kandidaat per label).
+    Producten met fouten gaan daarna individueel door set_product_metafields (met fallbacks)."""
+    report: Dict[str, Any] = {"written": 0, "fallback_products": [], "errors": []}
+    if not values_by_pid: return report
+    mm = _ensure_meta_map(token, store_domain)
+    entries: List[Dict[str, Any]] = []; owners: List[int] = []
+    for pid, values in values_by_pid.items():
+        for label, cands in (("height_cm", mm.get("height_candidates")), ("pot_diameter_cm", mm.get("diam_candidates"))):
+            if not values.get(label) or not cands: continue
+            w = _write_plan(store_domain, mm, label)["winner"]
+            if w and w["via"] == "rest": continue   # enkel via REST schrijfbaar → per product hieronder
+            c = w or next((c for c in cands if _cand_id(c["namespace"], c["key"], _metafield_type_slug(c["type"]), values[label])
+                           not in _write_plan(store_domain, mm, label)["failed"]), cands[0])
+            entries.append({"ownerId": f"gid://shopify/Product/{int(pid)}", "namespace": c["namespace"], "key": c["key"],
+                            "type": _metafield_type_slug(c["type"]), "value": values[label], "_label": label})
+            owners.append(int(pid))
+    rest_only = {pid for pid, values in values_by_pid.items()
+                 if any(values.get(l) and (_write_plan(store_domain, mm, l)["winner"] or {}).get("via") == "rest"
+                        for l in ("height_cm", "pot_diameter_cm"))}
+    retry: set = set()
+    done: Dict[int, set] = {}   # per product de labels die al via de batch geschreven zijn
+    for i in range(0, len(entries), METAFIELDS_SET_MAX):
+        chunk = entries[i:i + METAFIELDS_SET_MAX]
+        labels = [m.pop("_label") for m in chunk]
+        try:
+            failed = _gql_set_many(token, store_domain, chunk)
+        except Exception as e:
+            failed = {n: str(e) for n in range(len(chunk))}
+        report["written"] += len(chunk) - len(failed)
+        retry.update(owners[i + n] for n in failed)
+        for n, (m, label) in enumerate(zip(chunk, labels)):
+            if n not in failed: done.setdefault(owners[i + n], set()).add(label)
+            if n in failed or _write_plan(store_domain, mm, label)["winner"]: continue
+            _save_write_plan(store_domain, mm, label, winner={"namespace": m["namespace"], "key": m["key"], "type": m["type"], "via": "gql"})
+    for pid in sorted(retry | rest_only):
+        # enkel wat de batch niet schreef: niets dubbel schrijven of dubbel tellen
+        rest = {k: v for k, v in values_by_pid[pid].items() if k not in done.get(pid, ())}
+        rep = set_product_metafields(token, store_domain, pid, rest)
+        report["fallback_products"].append(pid)
+        report["written"] += len(rep.get("written", [])) + len(rep.get("fallback", []))
+        report["errors"] += rep.get("errors", [])
+    return report
+
+@_instrumented("rest_fallback")
 def _rest_upsert_product_metafield(store_domain: str, token: str, product_id: int,
                                    ns: str, key: str, tname_slug: str, value: str) -> Tuple[bool, str]:
     """Create or update via REST as fallback."""
-    base = f"https://{store_domain}/admin/api/2024-07"
+    base = f"{_shop_base(store_domain)}/admin/api/2024-07"
     val = _encode_rest_value(value, tname_slug)
     # 1) Try create
     try:
-        r = REQ.post(f"{base}/products/{product_id}/metafields.json",
-                     headers=_shopify_headers(token),
-                     json={"metafield": {"namespace": ns, "key": key, "type": tname_slug, "value": val}},
-                     timeout=REQUEST_TIMEOUT)
+        r = _shopify_request("POST", f"{base}/products/{product_id}/metafields.json", token,
+                             json={"metafield": {"namespace": ns, "key": key, "type": tname_slug, "value": val}})
         if r.status_code in (200, 201):
             return True, "created"
         # If already exists -> 422, we will update
@@ -642,20 +1771,16 @@ def _rest_upsert_product_metafield(store_domain: str, token: str, product_id: in
         items = [m for m in gr.json().get("metafields", []) if m.get("namespace")==ns and m.get("key")==key]
         if items:
             mid = items[0]["id"]
-            ur = REQ.put(f"{base}/metafields/{mid}.json",
-                         headers=_shopify_headers(token),
-                         json={"metafield": {"id": mid, "type": tname_slug, "value": val}},
-                         timeout=REQUEST_TIMEOUT)
+            ur = _shopify_request("PUT", f"{base}/metafields/{mid}.json", token,
+                                  json={"metafield": {"id": mid, "type": tname_slug, "value": val}})
             if ur.status_code in (200, 201):
                 return True, "updated"
             ur.raise_for_status()
         else:
             # second try create without product subresource (owner_* fields)
-            cr = REQ.post(f"{base}/metafields.json",
-                          headers=_shopify_headers(token),
-                          json={"metafield": {"namespace": ns, "key": key, "type": tname_slug, "value": val,
-                                              "owner_resource": "product", "owner_id": product_id}},
-                          timeout=REQUEST_TIMEOUT)
+            cr = _shopify_request("POST", f"{base}/metafields.json", token,
+                                  json={"metafield": {"namespace": ns, "key": key, "type": tname_slug, "value": val,
+                                                      "owner_resource": "product", "owner_id": product_id}})
             if cr.status_code in (200, 201):
                 return True, "created-global"
             cr.raise_for_status()
@@ -663,9 +1788,11 @@ def _rest_upsert_product_metafield(store_domain: str, token: str, product_id: in
         return False, f"REST upsert error: {e}"
     return False, "REST upsert failed"
 
+@_instrumented("set_product_metafields")
 def set_product_metafields(token: str, store_domain: str, product_id: int, values: Dict[str, str]) -> Dict[str, Any]:
     """
     Zet metafields via GraphQL. Als dat nergens lukt: REST fallback (create/update).
+    Een eerder geleerde winnaar per label gaat rechtstreeks (1 call); gekende mislukkingen worden overgeslagen.
     Geeft een rapport terug voor logging.
     """
     report: Dict[str, Any] = {"written": [], "errors": [], "fallback": []}
@@ -675,46 +1802,718 @@ def set_product_metafields(token: str, store_domain: str, product_id: int, value
     mm = _ensure_meta_map(token, store_domain)
     gid = f"gid://shopify/Product/{int(product_id)}"
 
-    def try_graphql_then_rest(label: str, val: str, candidates: List[Dict[str, Any]], fallback_key: str):
+    def try_graphql_then_rest(plan_label: str, label: str, val: str, candidates: List[Dict[str, Any]], fallback_key: str):
+        plan = _write_plan(store_domain, mm, plan_label)
+
+        # 0) Geleerde winnaar
+        w = plan["winner"]
+        if w:
+            if w["via"] == "rest":
+                ok, msg = _rest_upsert_product_metafield(store_domain, token, product_id, w["namespace"], w["key"], w["type"], val)
+                if ok:
+                    report["fallback"].append(f"{label}:{w['namespace']}.{w['key']} [{w['type']}] {msg}")
+                    _metric_inc("seo_metafield_plan_total", result="hit")
+                    return
+            else:
+                ok, msg = _gql_set_one(token, store_domain, gid, w["namespace"], w["key"], w["type"], val)
+                if ok:
+                    report["written"].append(f"{label}:{w['namespace']}.{w['key']} [{w['type']}]={val}")
+                    _metric_inc("seo_metafield_plan_total", result="hit")
+                    return
+            _metric_inc("seo_metafield_plan_total", result="stale")
+            if w["via"] == "rest" or _is_definition_error(msg):
+                _save_write_plan(store_domain, mm, plan_label, winner=None,
+                                 failed=_cand_id(w["namespace"], w["key"], w["type"], val))
+        else:
+            _metric_inc("seo_metafield_plan_total", result="miss")
+        skip = plan["failed"]
+
         # 1) GraphQL: probeer alle kandidaten
-        wrote = False
         last_errs = []
         for cand in candidates:
             ns, key, tslug = cand["namespace"], cand["key"], _metafield_type_slug(cand["type"])
+            cid = _cand_id(ns, key, tslug, val)
+            if cid in skip: continue
             ok, msg = _gql_set_one(token, store_domain, gid, ns, key, tslug, val)
             if ok:
                 report["written"].append(f"{label}:{ns}.{key} [{tslug}]={val}")
-                wrote = True
-                break
+                _save_write_plan(store_domain, mm, plan_label, winner={"namespace": ns, "key": key, "type": tslug, "via": "gql"})
+                return
             else:
                 last_errs.append(f"{ns}.{key} [{tslug}] → {msg}")
-        if wrote:
-            return
+                if _is_definition_error(msg): _save_write_plan(store_domain, mm, plan_label, failed=cid)
 
         # 2) GraphQL fallback naar default namespace/key als niets gelukt
         ns = META_NAMESPACE_DEFAULT or "specs"
         # kies veilig type: integer als het een geheel getal is; anders single_line_text_field
         tslug = "number_integer" if str(val).isdigit() else "single_line_text_field"
-        ok, msg = _gql_set_one(token, store_domain, gid, ns, fallback_key, tslug, val)
-        if ok:
-            report["written"].append(f"{label}:{ns}.{fallback_key} [fallback-{tslug}]={val}")
-            return
-        report["errors"].append(f"GQL fail {label}: {last_errs + [f'{ns}.{fallback_key} → {msg}']}")
+        cid = _cand_id(ns, fallback_key, tslug, val)
+        if cid not in skip:
+            ok, msg = _gql_set_one(token, store_domain, gid, ns, fallback_key, tslug, val)
+            if ok:
+                report["written"].append(f"{label}:{ns}.{fallback_key} [fallback-{tslug}]={val}")
+                _save_write_plan(store_domain, mm, plan_label, winner={"namespace": ns, "key": fallback_key, "type": tslug, "via": "gql"})
+                return
+            if _is_definition_error(msg): _save_write_plan(store_domain, mm, plan_label, failed=cid)
+            report["errors"].append(f"GQL fail {label}: {last_errs + [f'{ns}.{fallback_key} → {msg}']}")
 
         # 3) REST ultimate fallback (create/update)
         rok, rmsg = _rest_upsert_product_metafield(store_domain, token, product_id, ns, fallback_key, tslug, val)
         if rok:
             report["fallback"].append(f"{label}:{ns}.{fallback_key} [{tslug}] {rmsg}")
+            _save_write_plan(store_domain, mm, plan_label, winner={"namespace": ns, "key": fallback_key, "type": tslug, "via": "rest"})
         else:
             report["errors"].append(f"REST fail {label}:{ns}.{fallback_key} [{tslug}] → {rmsg}")
 
     if values.get("height_cm"):
-        try_graphql_then_rest("hoogte_cm", values["height_cm"], mm.get("height_candidates", []), "height_cm")
+        try_graphql_then_rest("height_cm", "hoogte_cm", values["height_cm"], mm.get("height_candidates", []), "height_cm")
     if values.get("pot_diameter_cm"):
-        try_graphql_then_rest("pot_diameter_cm", values["pot_diameter_cm"], mm.get("diam_candidates", []), "pot_diameter_cm")
+        try_graphql_then_rest("pot_diameter_cm", "pot_diameter_cm", values["pot_diameter_cm"], mm.get("diam_candidates", []), "pot_diameter_cm")
 
     return report
 
+# =========================
+# Optimalisatie per product
+# =========================
+
+def _product_prompt(title: str, body: str, garden: bool) -> str:
+    base_prompt = (
+        f"Originele titel: {title}\n"
+        f"Originele beschrijving (HTML toegestaan): {body}\n"
+        "Taken:\n"
+        "1) Lever ‘Nieuwe titel’ volgens format.\n"
+        "2) Lever ‘Beschrijving’ (HTML) met vaste h3-secties en 4 regels.\n"
+        "3) Lever ‘Meta title’ (≤60) en ‘Meta description’ (≤155).\n"
+    )
+    if garden:
+        base_prompt += (
+            "\nVOOR TUINPLANTEN:\n"
+            "- Voeg ONDER 'Eigenschappen & behoeften' optioneel extra regels toe (alleen als je het met hoge zekerheid weet):\n"
+            "  <p><strong>Bloeiperiode</strong>: …</p>\n"
+            "  <p><strong>Plantperiode</strong>: …</p>\n"
+            "- Als je het NIET zeker weet: laat de regels weg.\n"
+            "- Gebruik korte maandenreeksen (bv. 'juni–september', 'najaar (sep–nov)').\n"
+        )
+    return base_prompt
+
+def _field_prompt(title: str, body: str, pieces: Dict[str, str], fields: Dict[str, str], garden: bool) -> str:
+    """Gerichte prompt: enkel `fields` (veld → probleem) opnieuw; de rest gaat mee als korte context."""
+    lines = [f"Originele titel: {title}"]
+    if "body_html" in fields:
+        lines.append(f"Originele beschrijving (HTML toegestaan): {body}")
+    else:
+        lines.append(f"Productinfo: {_short(_html_to_text(pieces.get('body_html') or body), 600)}")
+    for f in ("title", "meta_title"):
+        if f not in fields and pieces.get(f): lines.append(f"{FIELD_LABELS[f]} (behouden): {pieces[f]}")
+    lines.append("Lever enkel: " + "; ".join(FIELD_LABELS[f] + (f" (probleem: {why})" if why else "") for f, why in fields.items()))
+    if garden and "body_html" in fields:
+        lines.append("Tuinplant: voeg Bloeiperiode/Plantperiode enkel toe als je het zeker weet.")
+    return "\n".join(lines) + "\n"
+
+def _merge_fields(pieces: Dict[str, str], raw: str, fields: Any) -> Dict[str, str]:
+    """Neem enkel geldige nieuwe waarden over; een veld dat nog steeds faalt houdt zijn oude waarde."""
+    fix = split_ai_output(raw)
+    out = dict(pieces)
+    for f in fields:
+        v = _s(fix.get(f)).strip()
+        if not v and len(fields) == 1: v = (raw or "").strip()   # één veld, zonder label teruggegeven
+        if v and not validate_pieces({f: v}, (f,), lengths=False): out[f] = v
+    return out
+
+def _is_metas_only(ctx: Dict[str, Any], title: str, body: str) -> bool:
+    mode = ctx.get("mode", "full")
+    return mode == "metas" or (mode == "auto" and not validate_pieces({"title": title, "body_html": body}, ("title", "body_html")))
+
+# ---- Model-routing: eenvoudige producten → snel/goedkoop model, escalatie bij validatiefouten
+def route_score(title: str, body: str) -> Tuple[int, List[str]]:
+    """Complexiteit van één product (hoger = moeilijker) + redenen voor de routing-log."""
+    score, why = 0, []
+    n = len(_html_to_text(body).strip())
+    if n > 4000: score += 3; why.append("lange tekst")
+    elif n > 1200: score += 1; why.append("middellange tekst")
+    elif n < 80: score += 1; why.append("bijna geen tekst")
+    _, qty = analyze_bundle(title)
+    if qty and qty > 1: score += 2; why.append(f"{qty}x-verpakking")
+    if _detect_species_key(f"{title} {_short(_html_to_text(body), 400)}"): score += 1; why.append("tuinplant (seizoensregels)")
+    if not validate_pieces({"body_html": body}, ("body_html",)): score -= 1; why.append("gestructureerde tekst aanwezig")
+    return max(0, score), why
+
+def _route_for(title: str, body: str, metas_only: bool) -> Tuple[str, int, List[str]]:
+    score, why = route_score(title, body)
+    fast = bool(OPENAI_FAST_MODEL) and (metas_only or score <= ROUTE_FAST_MAX_SCORE)
+    return ("fast" if fast else "main"), score, why
+
+def _route_model(route: str) -> Tuple[str, float]:
+    if route == "fast" and OPENAI_FAST_MODEL: return OPENAI_FAST_MODEL, OPENAI_FAST_TEMP
+    return OPENAI_MODEL, OPENAI_TEMP
+
+def _record_route(ctx: Dict[str, Any], pid: int, route: str, score: int, why: List[str], seconds: float,
+                  escalated: bool) -> None:
+    r = ctx["routes"].setdefault(route, {"n": 0, "latencies": [], "escalated": 0})
+    r["n"] += 1; r["latencies"].append(seconds); r["escalated"] += int(escalated)
+    _metric_inc("seo_route_total", route=route, escalated=str(escalated).lower())
+    _metric_observe("seo_route_seconds", seconds, route=route)
+    _db().execute("INSERT INTO route_log (at, run_id, store, product_id, route, model, score, reasons, seconds, escalated) "
+                  "VALUES (?,?,?,?,?,?,?,?,?,?)", (time.time(), ctx["run_id"], ctx["store"], pid, route,
+                                                   _route_model(route)[0], score, ", ".join(why), seconds, int(escalated)))
+
+def _routing_event(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    routes = {k: {"n": v["n"], "escalated": v["escalated"], "p50": round(_percentile(v["latencies"], .5), 2),
+                  "p95": round(_percentile(v["latencies"], .95), 2)} for k, v in ctx["routes"].items()}
+    msg = "🔀 Routing: " + " · ".join(f"{k} ({_route_model(k)[0]}) {v['n']}× p50 {v['p50']}s p95 {v['p95']}s"
+                                      + (f", {v['escalated']} geëscaleerd" if v["escalated"] else "")
+                                      for k, v in sorted(routes.items()))
+    return _ev("routing", msg, routes=routes)
+
+def _regenerate_fields(ctx: Dict[str, Any], pid: int, title: str, body: str, pieces: Dict[str, str],
+                       fields: Dict[str, str], route: str = "main") -> Iterator[Dict[str, Any]]:
+    yield _ev("repair", "   • Gericht herschrijven: " + ", ".join(f"{FIELD_LABELS[f]} ({why})" for f, why in fields.items())
+              + (f" — geëscaleerd naar {OPENAI_MODEL}" if route != "main" else ""),
+              pid=pid, fields=fields, escalated=route != "main")
+    usage: Dict[str, Any] = {}
+    try:
+        raw = _openai_chat(_build_field_system_prompt(ctx["txn"], fields),
+                           _field_prompt(title, body, pieces, fields, ctx["garden"]), usage=usage)
+    finally:
+        _record_usage(ctx, usage)
+    ctx["repairs"] += 1
+    return _merge_fields(pieces, raw, list(fields))
+
+# ---- Dry-run: voorstellen bewaren + compacte diffs
+
+def _short(s: str, n: int = 70) -> str:
+    s = re.sub(r"\s+", " ", s or "").strip()
+    return s if len(s) <= n else s[:n - 1] + "…"
+
+def _compact_diff(before: Dict[str, Any], after: Dict[str, Any]) -> List[str]:
+    lines: List[str] = []
+    if before.get("title") != after.get("title"):
+        lines.append(f"Δ titel: '{_short(before.get('title'))}' → '{_short(after.get('title'))}'")
+    b_old, b_new = _s(before.get("body_html")), _s(after.get("body_html"))
+    if b_old != b_new:
+        ratio = difflib.SequenceMatcher(None, _html_to_text(b_old), _html_to_text(b_new), autojunk=True).ratio()
+        lines.append(f"Δ beschrijving: {len(b_old)} → {len(b_new)} tekens ({1 - ratio:.0%} gewijzigd)")
+    lines.append(f"Δ meta: '{_short(after.get('meta_title'), 60)}' | '{_short(after.get('meta_description'), 90)}'")
+    dims = after.get("dims") or {}
+    if dims:
+        lines.append("Δ metafields: " + ", ".join(f"{k}={v}" for k, v in dims.items()))
+    return lines
+
+def _save_preview(run_id: str, store: str, pid: int, before: Dict[str, Any], after: Dict[str, Any]) -> None:
+    _db().execute("INSERT OR REPLACE INTO previews (run_id, product_id, store, created, before, after, applied) "
+                  "VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                  (run_id, int(pid), store, time.time(), json.dumps(before), json.dumps(after)))
+
+def _load_previews(run_id: str, store: str, only_pending: bool = True) -> List[Dict[str, Any]]:
+    sql = "SELECT product_id, before, after, applied FROM previews WHERE run_id = ? AND store = ?"
+    if only_pending: sql += " AND applied IS NULL"
+    rows = _db().execute(sql + " ORDER BY product_id", (run_id, store)).fetchall()
+    return [{"id": r["product_id"], "before": json.loads(r["before"]), "after": json.loads(r["after"]),
+             "applied": r["applied"]} for r in rows]
+
+def _mark_applied(run_id: str, pids: List[int]) -> None:
+    now = time.time()
+    _db().executemany("UPDATE previews SET applied = ? WHERE run_id = ? AND product_id = ?",
+                      [(now, run_id, int(p)) for p in pids])
+
+def _run_ctx(store: str, token: str, txn: bool, garden: bool, **opts: Any) -> Dict[str, Any]:
+    """Status van één run; gedeeld door stream(), de webhook-queue en andere runners."""
+    return {"store": store, "token": token, "txn": txn, "sys_prompt": _build_system_prompt(txn),
+            "garden": garden, "family_dedup": opts.get("family_dedup", FAMILY_DEDUP),
+            "dry_run": opts.get("dry_run", False), "run_id": opts.get("run_id") or _new_run_id(),
+            "families": {}, "total_updated": 0, "ai_calls": 0, "derived": 0, "gen_latencies": [],
+            "outcomes": Counter(), "started": time.monotonic(),
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "cost_eur": 0.0, "calls": 0},
+            "budget_eur": opts.get("budget_eur") or 0.0, "budget_action": opts.get("budget_action") or "stop",
+            "mode": opts.get("mode") or GENERATION_MODE, "repairs": 0, "metas_only": 0, "routes": {},
+            "current": {}, "stages": {}, "duplicates": 0}
+
+def _ev(etype: str, msg: str = "", **fields: Any) -> Dict[str, Any]:
+    """Eén progress-event; `msg` is de leesbare regel (tekststream en logs)."""
+    return {"type": etype, "msg": msg, **fields}
+
+def _outcome(ctx: Dict[str, Any], result: str) -> None:
+    _product_done(result)
+    ctx["outcomes"][result] += 1
+
+def _metafields_event(pid: int, rep: Dict[str, Any]) -> Dict[str, Any]:
+    written, fallback, errors = len(rep["written"]), len(rep["fallback"]), rep["errors"]
+    msg = f"   • Metafields: {written} geschreven" + (f", {fallback} via REST" if fallback else "")
+    if errors: msg += f", {len(errors)} fout(en): {_short('; '.join(errors), 160)}"
+    return _ev("metafields", msg, pid=pid, written=written, fallback=fallback, errors=errors)
+
+def _run_metrics(ctx: Dict[str, Any], total: int) -> Dict[str, Any]:
+    o = ctx["outcomes"]
+    done = sum(o.values())
+    mins = max(1e-9, (time.monotonic() - ctx["started"]) / 60)
+    p95 = round(_percentile(ctx["gen_latencies"], .95), 2) if ctx["gen_latencies"] else None
+    u = ctx["usage"]
+    return _ev("metrics", "", done=done, total=total, outcomes=dict(o), per_minute=round(done / mins, 1),
+               ai_calls=ctx["ai_calls"], derived=ctx["derived"], gen_p95=p95,
+               tokens=u["prompt_tokens"] + u["completion_tokens"], cost_eur=round(u["cost_eur"], 4),
+               eur_per_minute=round(u["cost_eur"] / mins, 4))
+
+def _estimate_event(ctx: Dict[str, Any], sample: List[Dict[str, Any]], total: int) -> Dict[str, Any]:
+    """Kosten vooraf: promptgrootte over een steekproef (eerste batch) × verwachte AI-calls (na familie-dedup)."""
+    if not sample: return _ev("estimate", "", total=total)
+    sys_tokens = _approx_tokens(ctx["sys_prompt"])
+    metas_sys = _approx_tokens(_build_field_system_prompt(ctx["txn"], META_FIELDS))
+    completion = _avg_completion_tokens()
+    def prompt_cost(p: Dict[str, Any]) -> Tuple[int, float]:
+        t, b = _s(p.get("title")), _s(p.get("body_html"))
+        metas = _is_metas_only(ctx, t, b)
+        if metas:
+            n = metas_sys + _approx_tokens(_field_prompt(t, b, {"title": t, "body_html": b}, dict.fromkeys(META_FIELDS, ""), False))
+        else:
+            n = sys_tokens + _approx_tokens(_product_prompt(t, b, ctx["garden"]))
+        return n, _usage_cost(n, completion, _route_model(_route_for(t, b, metas)[0])[0])
+    costs = [prompt_cost(p) for p in sample]
+    prompt = sum(n for n, _ in costs) / len(sample)
+    fams = [family_key(_s(p.get("title")), _s(p.get("body_html"))) if ctx.get("family_dedup") else None for p in sample]
+    ratio = (len({f for f in fams if f}) + sum(1 for f in fams if not f)) / len(sample)
+    calls = max(1, round(total * ratio))
+    tokens = round(calls * (prompt + completion))
+    eur = calls * sum(c for _, c in costs) / len(sample)
+    msg = f"💶 Schatting: ~{calls} AI-calls, ~{tokens / 1000:.0f}k tokens ≈ €{eur:.2f}"
+    if ctx["budget_eur"]:
+        msg += f" (budget €{ctx['budget_eur']:.2f}{' — wordt waarschijnlijk overschreden' if eur > ctx['budget_eur'] else ''})"
+    return _ev("estimate", msg, total=total, ai_calls=calls, tokens=tokens, cost_eur=round(eur, 4),
+               budget_eur=ctx["budget_eur"] or None)
+
+def _budget_gate(ctx: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Budget bereikt? 'stop' → return True; 'pause' → wacht tot het budget verhoogd wordt (POST /api/runs/<id>/budget)."""
+    budget, cost = ctx["budget_eur"], ctx["usage"]["cost_eur"]
+    if not budget or cost < budget: return False
+    msg = f"💶 Budget €{budget:.2f} bereikt (verbruikt €{cost:.2f})"
+    if ctx["budget_action"] != "pause":
+        yield _ev("budget", msg + " — run gestopt.", action="stop", budget_eur=budget, cost_eur=round(cost, 4), run_id=ctx["run_id"])
+        return True
+    yield _ev("budget", msg + " — gepauzeerd; verhoog het budget om verder te gaan.", action="pause",
+              budget_eur=budget, cost_eur=round(cost, 4), run_id=ctx["run_id"])
+    waited = 0.0
+    while True:
+        time.sleep(2.0); waited += 2.0
+        row = _db().execute("SELECT budget_eur FROM run_budgets WHERE run_id=?", (ctx["run_id"],)).fetchone()
+        if row and row["budget_eur"] > cost:
+            ctx["budget_eur"] = row["budget_eur"]
+            yield _ev("resumed", f"▶️ Budget verhoogd naar €{row['budget_eur']:.2f}; run gaat verder.", budget_eur=row["budget_eur"])
+            return False
+        if waited >= 30:   # houdt de job annuleerbaar terwijl hij wacht
+            waited = 0.0
+            yield _ev("budget_wait", "", budget_eur=budget, cost_eur=round(cost, 4))
+
+def _finalize(ctx: Dict[str, Any], title: str, body: str, pieces: Dict[str, str], qty: Optional[int],
+              metas_only: bool) -> Dict[str, Any]:
+    with _timed("finalize"):
+        out = finalize_product(title, body, pieces, qty, ctx["txn"], ctx["garden"])
+    if metas_only: out.update(title=title, body_html=body)
+    return out
+
+def _optimize_product(ctx: Dict[str, Any], p: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Genereer + schrijf één product. Yieldt events (zie _ev); telt in ctx."""
+    store, token = ctx["store"], ctx["token"]
+    pid=int(p["id"])
+    title=_s(p.get("title",""))
+    body=_s(p.get("body_html",""))
+
+    skip_bundle, qty = analyze_bundle(title)
+    if skip_bundle:
+        _outcome(ctx, "skipped")
+        yield _ev("product_skipped", f"⏭️ #{pid}: overgeslagen (bundel met verschillende producten)", pid=pid, reason="bundel")
+        return
+
+    metas_only = _is_metas_only(ctx, title, body)
+    fam = family_key(title, body) if ctx.get("family_dedup") else None
+    if fam and metas_only: fam += "|metas"
+    leader = ctx["families"].get(fam) if fam else None
+
+    try:
+        if leader:
+            yield _ev("product_started", f"→ #{pid}: afgeleid van familie #{leader['pid']} (geen AI-call)",
+                      pid=pid, title=title, source="family", leader=leader["pid"])
+            pieces = derive_sibling_pieces(leader["pieces"], leader["variant"], variant_info(title, body))
+            if metas_only: pieces.update(title=title, body_html=body)
+            ctx["derived"] += 1
+        else:
+            route, score, why = _route_for(title, body, metas_only)
+            model, temp = _route_model(route)
+            via = f" [{model}]" if OPENAI_FAST_MODEL else ""
+            t0 = time.monotonic()
+            usage: Dict[str, Any] = {}
+            try:
+                if metas_only:
+                    yield _ev("product_started", f"→ #{pid}: enkel metas vernieuwen{via}...", pid=pid, title=title,
+                              source="metas", route=route, score=score)
+                    fields = dict.fromkeys(META_FIELDS, "")
+                    ai_raw = _openai_chat(_build_field_system_prompt(ctx["txn"], fields),
+                                          _field_prompt(title, body, {"title": title, "body_html": body}, fields, ctx["garden"]),
+                                          usage=usage, model=model, temperature=temp)
+                    pieces = _merge_fields({"title": title, "body_html": body}, ai_raw, META_FIELDS)
+                    ctx["metas_only"] += 1
+                else:
+                    yield _ev("product_started", f"→ #{pid}: AI-tekst genereren{via}...", pid=pid, title=title,
+                              source="ai", route=route, score=score)
+                    ai_raw=_openai_chat(ctx["sys_prompt"], _product_prompt(title, body, ctx["garden"]), usage=usage,
+                                        model=model, temperature=temp)
+                    with _timed("split_ai_output"):
+                        pieces = split_ai_output(ai_raw)
+            finally:   # ook als de call faalt: betaalde tokens boeken
+                _record_usage(ctx, usage)
+            ctx["gen_latencies"].append(time.monotonic() - t0)
+            ctx["ai_calls"] += 1
+            bad = validate_pieces(pieces, META_FIELDS if metas_only else FIELD_ORDER, lengths=False)
+            if bad:
+                pieces = yield from _regenerate_fields(ctx, pid, title, body, pieces, bad, route)
+            _record_route(ctx, pid, route, score, why, time.monotonic() - t0, escalated=bool(bad) and route != "main")
+            if fam:
+                ctx["families"][fam] = {"pid": pid, "pieces": pieces, "variant": variant_info(title, body)}
+
+        out = _finalize(ctx, title, body, pieces, qty, metas_only)
+        short = {} if leader else validate_pieces(out, META_FIELDS)
+        if short:   # ook na finalize_meta_* nog buiten de grenzen (bv. te korte description)
+            pieces = yield from _regenerate_fields(ctx, pid, title, body, pieces, short, route)
+            out = _finalize(ctx, title, body, pieces, qty, metas_only)
+            if fam: ctx["families"][fam]["pieces"] = pieces
+        dups: Dict[str, Tuple[int, float]] = {}
+        if DUP_DETECT:
+            family = _dup_family(title, body)
+            dups = find_duplicates(store, pid, _dup_texts(out), family)
+            fix = {DUP_FIELDS[f]: f"te gelijkend op #{o} ({sim:.0%}), schrijf het anders" for f, (o, sim) in dups.items()
+                   if not (metas_only and f == "body")}
+            if fix and not leader:   # één gerichte herschrijving van enkel de botsende velden
+                pieces = yield from _regenerate_fields(ctx, pid, title, body, pieces, fix, route)
+                out = _finalize(ctx, title, body, pieces, qty, metas_only)
+                dups = find_duplicates(store, pid, _dup_texts(out), family)
+            ctx["duplicates"] += len(dups)
+            yield from _duplicate_events(pid, dups)
+        final_title, dims = out["title"], out["dims"]
+
+        if ctx.get("dry_run"):
+            before = {"title": title, "body_html": body}
+            _save_preview(ctx["run_id"], store, pid, before, out)
+            diff = _compact_diff(before, out)
+            if diff: yield _ev("product_diff", "\n".join(f"   {line}" for line in diff), pid=pid, diff=diff)
+            ctx["total_updated"] += 1
+            _outcome(ctx, "previewed")
+            yield _ev("product_done", f"✅ #{pid} voorstel opgeslagen: {final_title}", pid=pid, title=final_title,
+                      result="previewed", run_id=ctx["run_id"])
+            return
+
+        _snapshot_products(ctx["run_id"], store, token, [pid], ctx["current"])
+        update_product_texts(store, token, pid, final_title, out["body_html"], out["meta_title"], out["meta_description"])
+        if DUP_DETECT: _dup_record(store, pid, _dup_texts(out), family, dups)
+
+        # Metafields
+        missing = {}
+        if dims.get("height_cm"):       missing["height_cm"] = dims["height_cm"]
+        if dims.get("pot_diameter_cm"): missing["pot_diameter_cm"] = dims["pot_diameter_cm"]
+
+        if missing:
+            yield _metafields_event(pid, set_product_metafields(token, store, pid, missing))
+        else:
+            yield _ev("metafields", "   • Metafields: geen waarden gevonden in titel/tekst", pid=pid, written=0, fallback=0, errors=[])
+
+        ctx["total_updated"] += 1
+        _outcome(ctx, "updated")
+        yield _ev("product_done", f"✅ #{pid} bijgewerkt: {final_title}", pid=pid, title=final_title, result="updated")
+
+    except Exception as e:
+        _outcome(ctx, "failed")
+        yield _ev("product_done", f"❌ Fout bij product #{pid}: {e}", pid=pid, result="failed", error=str(e))
+
+# =========================
+# Dubbele content: MinHash + LSH over beschrijving en meta description (per store, in SQLite)
+# =========================
+# Elke tekst → 64 minhashes over woord-3-grams; 16 banden × 4 rijen. Producten die in minstens één
+# band dezelfde bucket delen zijn kandidaten; enkel die worden vergeleken (≈ lineair over de catalogus).
+
+DUP_PERMUTATIONS, DUP_BANDS = 64, 16
+DUP_MIN_SHINGLES = 5
+DUP_FIELDS = {"body": "body_html", "meta": "meta_description"}
+RE_DUP_WORD = re.compile(r"[a-zà-ÿ]+")   # zonder cijfers: andere maten maken een tekst niet uniek
+_MH_PRIME = (1 << 61) - 1
+_MH_RAND = random.Random(0x5EED)
+_MH_PERMS = [(_MH_RAND.randrange(1, _MH_PRIME), _MH_RAND.randrange(0, _MH_PRIME)) for _ in range(DUP_PERMUTATIONS)]
+
+def _shingles(text: str) -> set:
+    words = RE_DUP_WORD.findall(html.unescape(_html_to_text(text)).lower())
+    grams = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))] if words else []
+    return {int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "big") for g in grams}
+
+def minhash(text: str) -> Optional[Tuple[int, ...]]:
+    """MinHash-signatuur; None voor teksten die te kort zijn om iets over te zeggen."""
+    sh = _shingles(text)
+    if len(sh) < DUP_MIN_SHINGLES: return None
+    return tuple(min((a * x + b) % _MH_PRIME for x in sh) for a, b in _MH_PERMS)
+
+def _sig_similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+def _sig_pack(sig: Tuple[int, ...]) -> bytes:
+    return b"".join(v.to_bytes(8, "big") for v in sig)
+
+def _sig_unpack(raw: bytes) -> Tuple[int, ...]:
+    return tuple(int.from_bytes(raw[i:i + 8], "big") for i in range(0, len(raw), 8))
+
+def _band_keys(sig: Tuple[int, ...]) -> List[str]:
+    rows = len(sig) // DUP_BANDS
+    return [f"{b}:{hashlib.blake2b(_sig_pack(sig[b * rows:(b + 1) * rows]), digest_size=8).hexdigest()}"
+            for b in range(DUP_BANDS)]
+
+def _dup_texts(out: Dict[str, Any]) -> Dict[str, str]:
+    return {f: _s(out.get(k)) for f, k in DUP_FIELDS.items()}
+
+def _dup_family(title: str, body_html: str) -> str:
+    # zusterproducten (andere maat/potkleur) mogen op elkaar lijken
+    return family_key(title, body_html) or ""
+
+def find_duplicates(store: str, pid: int, texts: Dict[str, str], family: str) -> Dict[str, Tuple[int, float]]:
+    """{veld: (ander product, gelijkenis)} voor de beste match ≥ DUP_THRESHOLD per veld."""
+    found: Dict[str, Tuple[int, float]] = {}
+    for field, text in texts.items():
+        sig = minhash(text)
+        if sig is None: continue
+        keys = _band_keys(sig)
+        rows = _db().execute(
+            "SELECT product_id, sig, family FROM dup_signatures WHERE store=? AND field=? AND product_id != ? AND product_id IN "
+            f"(SELECT product_id FROM dup_bands WHERE store=? AND field=? AND bk IN ({','.join('?' * len(keys))}))",
+            (store, field, pid, store, field, *keys)).fetchall()
+        best = None
+        for r in rows:
+            if family and r["family"] == family: continue
+            sim = _sig_similarity(sig, _sig_unpack(r["sig"]))
+            if sim >= DUP_THRESHOLD and (best is None or sim > best[1]): best = (int(r["product_id"]), sim)
+        if best: found[field] = best
+    return found
+
+def _dup_record(store: str, pid: int, texts: Dict[str, str], family: str, dups: Dict[str, Tuple[int, float]]) -> None:
+    """Vervang de signaturen + banden van één product en zijn vlaggen (incrementeel, per product).
+    Vlaggen van andere producten tegen dit product vervallen ook: de tekst waarop ze botsten bestaat niet meer."""
+    conn, now = _db(), time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM dup_bands WHERE store=? AND product_id=?", (store, pid))
+        conn.execute("DELETE FROM dup_signatures WHERE store=? AND product_id=?", (store, pid))
+        conn.execute("DELETE FROM dup_flags WHERE store=? AND product_id=?", (store, pid))
+        conn.execute("DELETE FROM dup_flags WHERE store=? AND other_id=?", (store, pid))
+        for field, text in texts.items():
+            sig = minhash(text)
+            if sig is None: continue
+            conn.execute("INSERT INTO dup_signatures (store, field, product_id, sig, family, updated) VALUES (?,?,?,?,?,?)",
+                         (store, field, pid, _sig_pack(sig), family, now))
+            conn.executemany("INSERT OR IGNORE INTO dup_bands (store, field, bk, product_id) VALUES (?,?,?,?)",
+                             [(store, field, k, pid) for k in _band_keys(sig)])
+        conn.executemany("INSERT INTO dup_flags (store, product_id, field, other_id, similarity, flagged) VALUES (?,?,?,?,?,?)",
+                         [(store, pid, f, o, sim, now) for f, (o, sim) in dups.items()])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK"); raise
+
+def _dup_reindex(store: str, pid: int, title: str, body_html: str, out: Dict[str, Any]) -> Dict[str, Tuple[int, float]]:
+    """Index bijwerken na een schrijfactie buiten _optimize_product (apply, rollback)."""
+    family, texts = _dup_family(title, body_html), _dup_texts(out)
+    dups = find_duplicates(store, pid, texts, family)
+    _dup_record(store, pid, texts, family, dups)
+    return dups
+
+def _duplicate_events(pid: int, dups: Dict[str, Tuple[int, float]]) -> Iterator[Dict[str, Any]]:
+    for field, (other, sim) in dups.items():
+        _metric_inc("seo_duplicates_total", field=field)
+        yield _ev("duplicate", f"   • ⚠️ {FIELD_LABELS[DUP_FIELDS[field]]} lijkt op #{other} ({sim:.0%}) — gemarkeerd",
+                  pid=pid, field=field, other=other, similarity=round(sim, 3))
+
+def _flagged_products(store: str) -> List[int]:
+    return [r[0] for r in _db().execute("SELECT DISTINCT product_id FROM dup_flags WHERE store=? ORDER BY product_id", (store,))]
+
+# =========================
+# Jobs: runs in een achtergrondthread + event-stream (NDJSON / SSE / tekst) met resume
+# =========================
+
+class _Job:
+    """Eén run; events krijgen een oplopend id en gaan naar een begrensde buffer + SQLite.
+
+    Lezers volgen met een cursor (laatst gezien id). Loopt een lezer meer dan JOB_EVENT_BUFFER
+    events achter, dan wacht de producent (begrensd) — backpressure i.p.v. een groeiende buffer.
+    Wie buiten het geheugenvenster valt (of op een andere worker zit) leest uit SQLite.
+    """
+
+    def __init__(self, kind: str, store: str) -> None:
+        self.id = _new_run_id()
+        self.kind, self.store = kind, store
+        self.events: deque = deque(maxlen=JOB_EVENT_BUFFER)
+        self.seq = 0
+        self.done = False
+        self.cancelled = False
+        self.cv = threading.Condition()
+        self.thread_ident: Optional[int] = None
+        self.readers: Dict[int, int] = {}
+        self.idle_since = time.monotonic()
+        self._cancel_checked = time.monotonic()
+        _db().execute("INSERT INTO jobs (job_id, kind, store, created) VALUES (?,?,?,?)",
+                      (self.id, kind, store, time.time()))
+
+    def emit(self, ev: Dict[str, Any]) -> None:
+        with self.cv:
+            limit = time.monotonic() + 2 * JOB_HEARTBEAT_SECONDS
+            while (self.readers and self.seq - min(self.readers.values()) >= JOB_EVENT_BUFFER
+                   and time.monotonic() < limit):
+                self.cv.wait(0.5)
+            self.seq += 1
+            ev = {"id": self.seq, "ts": round(time.time(), 3), **ev}
+            self.events.append(ev)
+            self.cv.notify_all()
+        with _timed("encode"):
+            raw = json.dumps(ev, ensure_ascii=False)
+        _db().execute("INSERT INTO job_events (job_id, seq, ev) VALUES (?,?,?)", (self.id, ev["id"], raw))
+
+    def should_stop(self) -> bool:
+        """Geannuleerd (ook via een andere worker) of al te lang zonder lezer."""
+        now = time.monotonic()
+        if not self.cancelled and now - self._cancel_checked >= 2:
+            self._cancel_checked = now
+            row = _db().execute("SELECT cancel FROM jobs WHERE job_id=?", (self.id,)).fetchone()
+            self.cancelled = bool(row and row["cancel"])
+        with self.cv:
+            orphaned = not self.readers and now - self.idle_since > JOB_ORPHAN_SECONDS
+        return self.cancelled or orphaned
+
+    def read(self, after: int, reader: int, timeout: float) -> Tuple[Optional[List[Dict[str, Any]]], bool]:
+        """(events na `after` of None als ze niet meer in het geheugen zitten, klaar?)."""
+        with self.cv:
+            self.readers[reader] = after
+            self.cv.notify_all()
+            if self.seq <= after and not self.done:
+                self.cv.wait(timeout)
+            first = self.events[0]["id"] if self.events else self.seq + 1
+            evs = list(itertools.islice(self.events, after + 1 - first, None)) if after + 1 >= first else None
+            return evs, self.done and after + len(evs or ()) >= self.seq
+
+    def detach(self, reader: int) -> None:
+        with self.cv:
+            self.readers.pop(reader, None)
+            if not self.readers: self.idle_since = time.monotonic()
+            self.cv.notify_all()
+
+    def finish(self) -> None:
+        _db().execute("UPDATE jobs SET finished=? WHERE job_id=?", (time.time(), self.id))
+        with self.cv:
+            self.done = True
+            self.cv.notify_all()
+
+_JOBS: Dict[str, _Job] = {}
+_JOBS_LOCK = threading.Lock()
+_READER_IDS = itertools.count(1)
+
+def _prune_jobs() -> None:
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    conn = _db()
+    old = [r["job_id"] for r in conn.execute("SELECT job_id FROM jobs WHERE created < ?", (cutoff,))]
+    for job_id in old:
+        conn.execute("DELETE FROM job_events WHERE job_id=?", (job_id,))
+        conn.execute("DELETE FROM jobs WHERE job_id=?", (job_id,))
+    with _JOBS_LOCK:
+        for job_id, job in list(_JOBS.items()):
+            if job.done and time.monotonic() - job.idle_since > JOB_ORPHAN_SECONDS and not job.readers:
+                del _JOBS[job_id]
+
+def _start_job(kind: str, store: str, events: Iterator[Dict[str, Any]]) -> _Job:
+    """Draai een event-generator los van de HTTP-verbinding; de client mag weg- en terugkomen."""
+    _prune_jobs()
+    job = _Job(kind, store)
+    with _JOBS_LOCK: _JOBS[job.id] = job
+
+    def run() -> None:
+        try:
+            job.emit(_ev("job_started", "", job_id=job.id, kind=kind))
+            for ev in events:
+                job.emit(ev)
+                if job.should_stop():
+                    events.close()
+                    job.emit(_ev("cancelled", "⏹ Job geannuleerd."))
+                    break
+        except Exception as e:
+            job.emit(_ev("error", f"⚠️ Beëindigd met fout: {e}"))
+        finally:
+            job.finish()
+
+    t = threading.Thread(target=run, name=f"job-{job.id}", daemon=True)
+    t.start()
+    job.thread_ident = t.ident
+    return job
+
+def _job_events_db(job_id: str, after: int, limit: int = 500) -> List[Dict[str, Any]]:
+    rows = _db().execute("SELECT ev FROM job_events WHERE job_id=? AND seq>? ORDER BY seq LIMIT ?",
+                         (job_id, after, limit)).fetchall()
+    return [json.loads(r["ev"]) for r in rows]
+
+def _job_reader(job_id: str, after: int) -> Iterator[List[Dict[str, Any]]]:
+    """Reeksen events na `after`; een lege lijst = heartbeat-moment."""
+    job = _JOBS.get(job_id)
+    if job:
+        reader = next(_READER_IDS)
+        try:
+            while True:
+                evs, done = job.read(after, reader, JOB_HEARTBEAT_SECONDS)
+                if evs is None: evs = _job_events_db(job_id, after)
+                if evs: after = evs[-1]["id"]
+                if evs or not done: yield evs
+                if done: return
+        finally:
+            job.detach(reader)
+    # job draait op een andere worker (of is al afgelopen): volg via SQLite
+    quiet = 0.0
+    while True:
+        row = _db().execute("SELECT finished FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        evs = _job_events_db(job_id, after)
+        if evs:
+            after = evs[-1]["id"]; quiet = 0.0
+            yield evs
+            continue
+        if row is None or row["finished"]: return
+        time.sleep(1.0); quiet += 1.0
+        if quiet >= JOB_HEARTBEAT_SECONDS:
+            quiet = 0.0
+            yield []
+
+_STREAM_MIMETYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream", "text": "text/plain"}
+
+def _stream_format() -> str:
+    fmt = (request.args.get("format") or "").lower()
+    if fmt in _STREAM_MIMETYPES: return fmt
+    accept = request.headers.get("Accept", "")
+    if "text/event-stream" in accept: return "sse"
+    if "application/x-ndjson" in accept: return "ndjson"
+    return "text"
+
+def _render_events(evs: List[Dict[str, Any]], fmt: str) -> str:
+    if not evs:
+        if fmt == "text": return ""
+        hb = json.dumps({"type": "heartbeat", "ts": round(time.time(), 3)})
+        return f"event: heartbeat\ndata: {hb}\n\n" if fmt == "sse" else hb + "\n"
+    if fmt == "sse":
+        return "".join(f"id: {e['id']}\nevent: {e['type']}\ndata: {json.dumps(e, ensure_ascii=False)}\n\n" for e in evs)
+    if fmt == "ndjson":
+        return "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in evs)
+    return "".join(e["msg"] + "\n" for e in evs if e.get("msg"))
+
+def _job_response(job_id: str, after: int = 0) -> Response:
+    """Stream de events van een job. Formaat via ?format= of Accept; gzip via ?gzip=1 (sync-flush per chunk)."""
+    fmt = _stream_format()
+    gz = request.args.get("gzip") in ("1", "true") and bool(request.accept_encodings["gzip"])
+
+    def body() -> Iterator[bytes]:
+        z = zlib.compressobj(6, zlib.DEFLATED, 31) if gz else None
+        if fmt == "sse": yield b"retry: 3000\n\n" if not z else z.compress(b"retry: 3000\n\n")
+        for evs in _job_reader(job_id, after):
+            chunk = _render_events(evs, fmt).encode("utf-8")
+            if not chunk: continue
+            yield z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH) if z else chunk
+        if z: yield z.flush()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Job-Id": job_id}
+    if gz: headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return Response(body(), mimetype=_STREAM_MIMETYPES[fmt], headers=headers)
+
 # =========================
 # Auth & UI
 # =========================
@@ -748,7 +2547,6 @@ button{padding:12px 16px;border:0;border-radius:12px;background:#4f7dff;color:#f
 DASHBOARD_HTML = """<!doctype html><html lang="nl"><head>
 <meta charset="utf-8"/><meta name="viewport" content="width=device-width,initial-scale=1"/>
 <title>Belle Flora SEO Optimizer</title>
-<meta name="csrf" content="{{CSRF}}">
 <style>
 body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Helvetica,Arial,sans-serif;background:#0b1020;color:#eef;margin:0}
 .wrap{max-width:1100px;margin:28px auto;padding:0 16px}
@@ -776,6 +2574,7 @@ pre{white-space:pre-wrap}
     <div style="margin-top:10px">
       <button onclick="saveCreds()">Opslaan</button>
       <button onclick="loadCollections()">Collecties laden</button>
+      <button onclick="loadCollections(true)" title="Opnieuw ophalen bij Shopify (nieuwe of hernoemde collecties)">Vernieuwen</button>
       <span id="cstatus" class="pill">Nog niet geladen</span>
     </div>
   </div>
@@ -789,23 +2588,46 @@ pre{white-space:pre-wrap}
       <span id="pstatus" class="pill">Geen producten geladen</span>
     </div>
 
+    <div style="margin-top:10px" class="row">
+      <div><label>Zoek in titels</label><input id="psearch" placeholder="bv. monstera" oninput="searchChanged()"></div>
+      <div><label>Zoekwijze</label><select id="pmatch" onchange="searchChanged()"><option value="contains">bevat</option><option value="prefix">begint met</option></select></div>
+    </div>
+
     <div style="margin-top:10px">
-      <label>Producten in de geselecteerde collecties (de-selecteer wat je wil overslaan)</label>
-      <select id="products" multiple size="12" style="height:260px"></select>
+      <label><input type="checkbox" id="allMatching" checked> Alle producten die aan de filter voldoen (de-selecteer wat je wil overslaan)</label>
+      <select id="products" multiple size="12" style="height:260px" onscroll="maybeMore()"></select>
+      <button id="btnMore" onclick="loadMoreProducts()" style="margin-top:6px" disabled>Meer laden</button>
     </div>
 
     <div style="margin-top:12px">
       <label><input type="checkbox" id="txn" checked> Transactiefocus (koopwoorden + USP’s)</label>
       <div style="opacity:.8;margin-top:4px;font-size:12px;">USP’s: Gratis verzending vanaf €49 | Binnen 3 werkdagen geleverd | Soepel retourbeleid | Europese kwekers | Top kwaliteit</div>
     </div>
+    <div style="margin-top:12px">
+      <label><input type="checkbox" id="dryrun"> Dry-run (enkel voorstel + diff, niets schrijven)</label>
+    </div>
+    <div style="margin-top:12px">
+      <label>Modus</label>
+      <select id="mode"><option value="full">Volledig herschrijven</option><option value="auto">Automatisch (enkel metas als titel + tekst al goed zijn)</option><option value="metas">Enkel meta title + description</option></select>
+    </div>
+    <div style="margin-top:12px" class="row">
+      <div><label>Budget per run (€, leeg = geen)</label><input id="budget" type="number" min="0" step="0.5" placeholder="geen"></div>
+      <div><label>Bij budget bereikt</label><select id="budgetAction"><option value="stop">stoppen</option><option value="pause">pauzeren</option></select></div>
+    </div>
     <div style="margin-top:12px">
       <button id="btnRun" onclick="optimizeSelected()">Optimaliseer geselecteerde producten</button>
+      <button id="btnApply" onclick="applyLastRun()" disabled>Pas laatste dry-run toe</button>
+      <button id="btnBackfill" onclick="backfillSelected()">Maten-metafields aanvullen (zonder AI)</button>
+      <button id="btnRollback" onclick="rollbackRun()">Run terugdraaien</button>
+      <button id="btnDupScan" onclick="scanDuplicates()">Dubbele teksten zoeken</button>
+      <button id="btnDupFix" onclick="optimizeSelected(true)">Dubbels herschrijven</button>
       <button id="btnCancel" onclick="cancelJob()" disabled>Annuleer</button>
     </div>
   </div>
 
   <div class="card">
     <small>Live status</small>
+    <div id="counters" class="pill" style="margin:6px 0">–</div>
     <pre id="status">Klaar om te starten…</pre>
   </div>
 </div>
@@ -813,11 +2635,15 @@ pre{white-space:pre-wrap}
 <script>
 function qs(s){return document.querySelector(s);}
 function setLog(t){qs('#status').textContent = t}
-function addLog(t){qs('#status').textContent += '\\n' + t}
+const LOG_MAX=300;  // enkel de laatste regels tonen; voortgang staat in de tellers
+function addLog(t){const el=qs('#status'); el.textContent=(el.textContent+'\\n'+t).split('\\n').slice(-LOG_MAX).join('\\n');}
 
-const CSRF = document.querySelector('meta[name="csrf"]').content;
+// de shell is statisch (gzip + ETag, gecachet); het CSRF-token komt apart
+let CSRF='';
+const CSRF_READY=fetch('/api/csrf',{cache:'no-store'}).then(r=>r.json()).then(d=>{ CSRF=d.csrf; });
 
-function post(url, body){
+async function post(url, body){
+  await CSRF_READY;
   return fetch(url, {
     method:'POST',
     headers:{'Content-Type':'application/json','X-CSRF-Token':CSRF},
@@ -837,12 +2663,12 @@ async function saveCreds(){
   }catch(e){ alert('Netwerkfout: ' + e.message); }
 }
 
-async function loadCollections(){
+async function loadCollections(refresh){
   setLog('Collecties laden…');
   try{
     const store=(qs('#store')?.value||'').trim();
     const token=(qs('#token')?.value||'').trim();
-    const res=await post('/api/collections', {store, token});
+    const res=await post('/api/collections', {store, token, refresh:!!refresh});
     const data=await res.json().catch(()=>null);
     if(!res.ok){
       addLog('❌ ' + (data && data.error ? data.error : ('Fout '+res.status)));
@@ -855,46 +2681,192 @@ async function loadCollections(){
   }catch(e){ addLog('❌ Netwerkfout: '+e.message); }
 }
 
+let PICK={cursor:null,total:0,loading:false,excluded:new Set()}, searchTimer=null;
+function pickerBody(extra){
+  return Object.assign({store:(qs('#store')?.value||'').trim(), token:(qs('#token')?.value||'').trim(),
+    collection_ids:Array.from(qs('#collections').selectedOptions).map(o=>o.value),
+    q:(qs('#psearch')?.value||'').trim(), match:qs('#pmatch').value}, extra||{});
+}
 async function loadProductsForCollections(){
   setLog('Producten ophalen…');
-  const ids=Array.from(qs('#collections').selectedOptions).map(o=>o.value);
-  if(ids.length===0){ addLog('Kies eerst 1 of meer collecties.'); return; }
-  const store=(qs('#store')?.value||'').trim();
-  const token=(qs('#token')?.value||'').trim();
+  if(qs('#collections').selectedOptions.length===0){ addLog('Kies eerst 1 of meer collecties.'); return; }
+  qs('#products').innerHTML=''; PICK={cursor:null,total:0,loading:false,excluded:new Set()};
+  if(await loadMoreProducts()) addLog('✅ Producten geladen.');
+}
+async function loadMoreProducts(){
+  if(PICK.loading) return false; PICK.loading=true;
   try{
-    const res = await post('/api/collection-products',{store, token, collection_ids: ids});
+    const res = await post('/api/products/search', pickerBody({cursor:PICK.cursor, limit:100}));
     const data = await res.json().catch(()=>null);
-    if(!res.ok){ addLog('❌ ' + (data && data.error ? data.error : ('Fout '+res.status))); return; }
-    const sel=qs('#products'); sel.innerHTML='';
-    (data||[]).forEach(p=>{
+    if(!res.ok){ addLog('❌ ' + (data && data.error ? data.error : ('Fout '+res.status))); return false; }
+    const sel=qs('#products'); const frag=document.createDocumentFragment();
+    (data.items||[]).forEach(p=>{
       const o=document.createElement('option');
-      o.value=String(p.id); o.textContent=`#${p.id} — ${p.title}`; o.selected=true;
-      sel.appendChild(o);
+      o.value=String(p.id); o.textContent=`#${p.id} — ${p.title}`; o.selected=!PICK.excluded.has(o.value);
+      frag.appendChild(o);
     });
-    qs('#pstatus').textContent = `${(data||[]).length} producten geladen (alles geselecteerd)`;
-    addLog('✅ Producten geladen.');
-  }catch(e){ addLog('❌ Netwerkfout: '+e.message); }
+    sel.appendChild(frag);
+    PICK.cursor=data.next_cursor; PICK.total=data.total;
+    qs('#btnMore').disabled=!PICK.cursor;
+    qs('#pstatus').textContent = `${sel.options.length} van ${PICK.total} producten getoond`;
+    return true;
+  }catch(e){ addLog('❌ Netwerkfout: '+e.message); return false; }
+  finally{ PICK.loading=false; }
+}
+function maybeMore(){ const s=qs('#products'); if(PICK.cursor && s.scrollTop+s.clientHeight>=s.scrollHeight-40) loadMoreProducts(); }
+function searchChanged(){ clearTimeout(searchTimer); searchTimer=setTimeout(()=>{ if(qs('#collections').selectedOptions.length) loadProductsForCollections(); }, 300); }
+function pickerSelection(){
+  // "alles wat matcht" → filter + expliciet uitgevinkte ID's; anders enkel de aangevinkte (geladen) opties
+  const opts=Array.from(qs('#products').options);
+  opts.forEach(o=>{ if(o.selected) PICK.excluded.delete(o.value); else PICK.excluded.add(o.value); });
+  if(qs('#allMatching').checked){
+    const b=pickerBody();
+    return {select:{collection_ids:b.collection_ids, q:b.q, match:b.match, exclude_ids:Array.from(PICK.excluded)}};
+  }
+  return {product_ids: opts.filter(o=>o.selected).map(o=>o.value)};
 }
 
 let abortCtrl=null, RUN=false;
-async function optimizeSelected(){
-  if(RUN) return; RUN=true; qs('#btnCancel').disabled=false; setLog('Start optimalisatie…');
+async function optimizeSelected(duplicates){
+  if(RUN) return; RUN=true; qs('#btnCancel').disabled=false; setLog(duplicates ? 'Dubbels herschrijven…' : 'Start optimalisatie…');
   abortCtrl=new AbortController();
   const collection_ids=Array.from(qs('#collections').selectedOptions).map(o=>o.value);
-  const product_ids=Array.from(qs('#products').selectedOptions).map(o=>o.value);
   const store=(qs('#store')?.value||'').trim();
   const token=(qs('#token')?.value||'').trim();
-  const body={store, token, collection_ids, product_ids, txn: qs('#txn').checked};
-  const res=await fetch('/api/optimize',{method:'POST',signal:abortCtrl.signal,headers:{'Content-Type':'application/json','X-CSRF-Token':CSRF},body:JSON.stringify(body)});
-  if(!res.ok){ addLog('❌ '+res.status); RUN=false; qs('#btnCancel').disabled=true; return; }
-  const reader=res.body.getReader(); const dec=new TextDecoder();
-  while(true){ const {value,done}=await reader.read(); if(done) break; addLog(dec.decode(value));}
-  RUN=false; qs('#btnCancel').disabled=true;
+  const body=Object.assign({store, token, collection_ids, txn: qs('#txn').checked, dry_run: qs('#dryrun').checked,
+    budget_eur: parseFloat(qs('#budget').value)||0, budget_action: qs('#budgetAction').value, mode: qs('#mode').value,
+    duplicates: !!duplicates}, pickerSelection());
+  await streamTo('/api/optimize', body);
+}
+async function scanDuplicates(){
+  if(RUN) return; RUN=true; qs('#btnCancel').disabled=false; setLog('Dubbele teksten zoeken…');
+  abortCtrl=new AbortController();
+  const store=(qs('#store')?.value||'').trim();
+  const token=(qs('#token')?.value||'').trim();
+  await streamTo('/api/duplicates/scan',
+    Object.assign({store, token, collection_ids: Array.from(qs('#collections').selectedOptions).map(o=>o.value)}, pickerSelection()));
+}
+let LAST_RUN=null, BACKFILL_RUN=null, ROLLBACK_ID=null, WRITE_RUN=null, JOB=null, LAST_EVENT=0, FINISHED=false, STATS={};
+function resetStats(){ STATS={total:0,done:0,updated:0,previewed:0,skipped:0,failed:0,per_minute:0,gen_p95:null,cost_eur:0,tokens:0}; showStats(); }
+function showStats(){
+  qs('#counters').textContent=`${STATS.done}/${STATS.total} verwerkt · ✅ ${STATS.updated+STATS.previewed} · ⏭ ${STATS.skipped} · ❌ ${STATS.failed} · ${STATS.per_minute}/min`
+    + (STATS.gen_p95!=null ? ` · p95 ${STATS.gen_p95}s` : '')
+    + (STATS.tokens ? ` · 💶 €${STATS.cost_eur.toFixed(3)} (${Math.round(STATS.tokens/1000)}k tokens)` : '')
+    + (STATS.paused ? ' · ⏸ gepauzeerd' : '');
+}
+function onEvent(ev){
+  if(ev.id) LAST_EVENT=ev.id;
+  switch(ev.type){
+    case 'job_started': JOB=ev.job_id; break;
+    case 'selection': STATS.total=ev.total; if(ev.done) STATS.done=ev.done; break;
+    case 'dry_run': LAST_RUN=ev.run_id; qs('#btnApply').disabled=false; break;
+    case 'product_skipped': STATS.done++; STATS.skipped++; break;
+    case 'product_done': STATS.done++; STATS[ev.result]=(STATS[ev.result]||0)+1; break;
+    case 'batch_done':
+      if(ev.applied!=null){ STATS.updated=ev.applied; STATS.done=ev.applied+STATS.failed; if(ev.rollback_id) ROLLBACK_ID=ev.rollback_id; }
+      else if(ev.written!=null){ STATS.done=ev.done; STATS.updated=ev.written; STATS.skipped=ev.without_dims; BACKFILL_RUN=ev.run_id; }
+      break;
+    case 'metrics': STATS.per_minute=ev.per_minute; STATS.gen_p95=ev.gen_p95; STATS.cost_eur=ev.cost_eur||0; STATS.tokens=ev.tokens||0; break;
+    case 'budget':
+      if(ev.action==='pause'){
+        STATS.paused=true; addLog(ev.msg); showStats();
+        const v=prompt(ev.msg+'\\nNieuw budget in € (leeg = annuleren):', (ev.budget_eur*2).toFixed(2));
+        if(v && parseFloat(v)>0) post('/api/runs/'+ev.run_id+'/budget', {budget_eur: parseFloat(v)}); else cancelJob();
+        return;
+      }
+      break;
+    case 'paused': STATS.paused=true; break;
+    case 'resumed': STATS.paused=false; break;
+    case 'run_done':
+      FINISHED=true; if(ev.written!=null) BACKFILL_RUN=null;
+      if(ev.rollback_id) ROLLBACK_ID=null; else if(ev.run_id && !ev.dry_run && ev.updated) WRITE_RUN=ev.run_id;
+      break;
+    case 'cancelled': case 'error': FINISHED=true; break;
+  }
+  if(ev.msg) addLog(ev.msg);
+  showStats();
+}
+async function readEvents(res){
+  const reader=res.body.getReader(); const dec=new TextDecoder(); let buf='';
+  while(true){
+    const {value,done}=await reader.read(); if(done) break;
+    buf+=dec.decode(value,{stream:true});
+    const lines=buf.split('\\n'); buf=lines.pop();
+    lines.forEach(l=>{ if(l.trim()) onEvent(JSON.parse(l)); });
+  }
+}
+function endRun(){ RUN=false; qs('#btnCancel').disabled=true; }
+async function streamTo(url, body){
+  await CSRF_READY;
+  resetStats(); JOB=null; LAST_EVENT=0; FINISHED=false;
+  const accept={'Accept':'application/x-ndjson'};
+  let res=null;
+  try{
+    res=await fetch(url+'?gzip=1',{method:'POST',signal:abortCtrl.signal,
+      headers:Object.assign({'Content-Type':'application/json','X-CSRF-Token':CSRF},accept),body:JSON.stringify(body)});
+  }catch(e){ addLog('❌ Netwerkfout: '+e.message); return endRun(); }
+  if(!res.ok){ addLog('❌ '+res.status); return endRun(); }
+  JOB=res.headers.get('X-Job-Id');
+  let tries=0;
+  while(res){
+    try{ await readEvents(res); tries=0; }catch(e){}
+    if(FINISHED || abortCtrl.signal.aborted || !JOB) break;
+    addLog('↻ Verbinding verbroken, hervatten vanaf event '+LAST_EVENT+'…'); res=null;
+    while(!res && tries<10 && !abortCtrl.signal.aborted){
+      await new Promise(r=>setTimeout(r, 1000*Math.min(++tries,5)));
+      res=await fetch(`/api/jobs/${JOB}/events?gzip=1&after=${LAST_EVENT}`,{signal:abortCtrl.signal,headers:accept})
+        .then(r=>r.ok?r:null).catch(()=>null);
+    }
+  }
+  endRun();
+}
+async function backfillSelected(){
+  // een onderbroken backfill gaat verder waar hij stopte
+  if(RUN) return; RUN=true; qs('#btnCancel').disabled=false;
+  setLog(BACKFILL_RUN ? 'Backfill hervatten ('+BACKFILL_RUN+')…' : 'Maten-metafields aanvullen…');
+  abortCtrl=new AbortController();
+  const store=(qs('#store')?.value||'').trim();
+  const token=(qs('#token')?.value||'').trim();
+  const body=BACKFILL_RUN ? {store, token, run_id: BACKFILL_RUN}
+    : Object.assign({store, token, collection_ids: Array.from(qs('#collections').selectedOptions).map(o=>o.value)}, pickerSelection());
+  await streamTo('/api/backfill', body);
+}
+async function applyLastRun(){
+  if(RUN || !LAST_RUN) return; RUN=true; qs('#btnCancel').disabled=false; setLog('Voorstellen toepassen ('+LAST_RUN+')…');
+  abortCtrl=new AbortController();
+  const store=(qs('#store')?.value||'').trim();
+  const token=(qs('#token')?.value||'').trim();
+  await streamTo('/api/apply', {store, token, run_id: LAST_RUN});
+}
+async function rollbackRun(){
+  // een onderbroken rollback gaat verder waar hij stopte
+  if(RUN) return;
+  const store=(qs('#store')?.value||'').trim();
+  const token=(qs('#token')?.value||'').trim();
+  let body;
+  if(ROLLBACK_ID) body={store, token, rollback_id: ROLLBACK_ID};
+  else {
+    const run=prompt('Welke run terugdraaien? (run-id)', WRITE_RUN||'');
+    if(!run) return; body={store, token, run_id: run.trim()};
+  }
+  RUN=true; qs('#btnCancel').disabled=false; abortCtrl=new AbortController();
+  setLog(ROLLBACK_ID ? 'Rollback hervatten ('+ROLLBACK_ID+')…' : 'Run '+body.run_id+' terugdraaien…');
+  await streamTo('/api/rollback', body);
+}
+function cancelJob(){
+  // de job draait server-side verder tot ze het annulatie-signaal ziet (na het lopende product)
+  if(JOB){ post('/api/jobs/'+JOB+'/cancel'); addLog('⏹ Annuleren aangevraagd…'); }
+  else if(abortCtrl){ abortCtrl.abort(); addLog('⏹ Job geannuleerd.'); }
+  qs('#btnCancel').disabled=true;
 }
-function cancelJob(){ if(abortCtrl){ abortCtrl.abort(); addLog('⏹ Job geannuleerd.'); qs('#btnCancel').disabled=true; } }
 </script>
 </body></html>"""
 
+# Eén keer opgebouwd (met --preload vóór de fork, gedeeld door alle workers)
+_DASHBOARD_RAW  = DASHBOARD_HTML.encode("utf-8")
+_DASHBOARD_GZ   = gzip.compress(_DASHBOARD_RAW, 9, mtime=0)
+_DASHBOARD_ETAG = hashlib.sha1(_DASHBOARD_RAW).hexdigest()[:20]
+
 # =========================
 # Routes
 # =========================
@@ -905,7 +2877,7 @@ def _paged(path: str, token: str, params: Optional[Dict[str, Any]] = None, store
     since = 0; out: List[Dict[str, Any]] = []
     while True:
         p["since_id"] = since
-        url = f"https://{store_domain}{path}"
+        url = f"{_shop_base(store_domain)}{path}"
         data = _get(url, token, params=p).json()
         key = next((k for k in ("custom_collections", "smart_collections", "products", "collects") if k in data), None)
         if not key: break
@@ -927,8 +2899,17 @@ def login():
 @app.route("/")
 def dashboard():
     if not session.get("logged_in"): return redirect("/login")
-    html = DASHBOARD_HTML.replace("{{CSRF}}", g.csrf_token)
-    return Response(html, mimetype="text/html")
+    headers = {"ETag": f'"{_DASHBOARD_ETAG}"', "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+    if _DASHBOARD_ETAG in request.if_none_match:
+        return Response(status=304, headers=headers)
+    if request.accept_encodings["gzip"]:   # q-waarde telt: "gzip;q=0" betekent nee
+        return Response(_DASHBOARD_GZ, mimetype="text/html", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(_DASHBOARD_RAW, mimetype="text/html", headers=headers)
+
+@app.get("/api/csrf")
+@_require_login
+def api_csrf():
+    return jsonify({"csrf": g.csrf_token}), 200, {"Cache-Control": "no-store"}
 
 @app.post("/api/set-creds")
 @_require_login
@@ -953,10 +2934,7 @@ def api_collections():
         store, token = _get_creds(data)
         if not store or not token:
             return jsonify({"error": "SHOPIFY_STORE_DOMAIN of SHOPIFY_ACCESS_TOKEN ontbreekt."}), 400
-        customs = _paged("/admin/api/2024-07/custom_collections.json", token, store=store)
-        smarts  = _paged("/admin/api/2024-07/smart_collections.json",  token, store=store)
-        cols = [{"id": c["id"], "title": c.get("title","(zonder titel)")} for c in (customs+smarts)]
-        return jsonify(cols)
+        return jsonify(_collections_list(store, token, refresh=bool(data.get("refresh"))))
     except requests.HTTPError as e:
         code = getattr(e.response, "status_code", 502)
         text = ""
@@ -966,6 +2944,79 @@ def api_collections():
     except Exception as e:
         return jsonify({"error": f"Collecties laden mislukt: {e}"}), 400
 
+def _collections_list(store: str, token: str, refresh: bool = False) -> List[Dict[str, Any]]:
+    """Custom + smart collecties per store, TITLE_INDEX_TTL gecachet. Sleutel bevat het token: een ander
+    token (andere app/scopes) ziet mogelijk andere collecties en mag geen lijst van een ander krijgen."""
+    key = (store, _api_key_id(token))
+    hit = _COLLECTIONS_CACHE.get(key)
+    if hit and not refresh and time.time() - hit["at"] < TITLE_INDEX_TTL: return hit["cols"]
+    customs = _paged("/admin/api/2024-07/custom_collections.json", token, store=store)
+    smarts  = _paged("/admin/api/2024-07/smart_collections.json",  token, store=store)
+    cols = [{"id": c["id"], "title": c.get("title","(zonder titel)")} for c in (customs+smarts)]
+    _COLLECTIONS_CACHE[key] = {"at": time.time(), "cols": cols}
+    return cols
+
+# ---- Producten per collectie: gecachete titel-index + gepagineerd zoeken
+
+def _collection_product_ids(store: str, token: str, coll_ids: List[Any]) -> List[int]:
+    pid_set = set()
+    for cid in coll_ids:
+        for c in _paged("/admin/api/2024-07/collects.json", token, {"collection_id": cid}, store=store):
+            pid_set.add(int(c["product_id"]))
+    return sorted(pid_set)
+
+def _title_index(store: str, token: str, coll_ids: List[Any]) -> Dict[str, Any]:
+    """Gesorteerde (titel_lower, id, titel)-index per store + collectieselectie, TITLE_INDEX_TTL gecachet."""
+    key = (store, tuple(sorted(str(c) for c in coll_ids)))
+    with _TITLE_INDEX_LOCK:
+        hit = _TITLE_INDEX_CACHE.get(key)
+        if hit and time.time() - hit["at"] < TITLE_INDEX_TTL:
+            _TITLE_INDEX_CACHE.move_to_end(key)
+            return hit
+    pids = _collection_product_ids(store, token, coll_ids)
+    rows: List[Tuple[str, int, str]] = []
+    for i in range(0, len(pids), 250):
+        r = _get(f"{_shop_base(store)}/admin/api/2024-07/products.json", token,
+                 params={"ids": ",".join(map(str, pids[i:i+250])), "limit": 250, "fields": "id,title"})
+        for p in r.json().get("products", []):
+            t = _s(p.get("title"))
+            rows.append((t.lower(), int(p["id"]), t))
+    rows.sort()
+    idx = {"at": time.time(), "rows": rows, "keys": [(r[0], r[1]) for r in rows]}
+    with _TITLE_INDEX_LOCK:
+        for k in [k for k, v in _TITLE_INDEX_CACHE.items() if idx["at"] - v["at"] >= TITLE_INDEX_TTL]:
+            del _TITLE_INDEX_CACHE[k]
+        _TITLE_INDEX_CACHE[key] = idx
+        _TITLE_INDEX_CACHE.move_to_end(key)
+        while len(_TITLE_INDEX_CACHE) > max(1, TITLE_INDEX_MAX):
+            _TITLE_INDEX_CACHE.popitem(last=False)
+    return idx
+
+def _encode_cursor(pos: Tuple[str, int]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(pos)).encode()).decode()
+
+def _decode_cursor(cur: str) -> Optional[Tuple[str, int]]:
+    try:
+        t, i = json.loads(base64.urlsafe_b64decode(cur.encode()))
+        return (str(t), int(i))
+    except Exception:
+        return None
+
+def _search_index(idx: Dict[str, Any], q: str, match: str) -> List[Tuple[str, int, str]]:
+    rows, q = idx["rows"], (q or "").strip().lower()
+    if not q: return rows
+    if match == "prefix":
+        lo = bisect.bisect_left(idx["keys"], (q, -1))
+        hi = bisect.bisect_left(idx["keys"], (q + "\U0010ffff", -1))
+        return rows[lo:hi]
+    return [r for r in rows if q in r[0]]
+
+def _select_product_ids(store: str, token: str, select: Dict[str, Any]) -> List[int]:
+    """'Alles wat aan de filter voldoet' → product-ID's (min. uitsluitingen)."""
+    idx = _title_index(store, token, select.get("collection_ids") or [])
+    exclude = {int(x) for x in (select.get("exclude_ids") or [])}
+    return sorted(r[1] for r in _search_index(idx, _s(select.get("q")), _s(select.get("match"))) if r[1] not in exclude)
+
 @app.post("/api/collection-products")
 @_require_login
 @require_csrf
@@ -978,26 +3029,52 @@ def api_collection_products():
             return jsonify({"error":"Store of token ontbreekt."}), 400
         if not coll_ids:
             return jsonify([])
-        pid_set = set()
-        for cid in coll_ids:
-            collects = _get(f"https://{store}/admin/api/2024-07/collects.json", token,
-                            params={"collection_id": cid, "limit": 250}).json().get("collects", [])
-            for c in collects:
-                pid_set.add(int(c["product_id"]))
-        pids = sorted(pid_set)
-        products: List[Dict[str, Any]] = []
-        for i in range(0, len(pids), 50):
-            batch = pids[i:i+50]
-            r = _get(f"https://{store}/admin/api/2024-07/products.json", token,
-                     params={"ids": ",".join(map(str, batch)), "limit": 250})
-            prods = r.json().get("products", [])
-            for p in prods:
-                products.append({"id": int(p["id"]), "title": p.get("title","")})
-        products.sort(key=lambda x: (x["title"].lower(), x["id"]))
-        return jsonify(products)
+        idx = _title_index(store, token, coll_ids)
+        return jsonify([{"id": r[1], "title": r[2]} for r in idx["rows"]])
     except Exception as e:
         return jsonify({"error": f"Producten laden mislukt: {e}"}), 400
 
+@app.post("/api/products/search")
+@_require_login
+@require_csrf
+def api_products_search():
+    """Gepagineerde, doorzoekbare productlijst: {items, next_cursor, total}."""
+    try:
+        data = request.get_json(force=True) or {}
+        store, token = _get_creds(data)
+        coll_ids = data.get("collection_ids") or []
+        if not store or not token:
+            return jsonify({"error":"Store of token ontbreekt."}), 400
+        if not coll_ids:
+            return jsonify({"items": [], "next_cursor": None, "total": 0})
+        limit = max(1, min(int(data.get("limit") or 50), PICKER_PAGE_MAX))
+        hits = _search_index(_title_index(store, token, coll_ids), _s(data.get("q")), _s(data.get("match")))
+        cur = _decode_cursor(_s(data.get("cursor"))) if data.get("cursor") else None
+        start = bisect.bisect_right(hits, cur, key=lambda r: (r[0], r[1])) if cur else 0
+        page = hits[start:start + limit]
+        nxt = _encode_cursor((page[-1][0], page[-1][1])) if page and start + limit < len(hits) else None
+        return jsonify({"items": [{"id": r[1], "title": r[2]} for r in page], "next_cursor": nxt, "total": len(hits)})
+    except Exception as e:
+        return jsonify({"error": f"Producten zoeken mislukt: {e}"}), 400
+
+def _fetch_products(store: str, token: str, ids: List[int]) -> List[Dict[str, Any]]:
+    if not ids: return []
+    r = _get(f"{_shop_base(store)}/admin/api/2024-07/products.json", token,
+             params={"ids": ",".join(map(str, ids)), "limit": 250})
+    return r.json().get("products", [])
+
+def _resolve_selection(store: str, token: str, select: Optional[Dict[str, Any]], explicit_pids: List[Any],
+                       colls: List[Any]) -> Tuple[List[int], str]:
+    """Product-ID's voor een run: filter (picker) > expliciete ID's > collecties."""
+    if select:
+        pids = _select_product_ids(store, token, select)
+        return pids, f"{len(pids)} producten geselecteerd via filter."
+    if explicit_pids:
+        pids = [int(x) for x in explicit_pids]
+        return pids, f"{len(pids)} expliciet geselecteerde producten ontvangen."
+    pids = _collection_product_ids(store, token, colls)
+    return pids, f"{len(pids)} producten gevonden uit collecties."
+
 @app.route("/api/optimize", methods=["POST"])
 @_require_login
 @require_csrf
@@ -1007,148 +3084,666 @@ def api_optimize():
     txn   = bool(payload.get("txn", TRANSACTIONAL_MODE))
     colls = payload.get("collection_ids") or []
     explicit_pids = payload.get("product_ids") or []
+    select = payload.get("select") if isinstance(payload.get("select"), dict) else None
+    if payload.get("duplicates"):   # enkel de als dubbel gemarkeerde producten opnieuw
+        explicit_pids, colls, select = _flagged_products(store), [], None
+    family_dedup = bool(payload.get("family_dedup", FAMILY_DEDUP))
+    dry_run = bool(payload.get("dry_run", False))
+    weight = float(payload.get("weight") or 1.0)
+    budget_eur = float(payload.get("budget_eur") or RUN_BUDGET_EUR or 0)
+    budget_action = "pause" if payload.get("budget_action") == "pause" else "stop"
+    mode = _s(payload.get("mode") or GENERATION_MODE).lower()
+    if mode not in ("full", "auto", "metas"): mode = "full"
+    profile = bool(payload.get("profile"))
     if not store or not token:
         return Response("Store of token ontbreekt.\n", mimetype="text/plain", status=400)
+    if profile and not PROFILER_ENABLED:
+        return Response("Profiler staat uit (PROFILER_ENABLED).\n", mimetype="text/plain", status=403)
     if not OPENAI_API_KEY:
         return Response("OPENAI_API_KEY ontbreekt.\n", mimetype="text/plain", status=500)
 
-    sys_prompt = _build_system_prompt(txn)
-
     garden_words = {"tuinplanten","bloeiende tuinplanten","siergrassen","hagen","klimplanten","olijfbomen","moestuin"}
     selected_titles = []
+    if select and not colls: colls = select.get("collection_ids") or []
     for coll_id in colls:
         try:
-            r1 = _get(f"https://{store}/admin/api/2024-07/smart_collections/{coll_id}.json", token)
+            r1 = _get(f"{_shop_base(store)}/admin/api/2024-07/smart_collections/{coll_id}.json", token)
             t1 = (r1.json().get("smart_collection") or {}).get("title")
             if t1: selected_titles.append(t1.lower())
         except Exception:
             pass
         try:
-            r2 = _get(f"https://{store}/admin/api/2024-07/custom_collections/{coll_id}.json", token)
+            r2 = _get(f"{_shop_base(store)}/admin/api/2024-07/custom_collections/{coll_id}.json", token)
             t2 = (r2.json().get("custom_collection") or {}).get("title")
             if t2: selected_titles.append(t2.lower())
         except Exception:
             pass
     is_garden_selection = any(any(w in t for w in garden_words) for t in selected_titles)
 
-    def stream():
-        try:
-            pid_list: List[int] = []
-            if explicit_pids:
-                pid_list = [int(x) for x in explicit_pids]
-                yield f"{len(pid_list)} expliciet geselecteerde producten ontvangen.\n"
-            else:
-                pid_set = set()
-                for coll_id in colls:
-                    url=f"https://{store}/admin/api/2024-07/collects.json"
-                    collects=_get(url, token, params={"collection_id":coll_id,"limit":250}).json().get("collects",[])
-                    for c in collects:
-                        pid_set.add(int(c["product_id"]))
-                pid_list = sorted(pid_set)
-                yield f"{len(pid_list)} producten gevonden uit collecties.\n"
-
-            total_updated = 0
-            if not pid_list:
-                yield "Niets te doen (lege selectie).\n"
-                return
-
-            for i in range(0, len(pid_list), 50):
-                batch_ids = pid_list[i:i+50]
-                r=_get(f"https://{store}/admin/api/2024-07/products.json", token,
-                       params={"ids":",".join(map(str,batch_ids)),"limit":250})
-                prods=r.json().get("products",[])
-                for p in prods:
-                    pid=int(p["id"])
-                    title=_s(p.get("title",""))
-                    body=_s(p.get("body_html",""))
-
-                    skip_bundle, qty = analyze_bundle(title)
-                    if skip_bundle:
-                        yield f"⏭️ #{pid}: overgeslagen (bundel met verschillende producten)\n"
-                        continue
-
-                    base_prompt = (
-                        f"Originele titel: {title}\n"
-                        f"Originele beschrijving (HTML toegestaan): {body}\n"
-                        "Taken:\n"
-                        "1) Lever ‘Nieuwe titel’ volgens format.\n"
-                        "2) Lever ‘Beschrijving’ (HTML) met vaste h3-secties en 4 regels.\n"
-                        "3) Lever ‘Meta title’ (≤60) en ‘Meta description’ (≤155).\n"
-                    )
-                    if is_garden_selection:
-                        base_prompt += (
-                            "\nVOOR TUINPLANTEN:\n"
-                            "- Voeg ONDER 'Eigenschappen & behoeften' optioneel extra regels toe (alleen als je het met hoge zekerheid weet):\n"
-                            "  <p><strong>Bloeiperiode</strong>: …</p>\n"
-                            "  <p><strong>Plantperiode</strong>: …</p>\n"
-                            "- Als je het NIET zeker weet: laat de regels weg.\n"
-                            "- Gebruik korte maandenreeksen (bv. 'juni–september', 'najaar (sep–nov)').\n"
-                        )
-
-                    try:
-                        yield f"→ #{pid}: AI-tekst genereren...\n"
-                        ai_raw=_openai_chat(sys_prompt, base_prompt)
-                        pieces = split_ai_output(ai_raw)
-
-                        title_ai = enforce_title_name_map(_s(pieces.get("title")) or title)
-                        body_ai  = _s(pieces.get("body_html")) or body
-
-                        dims = parse_dimensions(title_ai, body_ai)
-                        if not dims.get("height_cm") and not dims.get("pot_diameter_cm"):
-                            dims = parse_dimensions(title, body)
+    def stream() -> Iterator[Dict[str, Any]]:
+        pid_list, msg = _resolve_selection(store, token, select, explicit_pids, colls)
+        yield _ev("selection", msg, total=len(pid_list))
 
-                        pot_color   = extract_pot_color(title_ai, body_ai)
-                        pot_present = detect_pot_presence(title_ai, body_ai)
-
-                        final_title = normalize_title(title_ai, dims, pot_color, pot_present)
-                        if qty and not re.match(r"^\s*\d+\s*[xX]\s+", final_title):
-                            final_title = f"{qty}x {final_title}"
+        if not pid_list:
+            yield _ev("run_done", "Niets te doen (lege selectie).", updated=0)
+            return
 
-                        final_body = body_ai
-                        if is_garden_selection:
-                            final_body = _ensure_garden_lines(final_body, final_title)
-                        final_body = inject_heroicons(final_body)
+        ctx = _run_ctx(store, token, txn, is_garden_selection, family_dedup=family_dedup, dry_run=dry_run,
+                       budget_eur=budget_eur, budget_action=budget_action, mode=mode)
+        if budget_eur:
+            _db().execute("INSERT OR REPLACE INTO run_budgets (run_id, budget_eur, action) VALUES (?,?,?)",
+                          (ctx["run_id"], budget_eur, budget_action))
+        _STAGES.acc = ctx["stages"]
+        prof = _SamplingProfiler(threading.get_ident(), f"optimize-{ctx['run_id']}").start() if profile else None
+        try:
+            if dry_run:
+                yield _ev("dry_run", f"🧪 Dry-run {ctx['run_id']}: er wordt niets naar Shopify geschreven.", run_id=ctx["run_id"])
+            first = _fetch_products(store, token, pid_list[:50])
+            yield _estimate_event(ctx, first, len(pid_list))
+            last_metrics = time.monotonic()
+            stopped = False
+            with SCHED.job(store, weight) as job_id:
+                for i in range(0, len(pid_list), 50):
+                    prods = first if i == 0 else _fetch_products(store, token, pid_list[i:i+50])
+                    if not dry_run:   # één GraphQL-call per batch voor de snapshots (zie _snapshot_products)
+                        ctx["current"] = fetch_current_texts(store, token, [int(p["id"]) for p in prods])
+                    for n, p in enumerate(prods):
+                        SCHED.progress(job_id, len(pid_list) - i - n)
+                        yield from _await_upstreams([f"shopify:{store}", "openai"])
+                        stopped = yield from _budget_gate(ctx)
+                        if stopped: break
+                        with SCHED.slot("product", "*"):
+                            yield from _optimize_product(ctx, p)
+                        if time.monotonic() - last_metrics >= JOB_METRICS_SECONDS:
+                            last_metrics = time.monotonic()
+                            yield _run_metrics(ctx, len(pid_list))
+                        if not dry_run: time.sleep(DELAY_PER_PRODUCT)
+
+                    yield _ev("batch_done", f"-- Batch klaar ({len(prods)} producten) --", size=len(prods),
+                              done=sum(ctx["outcomes"].values()), total=len(pid_list))
+                    if stopped: break
+        finally:
+            # ook bij annuleren (generator gesloten) of een fout: de thread mag geen stage-tijden meer in deze
+            # run boeken, en de sampler moet stoppen en zijn profiel wegschrijven
+            _STAGES.acc = None
+            if prof: prof.stop()
+
+        u = ctx["usage"]
+        yield _run_metrics(ctx, len(pid_list))
+        yield _ev("usage", f"💶 Verbruik: {u['calls']} calls, {u['prompt_tokens'] + u['completion_tokens']} tokens "
+                           f"({u['prompt_tokens']} prompt / {u['completion_tokens']} completion) ≈ €{u['cost_eur']:.4f}",
+                  **u, run_id=ctx["run_id"])
+        yield _ev("run_done", f"Klaar. Totaal {'voorstellen' if dry_run else 'bijgewerkt'}: {ctx['total_updated']} "
+                              f"(AI-calls: {ctx['ai_calls']}, afgeleid uit familie: {ctx['derived']}, "
+                              f"enkel metas: {ctx['metas_only']}, gericht hersteld: {ctx['repairs']}, "
+                              f"dubbel gemarkeerd: {ctx['duplicates']}) — "
+                              f"⏱ stages (eigen wall/cpu): {_stage_summary(ctx['stages'])}",
+                  updated=ctx["total_updated"], ai_calls=ctx["ai_calls"], derived=ctx["derived"],
+                  metas_only=ctx["metas_only"], repairs=ctx["repairs"], duplicates=ctx["duplicates"],
+                  stages={k: {"wall": round(w, 3), "cpu": round(c, 3), "n": n} for k, (w, c, n) in ctx["stages"].items()},
+                  dry_run=dry_run, run_id=ctx["run_id"])
+        yield _ev("latency", f"⏱ Generatie-latency: {_latency_summary(ctx['gen_latencies'])}",
+                  p50=_percentile(ctx["gen_latencies"], .5), p95=_percentile(ctx["gen_latencies"], .95),
+                  n=len(ctx["gen_latencies"]))
+        if OPENAI_FAST_MODEL and ctx["routes"]: yield _routing_event(ctx)
+        if prof:
+            path = prof.path
+            yield _ev("log", f"🔥 Profiel: {prof.samples} samples → {os.path.basename(path)} (GET /api/profiles/{os.path.basename(path)})",
+                      profile=os.path.basename(path), samples=prof.samples)
+        if dry_run:
+            yield _ev("log", f"🧪 Voorstellen bewaard onder run {ctx['run_id']} — toepassen via /api/apply.")
+        elif ctx["total_updated"]:
+            yield _ev("log", f"↩️ Originelen bewaard onder run {ctx['run_id']} — terugdraaien via /api/rollback.")
+
+    return _job_response(_start_job("optimize", store, stream()).id)
+
+@app.post("/api/apply")
+@_require_login
+@require_csrf
+def api_apply():
+    """Schrijf de bewaarde dry-run voorstellen van een run naar Shopify (gebundeld, zonder opnieuw te genereren)."""
+    payload = request.get_json(force=True) or {}
+    store, token = _get_creds(payload)
+    run_id = _s(payload.get("run_id")).strip()
+    only = {int(x) for x in (payload.get("product_ids") or [])}
+    if not store or not token or not run_id:
+        return Response("Store, token of run_id ontbreekt.\n", mimetype="text/plain", status=400)
+
+    def stream() -> Iterator[Dict[str, Any]]:
+        items = [it for it in _load_previews(run_id, store) if not only or it["id"] in only]
+        yield _ev("selection", f"{len(items)} openstaande voorstellen in run {run_id}.", total=len(items))
+        done = 0
+        for i in range(0, len(items), APPLY_BATCH_SIZE):
+            batch = items[i:i + APPLY_BATCH_SIZE]
+            # na de dry-run verwijderd: overslaan en afvinken, anders blijft elke hervatting op deze batch hangen
+            lost = _snapshot_products(run_id, store, token, [it["id"] for it in batch], strict=False)
+            for pid in lost:
+                yield _ev("product_done", f"❌ #{pid}: product niet gevonden (verwijderd?), overgeslagen",
+                          pid=pid, result="failed", error="niet gevonden")
+            _mark_applied(run_id, lost)
+            batch = [it for it in batch if it["id"] not in lost]
+            failed = update_products_texts_batch(store, token, [{"id": it["id"], **it["after"]} for it in batch])
+            for pid, err in failed.items():
+                yield _ev("product_done", f"❌ #{pid}: {err}", pid=pid, result="failed", error=err)
+            ok = [it for it in batch if it["id"] not in failed]
+            if DUP_DETECT:
+                for it in ok:
+                    yield from _duplicate_events(it["id"], _dup_reindex(store, it["id"], _s(it["before"].get("title")),
+                                                                         _s(it["before"].get("body_html")), it["after"]))
+            mrep = set_metafields_batch(token, store, {it["id"]: it["after"].get("dims") or {} for it in ok
+                                                       if (it["after"].get("dims") or {})})
+            for err in mrep["errors"]:
+                yield _ev("metafields", f"   • Metafields: {err}", errors=[err])
+            _mark_applied(run_id, [it["id"] for it in ok])
+            done += len(ok)
+            yield _ev("batch_done", f"✅ {done}/{len(items)} toegepast", size=len(batch), applied=done, total=len(items))
+        yield _ev("run_done", f"Klaar. Toegepast: {done}", updated=done, run_id=run_id)
+
+    return _job_response(_start_job("apply", store, stream()).id)
+
+@app.get("/api/jobs/<job_id>/events")
+@_require_login
+def api_job_events(job_id: str):
+    """Hervat een event-stream; Last-Event-ID (SSE) of ?after=<id> = laatst ontvangen event."""
+    if not _db().execute("SELECT 1 FROM jobs WHERE job_id=?", (job_id,)).fetchone():
+        return jsonify({"error": "onbekende job"}), 404
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.args.get("after") or 0)
+    except ValueError:
+        after = 0
+    return _job_response(job_id, after)
 
-                        final_meta_title = finalize_meta_title(pieces.get("meta_title"), final_title)
-                        final_meta_desc  = finalize_meta_desc(pieces.get("meta_description"), final_body, final_title, txn)
+@app.post("/api/jobs/<job_id>/cancel")
+@_require_login
+@require_csrf
+def api_job_cancel(job_id: str):
+    cur = _db().execute("UPDATE jobs SET cancel=1 WHERE job_id=? AND finished IS NULL", (job_id,))
+    job = _JOBS.get(job_id)
+    if job: job.cancelled = True
+    return jsonify({"ok": bool(cur.rowcount)})
 
-                        update_product_texts(store, token, pid, final_title, final_body, final_meta_title, final_meta_desc)
+@app.post("/api/jobs/<job_id>/profile")
+@_require_login
+@require_csrf
+def api_job_profile(job_id: str):
+    """Hang de sampling-profiler aan een lopende job (enkel op de worker die de job draait)."""
+    if not PROFILER_ENABLED:
+        return jsonify({"error": "profiler staat uit (PROFILER_ENABLED)"}), 403
+    job = _JOBS.get(job_id)
+    if not job or job.done or not job.thread_ident:
+        return jsonify({"error": "job loopt niet op deze worker"}), 409
+    seconds = float((request.get_json(silent=True) or {}).get("seconds") or 30)
+    prof = _SamplingProfiler(job.thread_ident, f"{job.kind}-{job.id}-{int(time.time())}", seconds).start()
+    return jsonify({"profile": os.path.basename(prof.path), "seconds": min(seconds, PROFILE_MAX_SECONDS)})
+
+@app.get("/api/profiles")
+@_require_login
+def api_profiles():
+    if not PROFILER_ENABLED: return jsonify({"error": "profiler staat uit (PROFILER_ENABLED)"}), 403
+    try: names = sorted((f for f in os.listdir(PROFILE_DIR) if f.endswith(".folded")), reverse=True)
+    except OSError: names = []
+    return jsonify([{"name": n, "bytes": os.path.getsize(os.path.join(PROFILE_DIR, n))} for n in names])
 
-                        # Metafields
-                        missing = {}
-                        if dims.get("height_cm"):       missing["height_cm"] = dims["height_cm"]
-                        if dims.get("pot_diameter_cm"): missing["pot_diameter_cm"] = dims["pot_diameter_cm"]
+@app.get("/api/profiles/<name>")
+@_require_login
+def api_profile_download(name: str):
+    """Collapsed stacks als tekst: `flamegraph.pl profiel.folded > profiel.svg` of laden in speedscope."""
+    if not PROFILER_ENABLED: return jsonify({"error": "profiler staat uit (PROFILER_ENABLED)"}), 403
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not name.endswith(".folded") or not os.path.isfile(path):
+        return jsonify({"error": "onbekend profiel"}), 404
+    with open(path, encoding="utf-8") as f:
+        return Response(f.read(), mimetype="text/plain",
+                        headers={"Content-Disposition": f'attachment; filename="{os.path.basename(name)}"'})
+
+@app.get("/api/duplicates")
+@_require_login
+def api_duplicates():
+    """Gemarkeerde producten (bijna-dubbele beschrijving of meta description) voor de huidige store."""
+    store, _ = _get_creds(request.args.to_dict())
+    rows = _db().execute("SELECT product_id, field, other_id, similarity, flagged FROM dup_flags WHERE store=? "
+                         "ORDER BY similarity DESC", (store,)).fetchall()
+    return jsonify({"product_ids": sorted({r["product_id"] for r in rows}), "flags": [dict(r) for r in rows]})
+
+@app.post("/api/duplicates/scan")
+@_require_login
+@require_csrf
+def api_duplicates_scan():
+    """Bouw de index op uit de huidige Shopify-teksten (zonder AI) en markeer bijna-dubbels."""
+    payload = request.get_json(force=True) or {}
+    store, token = _get_creds(payload)
+    select = payload.get("select") if isinstance(payload.get("select"), dict) else None
+    if not store or not token:
+        return Response("Store of token ontbreekt.\n", mimetype="text/plain", status=400)
 
-                        if missing:
-                            rep = set_product_metafields(token, store, pid, missing)
-                            yield f"   • Metafields resultaat: {rep}\n"
-                        else:
-                            yield "   • Metafields: geen waarden gevonden in titel/tekst\n"
+    def stream() -> Iterator[Dict[str, Any]]:
+        pids, msg = _resolve_selection(store, token, select, payload.get("product_ids") or [],
+                                       payload.get("collection_ids") or [])
+        yield _ev("selection", msg, total=len(pids))
+        flagged = 0
+        for i in range(0, len(pids), 250):
+            current = fetch_current_texts(store, token, pids[i:i + 250])
+            for pid, cur in current.items():
+                family = _dup_family(cur["title"], cur["body_html"])
+                texts = _dup_texts(cur)
+                dups = find_duplicates(store, pid, texts, family)
+                _dup_record(store, pid, texts, family, dups)
+                if dups:
+                    flagged += 1
+                    yield from _duplicate_events(pid, dups)
+            done = min(i + 250, len(pids))
+            yield _ev("batch_done", f"🔎 {done}/{len(pids)} geïndexeerd — {flagged} gemarkeerd", size=len(current),
+                      done=done, total=len(pids), flagged=flagged)
+        yield _ev("run_done", f"Klaar. {flagged} producten met bijna-dubbele tekst; herschrijven via "
+                              "/api/optimize met {\"duplicates\": true}.", flagged=flagged)
+
+    return _job_response(_start_job("duplicates", store, stream()).id)
+
+@app.post("/api/backfill")
+@_require_login
+@require_csrf
+def api_backfill():
+    """Dimensie-metafields voor een hele selectie zonder AI: parse_dimensions + gebundelde metafieldsSet.
+    Hervatten: dezelfde call met {"run_id": ...}; de cursor staat in SQLite."""
+    payload = request.get_json(force=True) or {}
+    store, token = _get_creds(payload)
+    resume = _s(payload.get("run_id")).strip()
+    select = payload.get("select") if isinstance(payload.get("select"), dict) else None
+    if not store or not token:
+        return Response("Store of token ontbreekt.\n", mimetype="text/plain", status=400)
+    row = _db().execute("SELECT * FROM backfill_runs WHERE run_id=? AND store=?", (resume, store)).fetchone() if resume else None
+    if resume and row is None:
+        return jsonify({"error": "onbekende backfill-run"}), 404
+
+    def stream() -> Iterator[Dict[str, Any]]:
+        if row is not None:
+            run_id, pids, cursor, written = resume, json.loads(row["pids"]), row["cursor"], row["written"]
+            yield _ev("selection", f"Backfill {run_id} hervat bij {cursor}/{len(pids)}.", total=len(pids),
+                      done=cursor, run_id=run_id)
+        else:
+            pids, msg = _resolve_selection(store, token, select, payload.get("product_ids") or [],
+                                           payload.get("collection_ids") or [])
+            run_id, cursor, written = _new_run_id(), 0, 0
+            _db().execute("INSERT INTO backfill_runs (run_id, store, pids, cursor, written, created, updated) "
+                          "VALUES (?,?,?,?,?,?,?)", (run_id, store, json.dumps(pids), 0, 0, time.time(), time.time()))
+            yield _ev("selection", f"{msg} Backfill {run_id}.", total=len(pids), done=0, run_id=run_id)
+
+        without = 0
+        for i in range(cursor, len(pids), BACKFILL_PAGE):
+            page = pids[i:i + BACKFILL_PAGE]
+            r = _get(f"{_shop_base(store)}/admin/api/2024-07/products.json", token,
+                     params={"ids": ",".join(map(str, page)), "fields": "id,title,body_html", "limit": 250})
+            values: Dict[int, Dict[str, str]] = {}
+            for p in r.json().get("products", []):
+                dims = parse_dimensions(_s(p.get("title")), _s(p.get("body_html")))
+                if dims: values[int(p["id"])] = dims
+            without += len(page) - len(values)
+            rep = set_metafields_batch(token, store, values)
+            for err in rep["errors"]:
+                yield _ev("metafields", f"   • Metafields: {err}", errors=[err])
+            cursor, written = i + len(page), written + rep["written"]
+            _db().execute("UPDATE backfill_runs SET cursor=?, written=?, updated=? WHERE run_id=?",
+                          (cursor, written, time.time(), run_id))
+            yield _ev("batch_done", f"✅ {cursor}/{len(pids)} verwerkt — {written} metafields geschreven",
+                      size=len(page), done=cursor, total=len(pids), written=written, without_dims=without,
+                      fallback=len(rep["fallback_products"]), run_id=run_id)
+
+        _db().execute("UPDATE backfill_runs SET finished=? WHERE run_id=?", (time.time(), run_id))
+        yield _ev("run_done", f"Klaar. Backfill {run_id}: {written} metafields geschreven ({without} producten zonder maten).",
+                  written=written, without_dims=without, run_id=run_id)
+
+    return _job_response(_start_job("backfill", store, stream()).id)
+
+@app.post("/api/rollback")
+@_require_login
+@require_csrf
+def api_rollback():
+    """Zet titel/beschrijving/SEO van een hele run terug naar de snapshots (gebundeld, parallel, hervatbaar).
+    Starten: {"run_id": ...}; hervatten: {"rollback_id": ...}. Metafields blijven ongemoeid."""
+    payload = request.get_json(force=True) or {}
+    store, token = _get_creds(payload)
+    run_id, resume = _s(payload.get("run_id")).strip(), _s(payload.get("rollback_id")).strip()
+    if not store or not token or not (run_id or resume):
+        return Response("Store, token of run_id ontbreekt.\n", mimetype="text/plain", status=400)
+    row = _db().execute("SELECT * FROM rollback_runs WHERE rollback_id=? AND store=?", (resume, store)).fetchone() if resume else None
+    if resume and row is None:
+        return jsonify({"error": "onbekende rollback"}), 404
+
+    def restore(pids: List[int], job_id: str) -> Dict[int, str]:
+        # pool-threads erven SCHED._local niet: zonder bind telt deze batch niet mee voor de eerlijke verdeling
+        with SCHED.bind(job_id), SCHED.slot("product", "*"):
+            before = _load_snapshots(row["run_id"] if row is not None else run_id, store, pids)
+            failed = update_products_texts_batch(store, token, [{"id": pid, **before[pid]} for pid in pids if pid in before],
+                                                 restore=True)
+        failed.update({pid: "geen snapshot" for pid in pids if pid not in before})
+        if DUP_DETECT:
+            for pid, b in before.items():
+                if pid not in failed: _dup_reindex(store, pid, b["title"], b["body_html"], b)
+        return failed
+
+    def stream() -> Iterator[Dict[str, Any]]:
+        if row is not None:
+            rb_id, src, pids, cursor = resume, row["run_id"], json.loads(row["pids"]), row["cursor"]
+            restored, failed = row["restored"], row["failed"]
+            yield _ev("selection", f"Rollback {rb_id} van run {src} hervat bij {cursor}/{len(pids)}.", total=len(pids),
+                      done=cursor, rollback_id=rb_id)
+        else:
+            src = run_id
+            pids = [r[0] for r in _db().execute("SELECT product_id FROM snapshots WHERE run_id=? AND store=? ORDER BY product_id",
+                                                (src, store))]
+            rb_id, cursor, restored, failed = _new_run_id(), 0, 0, 0
+            _db().execute("INSERT INTO rollback_runs (rollback_id, run_id, store, pids, cursor, restored, failed, created, updated) "
+                          "VALUES (?,?,?,?,?,?,?,?,?)", (rb_id, src, store, json.dumps(pids), 0, 0, 0, time.time(), time.time()))
+            yield _ev("selection", f"{len(pids)} producten met snapshot in run {src}. Rollback {rb_id}.", total=len(pids),
+                      done=0, rollback_id=rb_id)
+
+        # golven van ROLLBACK_CONCURRENCY batches; de cursor schuift pas op als een hele golf klaar is
+        # (hervatten doet hooguit één golf opnieuw — idempotent). Rate limits: SCHED.slot + _send.
+        wave = APPLY_BATCH_SIZE * max(1, ROLLBACK_CONCURRENCY)
+        with SCHED.job(store) as job_id, \
+                ThreadPoolExecutor(max_workers=max(1, ROLLBACK_CONCURRENCY), thread_name_prefix="rollback") as pool:
+            for i in range(cursor, len(pids), wave):
+                SCHED.progress(job_id, len(pids) - i)
+                yield from _await_upstreams([f"shopify:{store}"])
+                chunk = pids[i:i + wave]
+                batches = [chunk[j:j + APPLY_BATCH_SIZE] for j in range(0, len(chunk), APPLY_BATCH_SIZE)]
+                for batch, fut in [(b, pool.submit(restore, b, job_id)) for b in batches]:
+                    try:
+                        errs = fut.result()
+                    except Exception as e:
+                        errs = {pid: str(e) for pid in batch}
+                    for pid, err in errs.items():
+                        yield _ev("product_done", f"❌ #{pid}: {err}", pid=pid, result="failed", error=err)
+                    restored += len(batch) - len(errs); failed += len(errs)
+                cursor = i + len(chunk)
+                _db().execute("UPDATE rollback_runs SET cursor=?, restored=?, failed=?, updated=? WHERE rollback_id=?",
+                              (cursor, restored, failed, time.time(), rb_id))
+                yield _ev("batch_done", f"↩️ {cursor}/{len(pids)} verwerkt — {restored} teruggezet", size=len(chunk),
+                          done=cursor, total=len(pids), applied=restored, rollback_id=rb_id)
+
+        _db().execute("UPDATE rollback_runs SET finished=? WHERE rollback_id=?", (time.time(), rb_id))
+        yield _ev("run_done", f"Klaar. Rollback {rb_id}: {restored} producten teruggezet"
+                              + (f", {failed} mislukt" if failed else "") + f" (run {src}).",
+                  updated=restored, failed=failed, rollback_id=rb_id, run_id=src)
+
+    return _job_response(_start_job("rollback", store, stream()).id)
+
+@app.post("/api/runs/<run_id>/budget")
+@_require_login
+@require_csrf
+def api_run_budget(run_id: str):
+    """Verhoog (of zet) het budget van een lopende run; een gepauzeerde run gaat dan verder."""
+    payload = request.get_json(force=True) or {}
+    try:
+        budget = float(payload.get("budget_eur"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "budget_eur ontbreekt"}), 400
+    action = "pause" if payload.get("budget_action", "pause") == "pause" else "stop"
+    _db().execute("INSERT INTO run_budgets (run_id, budget_eur, action) VALUES (?,?,?) "
+                  "ON CONFLICT(run_id) DO UPDATE SET budget_eur=excluded.budget_eur", (run_id, budget, action))
+    return jsonify({"ok": True, "budget_eur": budget})
+
+@app.get("/api/usage")
+@_require_login
+def api_usage():
+    """Tokens en kosten per run (laatste runs eerst)."""
+    limit = max(1, min(500, int(request.args.get("limit") or 50)))
+    rows = _db().execute(
+        "SELECT run_id, store, model, COUNT(*) AS calls, SUM(prompt_tokens) AS prompt_tokens, "
+        "SUM(completion_tokens) AS completion_tokens, SUM(cost_eur) AS cost_eur, MIN(at) AS started, MAX(at) AS last "
+        "FROM openai_usage GROUP BY run_id, store, model ORDER BY last DESC LIMIT ?", (limit,)).fetchall()
+    return jsonify([{**dict(r), "cost_eur": round(r["cost_eur"], 4)} for r in rows])
+
+@app.get("/api/routing")
+@_require_login
+def api_routing():
+    """Routing-beslissingen per route (optioneel voor één run): aantallen, latency, escalaties, gem. score."""
+    run_id = request.args.get("run_id")
+    where, args = ("WHERE run_id = ?", (run_id,)) if run_id else ("", ())
+    rows = _db().execute(f"SELECT route, model, seconds, escalated, score FROM route_log {where} "
+                         "ORDER BY at DESC LIMIT 20000", args).fetchall()
+    out: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        o = out.setdefault(r["route"], {"model": r["model"], "n": 0, "escalated": 0, "score_sum": 0, "seconds": []})
+        o["n"] += 1; o["escalated"] += r["escalated"]; o["score_sum"] += r["score"]; o["seconds"].append(r["seconds"])
+    return jsonify({k: {"model": o["model"], "n": o["n"], "escalated": o["escalated"],
+                        "avg_score": round(o["score_sum"] / o["n"], 2),
+                        "p50": round(_percentile(o["seconds"], .5), 3), "p95": round(_percentile(o["seconds"], .95), 3)}
+                    for k, o in out.items()})
+
+@app.get("/api/runs/<run_id>/previews")
+@_require_login
+def api_run_previews(run_id: str):
+    store, _ = _get_creds(request.args.to_dict())
+    items = _load_previews(run_id, store, only_pending=False)
+    return jsonify([{"id": it["id"], "applied": bool(it["applied"]),
+                     "before_title": it["before"].get("title"), "after_title": it["after"].get("title"),
+                     "diff": _compact_diff(it["before"], it["after"])} for it in items])
 
-                        total_updated += 1
-                        yield f"✅ #{pid} bijgewerkt: {final_title}\n"
+# =========================
+# Webhooks: products/create + products/update → gedebouncede queue
+# =========================
 
+_WEBHOOK_THREAD: Optional[threading.Thread] = None
+_WEBHOOK_LOCK = threading.Lock()
+
+def _verify_webhook(raw: bytes, hmac_header: str) -> bool:
+    if not SHOPIFY_WEBHOOK_SECRET or not hmac_header: return False
+    digest = hmac.new(SHOPIFY_WEBHOOK_SECRET.encode(), raw, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), hmac_header.encode())
+
+def _is_self_update(store: str, p: Dict[str, Any]) -> bool:
+    """Update die we zelf veroorzaakt hebben: inhoud gelijk aan wat we laatst schreven.
+    Enkel de hash telt; een handmatige wijziging van de tekst met dezelfde titel is geen eigen update."""
+    row = _db().execute("SELECT content_hash FROM written WHERE store = ? AND product_id = ?",
+                        (store, int(p["id"]))).fetchone()
+    return bool(row) and row["content_hash"] == _content_hash(_s(p.get("title")), _s(p.get("body_html")))
+
+def _enqueue_product(store: str, pid: int) -> None:
+    now = time.time()
+    _db().execute("INSERT INTO webhook_queue (store, product_id, due, received, events) VALUES (?, ?, ?, ?, 1) "
+                  "ON CONFLICT(store, product_id) DO UPDATE SET due = excluded.due, events = events + 1, attempts = 0",
+                  (store, int(pid), now + WEBHOOK_DEBOUNCE_SECONDS, now))
+
+def _claim_due(limit: int = 50) -> List[Tuple[str, int, float]]:
+    """Claim vervallen items atomair met een lease (één worker-proces krijgt elk item).
+    Rijen blijven staan tot _finish_queued; sterft de worker, dan vervalt de lease en neemt een ander het over."""
+    conn, now = _db(), time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("SELECT store, product_id, due FROM webhook_queue WHERE due <= ? "
+                            "AND (claimed_until IS NULL OR claimed_until < ?) ORDER BY due LIMIT ?",
+                            (now, now, limit)).fetchall()
+        conn.executemany("UPDATE webhook_queue SET claimed_until = ? WHERE store = ? AND product_id = ?",
+                         [(now + WEBHOOK_LEASE_SECONDS, r["store"], r["product_id"]) for r in rows])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK"); raise
+    return [(r["store"], int(r["product_id"]), r["due"]) for r in rows]
+
+def _finish_queued(store: str, pid: int, due: float) -> None:
+    """Verwerkt: weg uit de queue, tenzij er intussen een nieuwe webhook binnenkwam (due verschoven)."""
+    conn = _db()
+    if not conn.execute("DELETE FROM webhook_queue WHERE store = ? AND product_id = ? AND due = ?",
+                        (store, pid, due)).rowcount:
+        conn.execute("UPDATE webhook_queue SET claimed_until = NULL WHERE store = ? AND product_id = ?", (store, pid))
+
+def _retry_queued(store: str, pid: int, count_attempt: bool = True) -> None:
+    """Lease vrijgeven met backoff; na WEBHOOK_MAX_ATTEMPTS mislukte pogingen valt het item weg."""
+    conn = _db()
+    row = conn.execute("SELECT attempts FROM webhook_queue WHERE store = ? AND product_id = ?", (store, pid)).fetchone()
+    if not row: return
+    attempts = row["attempts"] + (1 if count_attempt else 0)
+    if attempts >= WEBHOOK_MAX_ATTEMPTS:
+        conn.execute("DELETE FROM webhook_queue WHERE store = ? AND product_id = ?", (store, pid))
+        app.logger.error("webhook-queue %s: #%d na %d pogingen opgegeven", store, pid, attempts)
+        return
+    delay = WEBHOOK_POLL_SECONDS * 2 ** attempts if count_attempt else WEBHOOK_LEASE_SECONDS
+    conn.execute("UPDATE webhook_queue SET claimed_until = NULL, attempts = ?, due = MAX(due, ?) "
+                 "WHERE store = ? AND product_id = ?", (attempts, time.time() + delay, store, pid))
+
+def _webhook_token(store: str) -> str:
+    env_store = _normalize_store_domain(os.environ.get("SHOPIFY_STORE_DOMAIN", ""))
+    return os.environ.get("SHOPIFY_ACCESS_TOKEN", "").strip() if store == env_store else ""
+
+def _process_webhook_queue() -> int:
+    items = _claim_due()
+    by_store: Dict[str, Dict[int, float]] = {}
+    for store, pid, due in items: by_store.setdefault(store, {})[pid] = due
+    for store, claimed in by_store.items():
+        token = _webhook_token(store)
+        if not token or not OPENAI_API_KEY:
+            # zonder token komt het nooit goed: telt mee tot WEBHOOK_MAX_ATTEMPTS; een ontbrekende OpenAI-key
+            # is tijdelijk (config), dan enkel uitstellen
+            app.logger.warning("webhook-queue: geen %s voor %s, %d items uitgesteld",
+                               "token" if not token else "OpenAI-key", store, len(claimed))
+            for pid in claimed: _retry_queued(store, pid, count_attempt=not token)
+            continue
+        pids = list(claimed)
+        for i in range(0, len(pids), 50):
+            chunk = pids[i:i+50]
+            try:
+                r = _get(f"{_shop_base(store)}/admin/api/2024-07/products.json", token,
+                         params={"ids": ",".join(map(str, chunk)), "limit": 250})
+                products = r.json().get("products", [])
+            except Exception as e:
+                app.logger.error("webhook-queue %s: ophalen mislukt: %s", store, e)
+                for pid in chunk: _retry_queued(store, pid)
+                continue
+            found = {int(p["id"]) for p in products}
+            for pid in chunk:
+                if pid not in found: _finish_queued(store, pid, claimed[pid])  # intussen verwijderd
+            with SCHED.job(store) as job_id:
+                for p in products:
+                    pid = int(p["id"])
+                    if _is_self_update(store, p):
+                        _finish_queued(store, pid, claimed[pid]); continue
+                    ctx = _run_ctx(store, token, TRANSACTIONAL_MODE, bool(_detect_species_key(_s(p.get("title")))))
+                    ok = True
+                    try:
+                        with SCHED.slot("product", "*"):
+                            for ev in _optimize_product(ctx, p):
+                                app.logger.info("webhook-queue %s: %s", store, ev["msg"].strip())
+                                if ev.get("result") == "failed": ok = False
                     except Exception as e:
-                        yield f"❌ Fout bij product #{pid}: {e}\n"
-
+                        app.logger.error("webhook-queue %s: #%d mislukt: %s", store, pid, e); ok = False
+                    if ok: _finish_queued(store, pid, claimed[pid])
+                    else: _retry_queued(store, pid)
                     time.sleep(DELAY_PER_PRODUCT)
+    return len(items)
 
-                yield f"-- Batch klaar ({len(prods)} producten) --\n"
-
-            yield f"Klaar. Totaal bijgewerkt: {total_updated}\n"
+def _webhook_worker() -> None:
+    while True:
+        try:
+            if not _process_webhook_queue():
+                time.sleep(WEBHOOK_POLL_SECONDS)
         except Exception as e:
-            yield f"⚠️ Beëindigd met fout: {e}\n"
+            app.logger.error("webhook-queue fout: %s", e)
+            time.sleep(WEBHOOK_POLL_SECONDS)
 
-    return Response(stream(), mimetype="text/plain", headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+def _ensure_webhook_worker() -> None:
+    global _WEBHOOK_THREAD
+    with _WEBHOOK_LOCK:
+        if _WEBHOOK_THREAD is None or not _WEBHOOK_THREAD.is_alive():
+            _WEBHOOK_THREAD = threading.Thread(target=_webhook_worker, name="webhook-queue", daemon=True)
+            _WEBHOOK_THREAD.start()
+
+@app.before_request
+def _start_webhook_worker():
+    # per worker-proces bij het eerste request (ook /healthz), zodat items van vóór een herstart verwerkt
+    # worden zonder op een nieuwe webhook te wachten; niet bij import: onder --preload overleeft de thread de fork niet
+    if SHOPIFY_WEBHOOK_SECRET and (_WEBHOOK_THREAD is None or not _WEBHOOK_THREAD.is_alive()):
+        _ensure_webhook_worker()
+
+@app.post("/webhooks/products")
+def webhook_products():
+    raw = request.get_data(cache=False)
+    if not _verify_webhook(raw, request.headers.get("X-Shopify-Hmac-Sha256", "")):
+        return "unauthorized", 401
+    topic = request.headers.get("X-Shopify-Topic", "")
+    if topic not in ("products/create", "products/update"):
+        return "ignored", 200
+    store = _normalize_store_domain(request.headers.get("X-Shopify-Shop-Domain", ""))
+    try:
+        p = json.loads(raw or b"{}")
+    except ValueError:
+        return "bad payload", 400
+    if not store or not p.get("id"):
+        return "bad payload", 400
+    if topic == "products/update" and _is_self_update(store, p):
+        _metric_inc("seo_webhooks_total", result="self")
+        return "self", 200
+    if not _webhook_token(store):   # 200: Shopify hoeft niet opnieuw te proberen, we kunnen er toch niets mee
+        _metric_inc("seo_webhooks_total", result="no_token")
+        return "no token for store", 200
+    _enqueue_product(store, int(p["id"]))
+    _metric_inc("seo_webhooks_total", result="queued")
+    return "queued", 200
+
+@app.get("/api/scheduler")
+@_require_login
+def api_scheduler():
+    return jsonify(SCHED.snapshot())
+
+@app.get("/api/upstreams")
+@_require_login
+def api_upstreams():
+    with _UPSTREAM_CV: names = sorted(_UPSTREAMS)
+    return jsonify({n: _upstream(n).snapshot() for n in names})
+
+@app.get("/api/webhooks/queue")
+@_require_login
+def api_webhook_queue():
+    rows = _db().execute("SELECT store, COUNT(*) AS n, MIN(due) AS next_due FROM webhook_queue GROUP BY store").fetchall()
+    return jsonify([{"store": r["store"], "queued": r["n"], "next_in_seconds": max(0, round(r["next_due"] - time.time()))}
+                    for r in rows])
 
 # =========================
-# Health
+# Health & metrics
 # =========================
 
 @app.get("/healthz")
 def healthz():
     return "ok", 200
 
+@app.get("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        return "unauthorized", 401
+    return Response(_metrics_render(), mimetype="text/plain; version=0.0.4")
+
+# =========================
+# Warme start (gunicorn --preload: één keer in de master, vóór de fork)
+# =========================
+
+def _warm_start() -> None:
+    """Vul de metafield-map en de collectielijst van de geconfigureerde store, zodat het eerste request
+    na een deploy die calls niet meer betaalt. Daarna niets fork-onveilig laten liggen."""
+    store = _normalize_store_domain(SHOPIFY_STORE_DOMAIN)
+    token = os.environ.get("SHOPIFY_ACCESS_TOKEN", "").strip()
+    t0 = time.monotonic()
+    try:
+        if store and token and store != "your-store.myshopify.com":
+            _ensure_meta_map(token, store)
+            _collections_list(store, token)
+            app.logger.info("warme start %s: %.1fs", store, time.monotonic() - t0)
+    except Exception as e:
+        app.logger.warning("warme start mislukt voor %s: %s", store, e)
+    finally:
+        # geen sockets, SQLite-verbinding, breaker-state of metrics delen met de workers
+        REQ.close()
+        conn = getattr(_DB_LOCAL, "conn", None)
+        if conn is not None:
+            conn.close(); _DB_LOCAL.conn = None
+        with _UPSTREAM_CV: _UPSTREAMS.clear()
+        with _METRICS_LOCK:
+            for v in _METRICS.values(): v.clear()
+        try: os.remove(os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json"))
+        except OSError: pass
+
+if WARM_START:
+    _warm_start()
+
 # =========================
 # Main
 # =========================
@@ -0,0 +1,107 @@
+# batch.py — offline batchverwerking: product-export (JSONL) → geplande updates (JSONL), zonder API-calls
+#
+#   python batch.py products.jsonl -o plan.jsonl
+#   python batch.py products.jsonl --ai-cache ai.jsonl --garden --workers 8 -o plan.jsonl
+#
+# Invoer: één product per regel ({"id", "title", "body_html"}; "descriptionHtml" mag ook).
+# Bestaande metas: "meta_title"/"meta_description", "seo": {"title", "description"} of de REST-velden
+# "metafields_global_title_tag"/"metafields_global_description_tag".
+# AI-cache (optioneel): {"id", "ai_output": "<ruwe completion>"} of {"id", "title", "body_html", "meta_title", "meta_description"}.
+# Zonder AI-cache wordt de bestaande titel/tekst opnieuw genormaliseerd met de huidige regels; bestaande metas
+# worden mee genormaliseerd, ontbrekende blijven weg uit het plan (niets verzinnen zonder AI-resultaat).
+import argparse, json, os, sys, time
+from multiprocessing import Pool
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import app as seo
+
+FIELDS = ("title", "body_html", "meta_title", "meta_description")
+
+def _read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in f:
+            line = line.strip()
+            if line: yield json.loads(line)
+    finally:
+        if f is not sys.stdin: f.close()
+
+def _load_ai_cache(path: Optional[str]) -> Dict[int, Dict[str, str]]:
+    cache: Dict[int, Dict[str, str]] = {}
+    if not path: return cache
+    for rec in _read_jsonl(path):
+        if "id" not in rec: continue
+        if rec.get("ai_output"):
+            cache[int(rec["id"])] = {"ai_output": rec["ai_output"]}
+        else:
+            cache[int(rec["id"])] = {k: seo._s(rec.get(k)) for k in FIELDS}
+    return cache
+
+def _exported_metas(p: Dict[str, Any]) -> Dict[str, str]:
+    seo_ = p.get("seo") or {}
+    return {"meta_title": seo._s(p.get("meta_title") or seo_.get("title") or p.get("metafields_global_title_tag")),
+            "meta_description": seo._s(p.get("meta_description") or seo_.get("description")
+                                       or p.get("metafields_global_description_tag"))}
+
+def plan_product(job: Tuple[Dict[str, Any], Optional[Dict[str, str]], bool, bool]) -> Dict[str, Any]:
+    """Pure keten voor één product (draait in een worker-proces)."""
+    p, cached, txn, garden = job
+    pid = int(p["id"])
+    title = seo._s(p.get("title"))
+    body = seo._s(p.get("body_html") if p.get("body_html") is not None else p.get("descriptionHtml"))
+    skip_bundle, qty = seo.analyze_bundle(title)
+    if skip_bundle:
+        return {"id": pid, "status": "skipped", "reason": "bundel"}
+    before = {"title": title, "body_html": body, **_exported_metas(p)}
+    try:
+        if cached and cached.get("ai_output"):
+            pieces = seo.split_ai_output(cached["ai_output"]); source = "ai-cache"
+        elif cached:
+            pieces = cached; source = "ai-cache"
+        else:
+            pieces = dict(before); source = "renormalize"
+        out = seo.finalize_product(title, body, pieces, qty, txn, garden)
+    except Exception as e:
+        return {"id": pid, "status": "error", "error": str(e)}
+    # renormaliseren zonder bestaande meta: veld weglaten i.p.v. een fallback over de huidige heen te schrijven
+    fields = [k for k in FIELDS if source != "renormalize" or k in ("title", "body_html") or before[k]]
+    rec = {"id": pid, "status": "planned", "source": source,
+           "changed": [k for k in fields if out[k] != before[k]]}
+    rec.update({k: out[k] for k in fields})
+    rec["metafields"] = out["dims"]
+    return rec
+
+def main(argv: Optional[list] = None) -> int:
+    ap = argparse.ArgumentParser(description="Normaliseer een product-export offline over alle cores.")
+    ap.add_argument("products", help="JSONL met producten ('-' = stdin)")
+    ap.add_argument("-o", "--out", default="-", help="JSONL met geplande updates ('-' = stdout)")
+    ap.add_argument("--ai-cache", help="JSONL met eerder gegenereerde AI-resultaten per product-id")
+    ap.add_argument("--garden", action="store_true", help="tuinplanten: Bloei-/Plantperiode aanvullen")
+    ap.add_argument("--no-txn", dest="txn", action="store_false", help="geen USP's in meta description")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunksize", type=int, default=64)
+    ap.add_argument("--only-changed", action="store_true", help="enkel producten waar titel/tekst/metas wijzigen")
+    args = ap.parse_args(argv)
+
+    cache = _load_ai_cache(args.ai_cache)
+    jobs = ((p, cache.get(int(p["id"])), args.txn, args.garden) for p in _read_jsonl(args.products))
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    counts = {"planned": 0, "skipped": 0, "error": 0, "unchanged": 0}
+    t0 = time.monotonic()
+    try:
+        with Pool(processes=max(1, args.workers)) as pool:
+            for rec in pool.imap(plan_product, jobs, chunksize=max(1, args.chunksize)):
+                counts[rec["status"]] += 1
+                if args.only_changed and rec["status"] == "planned" and not rec["changed"]:
+                    counts["unchanged"] += 1
+                    continue
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout: out.close()
+    dt = time.monotonic() - t0
+    total = sum(v for k, v in counts.items() if k != "unchanged")
+    print(f"Klaar: {total} producten in {dt:.1f}s ({total / dt if dt else 0:.0f}/s) — {counts}", file=sys.stderr)
+    return 0 if not counts["error"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# bench/corpus.py — gegenereerd corpus van NL producttitels, beschrijvingen en AI-antwoorden
+#
+#   python bench/corpus.py --out corpus.jsonl          # dump (deterministisch per --seed)
+import argparse, json, random, sys
+from typing import Any, Dict, List
+
+from fakes import POT_COLORS, SPECIES
+
+SIZES = ("short", "medium", "long", "pathological")
+
+GARDEN = [("Lavendel", "Lavandula angustifolia"), ("Hortensia", "Hydrangea macrophylla"),
+          ("Rozen", "Rosa 'Iceberg'"), ("Kerstroos", "Helleborus niger"), ("Japanse esdoorn", "Acer palmatum")]
+
+SENTENCES = [
+    "Een dankbare plant die weinig verzorging vraagt.",
+    "Het blad is glanzend groen en mooi getekend.",
+    "Zet de plant op een lichte plek zonder felle middagzon.",
+    "Geef water wanneer de bovenste centimeters van de potgrond droog aanvoelen.",
+    "Geleverd in een kwekerspot van 17 cm, ideaal om te verpotten in een sierpot.",
+    "Hoogte inclusief pot: ca. 60–70 cm.",
+    "Past perfect in een moderne woonkamer of kantoor.",
+    "Houd de plant buiten bereik van huisdieren en kinderen.",
+]
+
+CARE = ["Lichtbehoefte", "Waterbehoefte", "Standplaats", "Giftigheid"]
+
+def _title(rnd: random.Random, size: str) -> str:
+    nl, lat = rnd.choice(SPECIES + GARDEN)
+    h = rnd.choice([25, 40, 60, 80, 100, 150]); d = rnd.choice([9, 12, 14, 17, 21, 27])
+    color = rnd.choice(POT_COLORS)
+    if size == "short":
+        return f"{lat} {h}cm"
+    t = rnd.choice([f"{nl} / {lat} – ↕{h}cm – ⌀{d}cm", f"{lat} {h} cm pot {d} cm", f"{nl} {lat} ↕{h} ⌀{d}"])
+    if color: t += f" in {color} pot"
+    if size == "long":
+        t = f"{rnd.randint(2, 6)}x {t} – extra vol – cadeau-idee – {rnd.choice(SENTENCES)}"
+    if size == "pathological":
+        t = " ".join([t] + [f"{rnd.randint(1, 999)} cm" for _ in range(60)] + ["Ø" * 40, "–" * 80])
+    return t
+
+def _body(rnd: random.Random, size: str, structured: bool) -> str:
+    n = {"short": 1, "medium": 4, "long": 25, "pathological": 600}[size]
+    paras = "".join(f"<p>{' '.join(rnd.sample(SENTENCES, 3))}</p>\n" for _ in range(n))
+    if not structured:
+        return paras
+    care = "".join(f"<p><strong>{c}</strong>: {rnd.choice(SENTENCES)}</p>\n" for c in CARE)
+    if rnd.random() < .5:
+        care += "<p><strong>Bloeiperiode</strong>: juni–september</p>\n"
+    body = f"<h3>Beschrijving</h3>\n{paras}<h3>Eigenschappen & behoeften</h3>\n{care}"
+    if size == "pathological":
+        body += "<div>" * 400 + "<span>x</span>" * 2000 + "</div>" * 400
+    return body
+
+def _ai_output(rnd: random.Random, title: str, body: str, size: str) -> str:
+    style = rnd.choice(["labels", "labels", "markdown", "loose"])
+    meta_t = f"Koop {title[:50]}"
+    meta_d = f"Bestel {title[:80]} online. {rnd.choice(SENTENCES)} Gratis verzending vanaf €49."
+    if size == "pathological":
+        meta_d = " ".join(rnd.choice(SENTENCES) for _ in range(200))
+    if style == "labels":
+        return f"Nieuwe titel: {title}\n\nBeschrijving: {body}\n\nMeta title: {meta_t}\nMeta description: {meta_d}\n"
+    if style == "markdown":
+        return f"**Titel:** {title}\n\n**Productbeschrijving:**\n{body}\n\n**SEO-meta title:** {meta_t}\n**SEO-meta description:** {meta_d}\n"
+    plain = " ".join(rnd.sample(SENTENCES, 4))
+    return f"{title}\n\n{plain}\n\n{meta_t}\n\n{meta_d}\n"
+
+def make_corpus(per_size: int = 50, seed: int = 42) -> List[Dict[str, Any]]:
+    """Records: {size, title, body_html, ai_output}; deterministisch voor dezelfde seed."""
+    rnd = random.Random(seed)
+    out: List[Dict[str, Any]] = []
+    for size in SIZES:
+        for _ in range(per_size if size != "pathological" else max(1, per_size // 10)):
+            title = _title(rnd, size)
+            body = _body(rnd, size, structured=rnd.random() < .6)
+            ai_body = _body(rnd, size if size != "pathological" else "long", structured=True)
+            out.append({"size": size, "title": title, "body_html": body,
+                        "ai_output": _ai_output(rnd, title, ai_body, size)})
+    return out
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description="Genereer het micro-benchmark corpus als JSONL.")
+    ap.add_argument("--per-size", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default="-")
+    args = ap.parse_args(argv)
+    f = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    for rec in make_corpus(args.per_size, args.seed):
+        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    if f is not sys.stdout: f.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
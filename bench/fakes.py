@@ -0,0 +1,252 @@
+# bench/fakes.py — lokale stand-ins voor Shopify Admin API en OpenAI (enkel voor benchmarks)
+import json, math, random, re, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+SPECIES = [
+    ("Gatenplant", "Monstera deliciosa"), ("Olifantsoor", "Alocasia zebrina"), ("Slaapplant", "Calathea orbifolia"),
+    ("Vrouwentong", "Sanseveria trifasciata"), ("Vioolbladplant", "Ficus lyrata"), ("Drakenboom", "Dracaena marginata"),
+    ("Flamingoplant", "Anthurium andreanum"), ("ZZ-Plant", "Zamioculcas zamiifolia"), ("Lavendel", "Lavandula angustifolia"),
+    ("Hortensia", "Hydrangea macrophylla"), ("Olijfboom", "Olea europaea"), ("Buxus", "Buxus sempervirens"),
+]
+POT_COLORS = ["witte", "grijze", "zwarte", "terracotta", None, None]
+
+def make_catalog(n: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Deterministische catalogus met variantfamilies (zelfde plant, andere maat/potkleur)."""
+    rnd = random.Random(seed)
+    out: List[Dict[str, Any]] = []
+    pid = 1000
+    while len(out) < n:
+        nl, lat = rnd.choice(SPECIES)
+        for h in rnd.sample([40, 60, 80, 100, 120, 150], rnd.randint(1, 3)):
+            if len(out) >= n: break
+            pid += 1
+            d = max(9, h // 4)
+            color = rnd.choice(POT_COLORS)
+            title = f"{nl} {lat} ↕{h}cm ⌀{d}cm" + (f" in {color} pot" if color else "")
+            body = (f"<p>{lat} is een sterke plant voor binnen. Hoogte {h} cm, potmaat {d} cm.</p>"
+                    + "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * rnd.randint(1, 6))
+            out.append({"id": pid, "title": title, "body_html": body})
+    return out
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _Base(BaseHTTPRequestHandler):
+    fake: Any = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *a: Any) -> None:
+        pass
+
+    def _send(self, code: int, data: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        raw = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _body(self) -> Dict[str, Any]:
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+class FakeBase:
+    handler: type = _Base
+
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+        self.server: Optional[_Server] = None
+
+    def count(self, key: str) -> None:
+        with self._lock: self.counts[key] += 1
+
+    def start(self) -> "FakeBase":
+        handler = type("H", (self.handler,), {"fake": self})
+        self.server = _Server(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def stop(self) -> None:
+        if self.server: self.server.shutdown(); self.server.server_close()
+
+# =========================
+# Shopify
+# =========================
+
+class _ShopifyHandler(_Base):
+    def do_GET(self) -> None:
+        fake: FakeShopify = self.fake
+        u = urlparse(self.path); q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        path = re.sub(r"^/admin/api/[\d-]+", "", u.path)
+        if not fake.rest_take():
+            fake.count("GET 429"); return self._send(429, {"errors": "Exceeded 2 calls per second"}, {"Retry-After": "1.0"})
+        if path == "/collects.json":
+            fake.count("GET collects.json")
+            cid = str(q.get("collection_id"))
+            rows = [{"id": int(cid) * 10**7 + p, "collection_id": int(cid), "product_id": p}
+                    for p in fake.collections.get(cid, [])]
+            rows = [r for r in rows if r["id"] > int(q.get("since_id", 0))]
+            return self._send(200, {"collects": rows[:int(q.get("limit", 50))]})
+        if path == "/products.json":
+            fake.count("GET products.json")
+            ids = [int(x) for x in q.get("ids", "").split(",") if x]
+            items = [fake.products[i] for i in ids if i in fake.products] if ids else list(fake.products.values())
+            if "since_id" in q: items = [p for p in items if p["id"] > int(q["since_id"])]
+            items = items[:int(q.get("limit", 50))]
+            if q.get("fields"):
+                keep = q["fields"].split(",")
+                items = [{k: p.get(k) for k in keep} for p in items]
+            return self._send(200, {"products": items})
+        m = re.match(r"^/(custom|smart)_collections(?:/(\d+))?\.json$", path)
+        if m:
+            kind, cid = m.groups()
+            fake.count(f"GET {kind}_collections.json")
+            if kind == "smart": return self._send(404 if cid else 200, {"errors": "Not Found"} if cid else {"smart_collections": []})
+            cols = [{"id": int(c), "title": f"Kamerplanten {c}"} for c in fake.collections]
+            if cid: return self._send(200, {"custom_collection": next((c for c in cols if str(c["id"]) == cid), {})})
+            since = int(q.get("since_id", 0))
+            return self._send(200, {"custom_collections": [c for c in cols if c["id"] > since]})
+        m = re.match(r"^/products/(\d+)/metafields\.json$", path)
+        if m:
+            fake.count("GET metafields.json")
+            return self._send(200, {"metafields": []})
+        fake.count(f"GET {path} 404")
+        self._send(404, {"errors": "Not Found"})
+
+    def do_POST(self) -> None:
+        fake: FakeShopify = self.fake
+        path = re.sub(r"^/admin/api/[\d-]+", "", urlparse(self.path).path)
+        body = self._body()
+        if path != "/graphql.json":
+            fake.count(f"POST {path}")
+            return self._send(201, {"metafield": {"id": 1}})
+        query = body.get("query") or ""
+        ops = re.findall(r"\b(productUpdate|metafieldsSet|metafieldDefinitions|nodes)\s*\(", query) or ["other"]
+        cost = sum(fake.COSTS.get(o, 1) for o in ops)
+        ok, status = fake.gql_take(cost)
+        ext = {"cost": {"requestedQueryCost": cost, "actualQueryCost": cost if ok else None, "throttleStatus": status}}
+        if not ok:
+            fake.count("POST graphql THROTTLED")
+            return self._send(200, {"errors": [{"message": "Throttled", "extensions": {"code": "THROTTLED"}}], "extensions": ext})
+        for o in set(ops): fake.count(f"POST graphql:{o}")
+        data: Dict[str, Any] = {}
+        aliases = re.findall(r"(\w+)\s*:\s*(productUpdate|metafieldsSet)\s*\(", query)
+        for alias, op in aliases or [(op, op) for op in ops]:
+            if op == "productUpdate":
+                data[alias] = {"product": {"id": "gid://shopify/Product/1"}, "userErrors": []}
+            elif op == "metafieldsSet":
+                data[alias] = {"metafields": [], "userErrors": []}
+        if "metafieldDefinitions" in ops:
+            data["metafieldDefinitions"] = {"edges": [{"node": d} for d in fake.definitions]}
+        if "nodes" in ops:
+            ids = (body.get("variables") or {}).get("ids") or []
+            data["nodes"] = [fake.node(g) for g in ids]
+        self._send(200, {"data": data, "extensions": ext})
+
+class FakeShopify(FakeBase):
+    """Shopify Admin stand-in: REST leaky bucket (429) en GraphQL cost throttling (THROTTLED)."""
+    handler = _ShopifyHandler
+    COSTS = {"productUpdate": 10, "metafieldsSet": 10, "metafieldDefinitions": 12, "nodes": 5, "other": 1}
+
+    def __init__(self, catalog: List[Dict[str, Any]], per_collection: int = 250,
+                 gql_bucket: float = 1000.0, gql_restore: float = 50.0,
+                 rest_bucket: float = 40.0, rest_leak: float = 2.0) -> None:
+        super().__init__()
+        self.products = {p["id"]: p for p in catalog}
+        ids = [p["id"] for p in catalog]
+        self.collections = {str(i + 1): ids[o:o + per_collection] for i, o in enumerate(range(0, len(ids), per_collection))}
+        self.definitions = [
+            {"name": "Hoogte", "namespace": "custom", "key": "hoogte_cm", "type": {"name": "number_integer"}},
+            {"name": "Diameter pot", "namespace": "custom", "key": "diameter_cm", "type": {"name": "number_integer"}},
+        ]
+        self.gql_max, self.gql_restore = gql_bucket, gql_restore
+        self.gql_avail, self.gql_at = gql_bucket, time.monotonic()
+        self.rest_max, self.rest_leak = rest_bucket, rest_leak
+        self.rest_level, self.rest_at = 0.0, time.monotonic()
+
+    def gql_take(self, cost: float) -> Tuple[bool, Dict[str, float]]:
+        with self._lock:
+            now = time.monotonic()
+            self.gql_avail = min(self.gql_max, self.gql_avail + (now - self.gql_at) * self.gql_restore)
+            self.gql_at = now
+            ok = self.gql_avail >= cost
+            if ok: self.gql_avail -= cost
+            return ok, {"maximumAvailable": self.gql_max, "currentlyAvailable": round(self.gql_avail, 1),
+                        "restoreRate": self.gql_restore}
+
+    def rest_take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.rest_level = max(0.0, self.rest_level - (now - self.rest_at) * self.rest_leak)
+            self.rest_at = now
+            if self.rest_level + 1 > self.rest_max: return False
+            self.rest_level += 1
+            return True
+
+    def node(self, gid: str) -> Dict[str, Any]:
+        p = self.products.get(int(str(gid).rsplit("/", 1)[-1]), {})
+        return {"id": gid, "title": p.get("title", ""), "descriptionHtml": p.get("body_html", ""),
+                "seo": {"title": None, "description": None}}
+
+# =========================
+# OpenAI
+# =========================
+
+class _OpenAIHandler(_Base):
+    def do_POST(self) -> None:
+        fake: FakeOpenAI = self.fake
+        body = self._body()
+        if fake.rnd_429():
+            fake.count("POST chat/completions 429")
+            return self._send(429, {"error": {"message": "Rate limit"}}, {"Retry-After": str(fake.retry_after)})
+        time.sleep(fake.sample_latency())
+        fake.count("POST chat/completions")
+        msgs = body.get("messages") or []
+        user = (msgs[-1].get("content") if msgs else "") or ""
+        m = re.search(r"Originele titel: (.*)", user)
+        title = m.group(1).strip() if m else "Plant"
+        content = (
+            f"Nieuwe titel: {title}\n\n"
+            "Beschrijving: <h3>Beschrijving</h3>\n"
+            f"<p>{title} brengt rust en groen in huis. Een dankbare plant met sierlijk blad.</p>\n"
+            "<h3>Eigenschappen & behoeften</h3>\n"
+            "<p><strong>Lichtbehoefte</strong>: Veel indirect licht</p>\n"
+            "<p><strong>Waterbehoefte</strong>: Matig, laat de grond opdrogen</p>\n"
+            "<p><strong>Standplaats</strong>: Lichte kamer zonder directe zon</p>\n"
+            "<p><strong>Giftigheid</strong>: Giftig voor huisdieren</p>\n\n"
+            f"Meta title: Koop {title[:40]}\n"
+            f"Meta description: Bestel {title} online bij Belle Flora, snel en vers geleverd.\n"
+        )
+        prompt_tokens = sum(len(m.get("content") or "") for m in msgs) // 4
+        self._send(200, {"choices": [{"message": {"role": "assistant", "content": content}}],
+                         "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                                   "total_tokens": prompt_tokens + len(content) // 4}})
+
+class FakeOpenAI(FakeBase):
+    """Chat-completions stand-in met lognormale latency en 429-injectie."""
+    handler = _OpenAIHandler
+
+    def __init__(self, median: float = 1.0, sigma: float = 0.5, rate_429: float = 0.0,
+                 retry_after: float = 0.5, seed: int = 11) -> None:
+        super().__init__()
+        self.median, self.sigma, self.rate_429, self.retry_after = median, sigma, rate_429, retry_after
+        self._rnd = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        with self._lock:
+            return self.median * math.exp(self._rnd.gauss(0, self.sigma)) if self.median > 0 else 0.0
+
+    def rnd_429(self) -> bool:
+        with self._lock:
+            return self._rnd.random() < self.rate_429
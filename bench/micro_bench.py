@@ -0,0 +1,137 @@
+# bench/micro_bench.py — ops/s en allocaties per tekstfunctie, met baseline-vergelijking
+#
+#   python bench/micro_bench.py                              # rapport
+#   python bench/micro_bench.py --save bench/baseline.json   # baseline vastleggen
+#   python bench/micro_bench.py --compare bench/baseline.json --tolerance 0.15   # exit 1 bij regressie
+import argparse, json, os, sys, time, tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import app as seo  # noqa: E402
+from corpus import SIZES, make_corpus  # noqa: E402
+
+Case = Tuple[Callable[..., Any], List[tuple]]
+
+def build_cases(corpus: List[Dict[str, Any]]) -> Dict[str, Case]:
+    """Per functie: (callable, argumentlijst over het hele corpus)."""
+    pieces = [seo.split_ai_output(r["ai_output"]) for r in corpus]
+    dims = [seo.parse_dimensions(r["title"], r["body_html"]) for r in corpus]
+    colors = [seo.extract_pot_color(r["title"], r["body_html"]) for r in corpus]
+    bodies = [p["body_html"] or r["body_html"] for p, r in zip(pieces, corpus)]
+    return {
+        "split_ai_output": (seo.split_ai_output, [(r["ai_output"],) for r in corpus]),
+        "parse_dimensions": (seo.parse_dimensions, [(r["title"], r["body_html"]) for r in corpus]),
+        "normalize_title": (seo.normalize_title, [(r["title"], d, c, bool(c)) for r, d, c in zip(corpus, dims, colors)]),
+        "finalize_meta_title": (seo.finalize_meta_title, [(p["meta_title"], r["title"]) for p, r in zip(pieces, corpus)]),
+        "finalize_meta_desc": (seo.finalize_meta_desc, [(p["meta_description"], b, r["title"], True)
+                                                        for p, b, r in zip(pieces, bodies, corpus)]),
+        "inject_heroicons": (seo.inject_heroicons, [(b,) for b in bodies]),
+        "_ensure_garden_lines": (seo._ensure_garden_lines, [(b, r["title"]) for b, r in zip(bodies, corpus)]),
+    }
+
+def _one_pass(fn: Callable[..., Any], args: List[tuple]) -> None:
+    for a in args: fn(*a)
+
+def measure(fn: Callable[..., Any], args: List[tuple], min_time: float, repeats: int) -> Dict[str, float]:
+    """Beste van `repeats` metingen (ruis zit enkel aan de trage kant) + allocaties per call."""
+    loops, elapsed = 1, 0.0
+    while True:  # kalibreren tot één meting ≥ min_time duurt
+        t0 = time.perf_counter()
+        for _ in range(loops): _one_pass(fn, args)
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time: break
+        loops *= 2
+    best = elapsed
+    for _ in range(repeats - 1):
+        t0 = time.perf_counter()
+        for _ in range(loops): _one_pass(fn, args)
+        best = min(best, time.perf_counter() - t0)
+    calls = loops * len(args)
+
+    # Allocaties tijdens de call: per call de piek boven het niveau vóór de call (tijdelijke strings, regex-
+    # matches, ...), en de blokken van het resultaat — dat houden we vast tot na de snapshot, anders is
+    # het al vrijgegeven en meet een pure functie altijd ~0.
+    tracemalloc.start()
+    transient = 0
+    for a in args:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fn(*a)
+        transient += tracemalloc.get_traced_memory()[1] - base
+    before = tracemalloc.take_snapshot()
+    kept = [fn(*a) for a in args]
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(max(0, s.count_diff) for s in after.compare_to(before, "filename"))
+    del kept
+    return {"ops_per_sec": calls / best, "us_per_op": best / calls * 1e6, "peak_kib": peak / 1024,
+            "alloc_kib_per_op": transient / len(args) / 1024, "result_blocks_per_op": blocks / len(args)}
+
+def run(per_size: int, seed: int, min_time: float, repeats: int, only: List[str]) -> Dict[str, Dict[str, Any]]:
+    corpus = make_corpus(per_size, seed)
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, (fn, args) in build_cases(corpus).items():
+        if only and name not in only: continue
+        res = {"all": measure(fn, args, min_time, repeats)}
+        for size in SIZES:
+            sub = [a for a, r in zip(args, corpus) if r["size"] == size]
+            if sub: res[size] = measure(fn, sub, min_time / 4, repeats)
+        results[name] = res
+    return results
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Regressies: ops/s meer dan `tolerance` lager dan de baseline (per functie en per grootteklasse)."""
+    out: List[str] = []
+    for name, res in results.items():
+        for bucket, m in res.items():
+            base = (baseline.get(name) or {}).get(bucket)
+            if not base: continue
+            ratio = m["ops_per_sec"] / base["ops_per_sec"]
+            if ratio < 1 - tolerance:
+                out.append(f"{name}[{bucket}]: {m['ops_per_sec']:.0f} ops/s vs baseline {base['ops_per_sec']:.0f} ({ratio:.0%})")
+    return out
+
+def _print(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'functie':<22} {'klasse':<13} {'ops/s':>12} {'µs/op':>10} {'peak KiB':>10} {'alloc KiB/op':>12} "
+          f"{'result blk/op':>13}")
+    for name, res in results.items():
+        for bucket, m in res.items():
+            print(f"{name:<22} {bucket:<13} {m['ops_per_sec']:>12.0f} {m['us_per_op']:>10.1f} "
+                  f"{m['peak_kib']:>10.1f} {m['alloc_kib_per_op']:>12.2f} {m['result_blocks_per_op']:>13.1f}")
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description="Micro-benchmarks voor de tekstverwerkende functies.")
+    ap.add_argument("--per-size", type=int, default=40)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--min-time", type=float, default=0.2, help="minimale duur per meting (s)")
+    ap.add_argument("--repeats", type=int, default=5)
+    ap.add_argument("--only", nargs="*", default=[], help="enkel deze functies")
+    ap.add_argument("--save", help="schrijf resultaten als baseline-JSON")
+    ap.add_argument("--compare", help="vergelijk met baseline-JSON; exit 1 bij regressie")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="toegelaten vertraging (fractie)")
+    args = ap.parse_args(argv)
+
+    results = run(args.per_size, args.seed, args.min_time, args.repeats, args.only)
+    _print(results)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"per_size": args.per_size, "seed": args.seed, "results": results}, f, indent=2)
+        print(f"Baseline opgeslagen: {args.save}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            base = json.load(f)
+        if (base.get("per_size"), base.get("seed")) != (args.per_size, args.seed):
+            print("⚠️ Baseline gemaakt met ander corpus (per_size/seed); vergelijking is indicatief.")
+        regressions = compare(results, base.get("results") or {}, args.tolerance)
+        if regressions:
+            print("❌ Trager dan baseline:")
+            for r in regressions: print("  " + r)
+            return 1
+        print(f"✅ Geen regressies (tolerantie {args.tolerance:.0%}).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+# bench/optimize_bench.py — end-to-end throughput van /api/optimize tegen lokale stand-ins
+#
+#   python bench/optimize_bench.py --products 200 --openai-median 0.3 --openai-429 0.05
+#
+# Start een fake Shopify + fake OpenAI, stuurt de echte Flask-app erheen (SHOPIFY_SCHEME=http,
+# OPENAI_BASE_URL) en rapporteert producten/s, latency per product en requests per endpoint.
+import argparse, json, os, sys, tempfile, time
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from fakes import FakeOpenAI, FakeShopify, make_catalog  # noqa: E402
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values: return 0.0
+    v = sorted(values)
+    k = (len(v) - 1) * q
+    lo = int(k); hi = min(lo + 1, len(v) - 1)
+    return v[lo] + (v[hi] - v[lo]) * (k - lo)
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    catalog = make_catalog(args.products, seed=args.seed)
+    shop = FakeShopify(catalog, gql_bucket=args.gql_bucket, gql_restore=args.gql_restore).start()
+    oai = FakeOpenAI(median=args.openai_median, sigma=args.openai_sigma, rate_429=args.openai_429).start()
+
+    os.environ.update({
+        "SHOPIFY_SCHEME": "http",
+        "OPENAI_BASE_URL": f"http://{oai.address}/v1",
+        "OPENAI_API_KEY": "bench",
+        "DELAY_SECONDS": str(args.delay),
+        "METRICS_DIR": tempfile.mkdtemp(prefix="bench-metrics-"),
+        "FAMILY_DEDUP": "true" if args.family_dedup else "false",
+    })
+    import app as seo  # na env-setup importeren: config wordt bij import gelezen
+    seo.app.config["SESSION_COOKIE_SECURE"] = False
+    client = seo.app.test_client()
+    client.post("/login", data={"username": seo.ADMIN_USERNAME, "password": seo.ADMIN_PASSWORD})
+    with client.session_transaction() as s: csrf = s["csrf_token"]
+
+    payload = {"store": shop.address, "token": "bench", "collection_ids": list(shop.collections), "txn": True}
+    started: Dict[int, float] = {}
+    per_product: List[float] = []
+    outcomes = {"ok": 0, "error": 0, "skipped": 0}
+    summary: List[str] = []
+
+    t0 = time.monotonic()
+    resp = client.post("/api/optimize", json=payload, buffered=False,
+                       headers={"X-CSRF-Token": csrf, "Accept": "application/x-ndjson"})
+    buf = ""
+    for chunk in resp.response:
+        buf += chunk.decode() if isinstance(chunk, bytes) else chunk
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            if not line.strip(): continue
+            now = time.monotonic()
+            ev = json.loads(line)
+            if args.verbose and ev.get("msg"): print(ev["msg"])
+            kind = ev["type"]
+            if kind == "product_started":
+                started.setdefault(ev["pid"], now)
+            elif kind == "product_done":
+                outcomes["error" if ev["result"] == "failed" else "ok"] += 1
+                if ev["pid"] in started: per_product.append(now - started.pop(ev["pid"]))
+            elif kind == "product_skipped":
+                outcomes["skipped"] += 1
+            elif kind in ("run_done", "latency", "error"):
+                summary.append(ev["msg"])
+    wall = time.monotonic() - t0
+    resp.close()
+
+    shop.stop(); oai.stop()
+    done = outcomes["ok"] + outcomes["error"]
+    return {
+        "products": len(catalog),
+        "outcomes": outcomes,
+        "wall_seconds": round(wall, 3),
+        "products_per_second": round(done / wall, 3) if wall else 0.0,
+        "latency_per_product": {q: round(_percentile(per_product, v), 3)
+                                for q, v in (("p50", .5), ("p95", .95), ("max", 1.0))},
+        "requests": {"shopify": dict(sorted(shop.counts.items())), "openai": dict(sorted(oai.counts.items()))},
+        "summary": summary,
+    }
+
+def _print(report: Dict[str, Any]) -> None:
+    print(f"Producten: {report['products']}  {report['outcomes']}")
+    print(f"Wandtijd:  {report['wall_seconds']}s  →  {report['products_per_second']} producten/s")
+    lat = report["latency_per_product"]
+    print(f"Per product: p50 {lat['p50']}s · p95 {lat['p95']}s · max {lat['max']}s")
+    for upstream, counts in report["requests"].items():
+        print(f"{upstream}:")
+        for k, v in counts.items(): print(f"  {v:>6}  {k}")
+    for line in report["summary"]: print(line)
+
+def main(argv: List[str] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark /api/optimize tegen lokale Shopify/OpenAI stand-ins.")
+    ap.add_argument("--products", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--delay", type=float, default=0.0, help="DELAY_SECONDS tussen producten")
+    ap.add_argument("--openai-median", type=float, default=0.2, help="mediane latency (s)")
+    ap.add_argument("--openai-sigma", type=float, default=0.5, help="spreiding (lognormaal)")
+    ap.add_argument("--openai-429", type=float, default=0.0, help="kans op 429 per request")
+    ap.add_argument("--gql-bucket", type=float, default=1000.0)
+    ap.add_argument("--gql-restore", type=float, default=50.0)
+    ap.add_argument("--no-family-dedup", dest="family_dedup", action="store_false")
+    ap.add_argument("--json", action="store_true", help="rapport als JSON")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args(argv)
+    report = run(args)
+    print(json.dumps(report, indent=2, ensure_ascii=False)) if args.json else _print(report)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())